@@ -1,6 +1,7 @@
 import os 
 
 from pathlib import Path
+from urllib.parse import quote
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -33,12 +34,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'mywebsite.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'mywebsite.middleware.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'carsoko.urls'
@@ -53,6 +56,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'mywebsite.context_processors.reference_data',
             ],
         },
     },
@@ -71,6 +75,49 @@ DATABASES = {
     }
 }
 
+# Read replicas (see mywebsite/routers.py). Listing views read from these
+# aliases; everything else uses 'default'. For a local setup, list SQLite
+# copies in CARSOKO_REPLICA_DATABASES (comma-separated paths) and keep them
+# fresh with `manage.py sync_sqlite_replicas`; with PostgreSQL, add the
+# replica connections to DATABASES and their aliases to DATABASE_REPLICAS.
+# SQLite replicas are opened read-only, so a missing copy fails its health
+# check instead of being created empty.
+DATABASE_REPLICAS = []
+for _number, _path in enumerate(filter(None, os.environ.get('CARSOKO_REPLICA_DATABASES', '').split(',')), 1):
+    DATABASES[f'replica{_number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{quote(os.path.abspath(_path))}?mode=ro",
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{_number}')
+
+DATABASE_ROUTERS = ['mywebsite.routers.PrimaryReplicaRouter']
+REPLICA_READ_VIEWS = [
+    'homepage', 'car_list', 'car_detail', 'car_detail_ajax', 'models_by_brand', 'catalog',
+]
+REPLICA_STICKY_SECONDS = 10  # reads stay on the primary this long after a write
+REPLICA_HEALTH_INTERVAL = 5  # seconds between replica probes
+REPLICA_MAX_LAG_SECONDS = 5  # PostgreSQL replay lag before a replica is ejected
+
+# Cache shared by every process: the invalidation stamps of the homepage,
+# facet index, reference data, car cards and conditional GETs only reach
+# other workers through it. A directory on the local disk serves a single
+# server; set CARSOKO_REDIS_URL (e.g. redis://127.0.0.1:6379/0) when the site
+# runs on several. Culling would drop the stamps with the data, so the entry
+# limit is well above what the site stores.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CARSOKO_CACHE_DIR', os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+if os.environ.get('CARSOKO_REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['CARSOKO_REDIS_URL'],
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -107,11 +154,59 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]  # Your custom static directory
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')    # For collectstatic (in production)
 
+# Content-hashed file names; `manage.py build_static` collects, prunes and
+# precompresses them (mywebsite.assets)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'mywebsite.assets.HashedStaticFilesStorage'},
+}
+
 # Media files (uploads like images, documents)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Scheme and host for absolute URLs built outside a request (`manage.py build_sitemaps`)
+SITE_URL = 'https://www.carsoko.com'
+
+# `manage.py optimize_media` scales uploads down to this longest edge
+MEDIA_OPTIMIZE_MAX_SIZE = 2560
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Buffered view counters (see mywebsite/counters.py)
+# 'memory' keeps pending counts per process; 'cache' keeps them in the shared
+# cache so `manage.py flush_view_counts` can write them from any process.
+VIEW_COUNTER_BUFFER = 'memory'
+VIEW_COUNTER_FLUSH_INTERVAL = 30  # seconds
+VIEW_COUNTER_BACKGROUND_FLUSH = True  # False leaves timed flushes to `manage.py flush_view_counts`
+VIEW_COUNTER_MAX_PENDING = 1000
+
+# Car image renditions (see mywebsite/images.py)
+IMAGE_RENDITIONS_ASYNC = True  # False builds renditions inline after commit
+IMAGE_RENDITIONS_WORKERS = 2
+
+# Write-behind inquiry/newsletter ingestion (see mywebsite/ingest.py)
+INGEST_SPOOL_DIR = os.path.join(BASE_DIR, 'spool')
+INGEST_SPOOL_FSYNC = True
+INGEST_BACKGROUND_FLUSH = True  # False leaves flushing to `manage.py flush_ingest_spool`
+INGEST_FLUSH_INTERVAL = 2  # seconds
+INGEST_BATCH_SIZE = 500  # records per transaction
+
+# Per-request query budgets (see mywebsite/middleware.py)
+QUERY_BUDGET_ENABLED = DEBUG
+QUERY_BUDGET_RAISE = False  # tests turn this on
+QUERY_BUDGET_REPEAT_THRESHOLD = 3  # identical query shapes before flagging N+1
+QUERY_BUDGETS = {  # steady state: reference data, facet index and homepage caches warm
+    'homepage': 12,
+    'car_list': 8,
+    'car_detail': 10,
+    'car_detail_ajax': 5,
+    'models_by_brand': 0,
+    'sitemap': 1,
+    'sitemap_cars': 1,
+    'car_feed': 1,
+    'car_feed_atom': 1,
+}
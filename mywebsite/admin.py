@@ -1,10 +1,23 @@
 from django.contrib import admin
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils.html import format_html
 from .models import (
     Brand, CarModel, Car, CarImage, Location, CarRental, 
     CustomerInquiry, BusinessConfig, Testimonial, BlogPost, 
     FAQ, CarComparison, NewsletterSubscription, ContactMessage
 )
+from . import exports
+
+# Streaming exports (see mywebsite/exports.py); "Select all" exports the
+# whole filtered changelist
+@admin.action(description="Export selected rows as CSV", permissions=['view'])
+def export_csv(modeladmin, request, queryset):
+    return exports.for_model(modeladmin.model).response(queryset, 'csv')
+
+@admin.action(description="Export selected rows as JSON Lines", permissions=['view'])
+def export_jsonl(modeladmin, request, queryset):
+    return exports.for_model(modeladmin.model).response(queryset, 'jsonl')
 
 # Brand Admin
 @admin.register(Brand)
@@ -53,7 +66,9 @@ class CarAdmin(admin.ModelAdmin):
     ]
     search_fields = ['brand__name', 'car_model__name', 'color']
     list_editable = ['price', 'status', 'is_featured']
+    list_select_related = ['brand', 'car_model', 'location', 'primary_image']
     readonly_fields = ['views_count', 'created_at', 'updated_at']
+    actions = [export_csv, export_jsonl]
     
     fieldsets = (
         ('Basic Information', {
@@ -85,6 +100,18 @@ class CarAdmin(admin.ModelAdmin):
     
     inlines = [CarImageInline, CarRentalInline]
     
+    def get_queryset(self, request):
+        # Image counts come from the list query itself so a changelist
+        # page costs the same number of queries for any row count. A
+        # correlated subquery rather than a join: the paginator's COUNT
+        # drops it and counts from an index instead of grouping every image
+        image_counts = CarImage.objects.filter(car=OuterRef('pk')).order_by().values('car').annotate(
+            count=Count('pk')
+        ).values('count')
+        return super().get_queryset(request).annotate(
+            image_count=Coalesce(Subquery(image_counts, output_field=IntegerField()), 0)
+        )
+    
     def get_car_name(self, obj):
         return f"{obj.year} {obj.brand.name} {obj.car_model.name}"
     get_car_name.short_description = 'Car'
@@ -92,17 +119,13 @@ class CarAdmin(admin.ModelAdmin):
     
     def car_image_thumbnail(self, obj):
         """Display car thumbnail in admin list"""
-        if obj.images.exists():
-            # Get the primary image first, or fall back to the first image
-            primary_image = obj.images.filter(is_primary=True).first()
-            if not primary_image:
-                primary_image = obj.images.first()
-            
-            if primary_image and primary_image.image:
-                return format_html(
-                    '<img src="{}" style="width: 60px; height: 45px; object-fit: cover; border-radius: 4px;" />',
-                    primary_image.image.url
-                )
+        # Denormalized cover image: the primary image, or else the first one
+        primary_image = obj.primary_image
+        if primary_image and primary_image.image:
+            return format_html(
+                '<img src="{}" style="width: 60px; height: 45px; object-fit: cover; border-radius: 4px;" />',
+                primary_image.thumb_url
+            )
         return format_html(
             '<div style="width: 60px; height: 45px; background-color: #f0f0f0; display: flex; align-items: center; justify-content: center; border-radius: 4px; font-size: 10px; color: #666;">No Image</div>'
         )
@@ -111,7 +134,7 @@ class CarAdmin(admin.ModelAdmin):
     
     def has_images(self, obj):
         """Show if car has images"""
-        count = obj.images.count()
+        count = obj.image_count
         if count > 0:
             return format_html(
                 '<span style="color: green; font-weight: bold;">✓ {} image{}</span>',
@@ -124,6 +147,7 @@ class CarAdmin(admin.ModelAdmin):
             )
     has_images.short_description = 'Images Status'
     has_images.allow_tags = True
+    has_images.admin_order_field = 'image_count'
 
 # Location Admin
 @admin.register(Location)
@@ -144,6 +168,7 @@ class CustomerInquiryAdmin(admin.ModelAdmin):
     search_fields = ['customer_name', 'customer_phone', 'customer_email']
     list_editable = ['status']
     readonly_fields = ['created_at', 'updated_at']
+    actions = [export_csv, export_jsonl]
     
     fieldsets = (
         ('Customer Information', {
@@ -161,9 +186,16 @@ class CustomerInquiryAdmin(admin.ModelAdmin):
         })
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            car_year=F('car__year'),
+            car_brand_name=F('car__brand__name'),
+            car_model_name=F('car__car_model__name'),
+        )
+    
     def get_car_info(self, obj):
-        if obj.car:
-            return f"{obj.car.year} {obj.car.brand.name} {obj.car.car_model.name}"
+        if obj.car_id:
+            return f"{obj.car_year} {obj.car_brand_name} {obj.car_model_name}"
         return "General Inquiry"
     get_car_info.short_description = 'Car'
 
@@ -250,6 +282,7 @@ class NewsletterSubscriptionAdmin(admin.ModelAdmin):
     list_filter = ['is_active', 'subscribed_at']
     search_fields = ['email']
     list_editable = ['is_active']
+    actions = [export_csv, export_jsonl]
 
 # Contact Message Admin
 @admin.register(ContactMessage)
@@ -277,12 +310,15 @@ class ContactMessageAdmin(admin.ModelAdmin):
 class CarComparisonAdmin(admin.ModelAdmin):
     list_display = ['get_comparison_info', 'user', 'created_at']
     list_filter = ['created_at']
+    list_select_related = ['user']
     readonly_fields = ['created_at']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(car_count=Count('cars'))
+    
     def get_comparison_info(self, obj):
-        cars = obj.cars.all()
-        if cars:
-            return f"Comparison of {cars.count()} cars"
+        if obj.car_count:
+            return f"Comparison of {obj.car_count} cars"
         return "Empty comparison"
     get_comparison_info.short_description = 'Comparison'
 
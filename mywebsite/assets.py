@@ -0,0 +1,366 @@
+"""
+Static asset pipeline: fingerprinted, precompressed files with far-future caching.
+
+``manage.py build_static`` runs ``collectstatic`` with ``HashedStaticFilesStorage``
+(the settings' staticfiles storage), which copies every file under a name
+carrying a hash of its content and rewrites stylesheet references to the
+hashed names. It then removes the files from ``STATICFILES_DIRS`` that no
+template references, directly or through a stylesheet or script, and
+writes a ``.gz`` (and, with the optional ``brotli`` package, a ``.br``)
+next to every compressible file that shrinks.
+
+``serve()`` serves ``STATIC_ROOT`` when DEBUG is off. It picks the smallest
+variant the client accepts, and marks hashed files immutable for a year: a
+changed file gets a new name. Behind nginx or a CDN the same directory can
+be served directly (``gzip_static`` / ``brotli_static``).
+
+``page_report()`` lists, per page, the static bytes the page pulls in and
+how much the precompressed variants save.
+"""
+import gzip
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.template.autoreload import get_template_directories
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Text formats worth compressing (images and woff/woff2 fonts already are)
+COMPRESSIBLE_EXTENSIONS = {
+    '.css', '.js', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico', '.ttf', '.otf', '.eot',
+}
+# A variant is only kept if it is at least this much smaller
+MIN_COMPRESSION_RATIO = 0.95
+
+# Content-Encoding -> file suffix, best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+STATIC_TAG = re.compile(r"""{%\s*static\s+['"]([^'"]+)['"]\s*%}""")
+CSS_URL = re.compile(r"""url\(\s*['"]?([^'")]+?)['"]?\s*\)""")
+SOURCE_MAP = re.compile(r"""[#@]\s*sourceMappingURL=(\S+?)(?:\s*\*/)?\s*$""", re.MULTILINE)
+# String literals in scripts that look like static file paths
+JS_PATH = re.compile(
+    r"""['"`]([^'"`\s?#]+\.(?:png|jpe?g|gif|webp|svg|ico|json|css|js|woff2?|ttf|otf|eot|mp4|webm))[?#'"`]""",
+    re.IGNORECASE,
+)
+
+
+class HashedStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that tolerates references to files that don't exist
+
+    The theme's stylesheets point at a few images it doesn't ship, and the
+    templates at some icons that were never added; those keep their plain
+    names instead of failing ``collectstatic``. Files missing from the
+    manifest (a checkout that was never collected, e.g. in tests) are
+    served under their plain names too.
+    """
+
+    def url_converter(self, name, hashed_files, template=None):
+        converter = super().url_converter(name, hashed_files, template)
+
+        def convert(matchobj):
+            try:
+                return converter(matchobj)
+            except ValueError:
+                missing = (name, matchobj['url'])
+                if missing not in self._missing:
+                    self._missing.add(missing)
+                    logger.warning("%s refers to missing file %s; left as is", *missing)
+                return matchobj[0]
+        return convert
+
+    def post_process(self, *args, **kwargs):
+        self._missing = set()
+        yield from super().post_process(*args, **kwargs)
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+# ----------------------------------------------------------------------
+# Referenced assets
+# ----------------------------------------------------------------------
+
+def template_references():
+    """
+    Static names used by ``{% static %}`` or a literal STATIC_URL path in
+    any template
+    """
+    literal = re.compile(r"""["'(]%s([^"'()?#\s]+)""" % re.escape(settings.STATIC_URL))
+    names = set()
+    for directory in get_template_directories():
+        for path in directory.rglob('*.html'):
+            text = path.read_text(errors='ignore')
+            names.update(STATIC_TAG.findall(text))
+            names.update(literal.findall(text))
+    return names
+
+
+def _linked(name, content):
+    """
+    Files a stylesheet or script refers to, as static names
+    """
+    text = content.decode('utf-8', errors='ignore')
+    targets = SOURCE_MAP.findall(text)
+    linked = set()
+    if name.endswith('.css'):
+        targets += CSS_URL.findall(text)
+    else:
+        for target in JS_PATH.findall(text):
+            path = unquote(urlsplit(target).path)
+            if path.startswith(settings.STATIC_URL):
+                linked.add(path.removeprefix(settings.STATIC_URL))
+            elif not target.startswith(('data:', '/', 'http:', 'https:')):
+                # A script's URLs resolve against the page, not the script:
+                # keep the path as a static name and relative to the script
+                linked.add(posixpath.normpath(path))
+                targets.append(target)
+    for target in targets:
+        if target.startswith(('data:', '#', '/', 'http:', 'https:')):
+            continue
+        path = unquote(urlsplit(target).path)
+        if path:
+            linked.add(posixpath.normpath(posixpath.join(posixpath.dirname(name), path)))
+    # Paths climbing out of the static tree name no static file
+    return {path for path in linked if not path.startswith('../') and path != '..'}
+
+
+def with_dependencies(names, read):
+    """
+    ``names`` plus everything their stylesheets, scripts and source maps
+    link to.
+    ``read(name)`` returns a file's bytes, or None if it doesn't exist.
+    """
+    found = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name in found:
+            continue
+        content = read(name)
+        if content is None:
+            continue
+        found.add(name)
+        if name.endswith(('.css', '.js')):
+            pending.extend(_linked(name, content))
+    return found
+
+
+def _read_source(name):
+    path = finders.find(name)
+    if path is None:
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def referenced_assets():
+    """
+    Source names of every static file a page can load
+    """
+    return with_dependencies(template_references(), _read_source)
+
+
+# ----------------------------------------------------------------------
+# Build steps (run after collectstatic)
+# ----------------------------------------------------------------------
+
+def prune(keep, storage=staticfiles_storage):
+    """
+    Delete the collected copies of project files (``STATICFILES_DIRS``)
+    not in ``keep``; app files (the admin's) are left alone. Returns the
+    number of source files removed.
+    """
+    project_files = {
+        name for finder in finders.get_finders() if isinstance(finder, finders.FileSystemFinder)
+        for name, _ in finder.list([])
+    }
+    removed = 0
+    for name in sorted(project_files - keep):
+        hashed = storage.hashed_files.pop(storage.hash_key(name), None)
+        for stored in {name, hashed} - {None}:
+            for suffix in [''] + [suffix for _, suffix in ENCODINGS]:
+                if storage.exists(stored + suffix):
+                    storage.delete(stored + suffix)
+        removed += 1
+    storage.save_manifest()
+    for directory, _, _ in os.walk(storage.location, topdown=False):
+        if directory != storage.location and not os.listdir(directory):
+            os.rmdir(directory)
+    return removed
+
+
+def compress_file(path):
+    """
+    Write the .gz/.br variants of one file that are worth keeping; returns
+    how many were written
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    written = 0
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(content) * MIN_COMPRESSION_RATIO:
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            written += 1
+    return written
+
+
+def compress_all(root=None):
+    """
+    Precompress every compressible file under STATIC_ROOT
+    """
+    written = 0
+    for directory, _, filenames in os.walk(root or settings.STATIC_ROOT):
+        for filename in filenames:
+            if os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                written += compress_file(os.path.join(directory, filename))
+    return written
+
+
+# ----------------------------------------------------------------------
+# Serving
+# ----------------------------------------------------------------------
+
+def accepted_encodings(request):
+    """
+    The content codings the client's Accept-Encoding allows
+    """
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+_hashed_names = (None, frozenset())
+
+
+def is_hashed(name):
+    """
+    True if ``name`` is a fingerprinted name from the manifest
+    """
+    global _hashed_names
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', {})
+    if _hashed_names[0] is not hashed_files:
+        _hashed_names = (hashed_files, frozenset(hashed_files.values()) - set(hashed_files))
+    return name in _hashed_names[1]
+
+
+def serve(request, path):
+    """
+    A file from STATIC_ROOT, precompressed if the client accepts it
+    """
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+
+    encoding = None
+    served = fullpath
+    accepted = accepted_encodings(request)
+    for name, suffix in ENCODINGS:
+        if name in accepted and os.path.isfile(fullpath + suffix):
+            encoding, served = name, fullpath + suffix
+            break
+
+    stat = os.stat(served)
+    if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+        response = FileResponse(open(served, 'rb'), content_type=content_type, filename=os.path.basename(fullpath))
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ['Accept-Encoding'])
+    if is_hashed(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+# ----------------------------------------------------------------------
+# Report
+# ----------------------------------------------------------------------
+
+def page_assets(html):
+    """
+    Static names a rendered page loads (its tags plus what they link to)
+    """
+    url = re.compile(r"""(?:src|href|data-setbg)=["']%s([^"'?#]+)""" % re.escape(settings.STATIC_URL))
+    return with_dependencies(url.findall(html), _read_collected)
+
+
+def _read_collected(name):
+    try:
+        path = safe_join(settings.STATIC_ROOT, name)
+    except SuspiciousFileOperation:
+        return None
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _size(path):
+    return os.path.getsize(path) if os.path.isfile(path) else None
+
+
+def page_report(pages):
+    """
+    Per page ({name: rendered html}): files, identity bytes, and the bytes
+    sent to gzip and brotli clients using the precompressed variants
+    """
+    report = {}
+    for page, html in pages.items():
+        totals = {'files': 0, 'identity': 0, 'gzip': 0, 'br': 0}
+        for name in page_assets(html):
+            path = os.path.join(settings.STATIC_ROOT, name)
+            identity = _size(path)
+            gz = _size(path + '.gz') or identity
+            br = _size(path + '.br') or gz
+            totals['files'] += 1
+            totals['identity'] += identity
+            totals['gzip'] += gz
+            totals['br'] += min(br, gz)
+        totals['saved'] = totals['identity'] - totals['br']
+        report[page] = totals
+    return report
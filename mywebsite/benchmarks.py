@@ -0,0 +1,495 @@
+"""
+View-level performance benchmarks.
+
+Drives the public views through the Django test client and records, per
+scenario, the number of SQL queries, the median wall time and the peak
+Python memory allocated while serving the request. ``manage.py
+benchmark_views`` seeds a throwaway test database, runs every scenario and
+writes the results to a JSON baseline; with ``--compare`` it fails when a
+view regresses against an earlier baseline.
+
+Scenarios are measured warm: each one is requested once before timing, so
+per-process caches (facet index, homepage bundle) are already built.
+
+``throughput()`` compares the same read-only endpoints served through
+Django's WSGI handler (a thread per in-flight request) and its ASGI handler
+(asyncio tasks on one event loop) at a given concurrency. Requests are fed
+to the handlers in-process, so the numbers are the framework and view cost
+without a server or network in front; ``manage.py benchmark_concurrency``
+runs it on a seeded test database.
+
+``full_scans()`` runs scenarios through the same client, asks SQLite for the plan of
+every query they issue (``EXPLAIN QUERY PLAN``) and reports each full table
+scan of the large tables (``PLAN_GUARDED_TABLES``), so a lost index or a new
+unindexed query shape fails the test suite.
+
+``card_cache()`` times a 30-card ``car_list`` page with the card fragment
+cache cold (dropped before every request) and warm; ``manage.py
+benchmark_card_cache`` runs it on a seeded test database.
+
+``export_throughput()`` streams one of the ``mywebsite.exports`` exports and
+reports rows per second and the peak Python memory it allocated.
+"""
+import asyncio
+import gc
+import itertools
+import platform
+import re
+import statistics
+import time
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlencode
+
+import django
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from . import cards, exports
+from .models import Car
+
+Scenario = namedtuple('Scenario', 'name method path data')
+
+CAR_LIST_FILTERS = {
+    'all': {},
+    'brand': {'brand': None},
+    'model': {'model': None},
+    'body_type': {'body_type': 'suv'},
+    'condition': {'condition': 'used_foreign'},
+    'transmission': {'transmission': 'automatic'},
+    'fuel_type': {'fuel_type': 'petrol'},
+    'price': {'min_price': '1000000', 'max_price': '4000000'},
+    'keyword': {'q': None},
+    'combined': {'brand': None, 'transmission': 'automatic', 'min_price': '1000000'},
+}
+CAR_LIST_SORTS = ['-created_at', 'created_at', 'price', '-price', 'year', '-year', 'relevance']
+CAR_LIST_PER_PAGE = ['9', '60', 'all']
+
+# Timing jitter below this many milliseconds is never a regression
+MIN_TIME_SLACK_MS = 2.0
+
+
+def build_scenarios():
+    """
+    Every benchmarked request, using rows from the current database
+    """
+    car = Car.objects.select_related('brand', 'car_model').order_by('pk').first()
+    if car is None:
+        raise ValueError("The benchmark database has no cars")
+    brand, car_model = car.brand, car.car_model
+
+    samples = {'brand': brand.slug, 'model': str(car_model.pk), 'q': car_model.name}
+    scenarios = [
+        Scenario('homepage', 'get', reverse('homepage'), {}),
+        Scenario('homepage:search', 'get', reverse('homepage'),
+                 {'search': '1', 'brand': str(brand.pk), 'keyword': car_model.name}),
+    ]
+
+    for (filter_name, params), sort, per_page in itertools.product(
+            CAR_LIST_FILTERS.items(), CAR_LIST_SORTS, CAR_LIST_PER_PAGE):
+        if sort == 'relevance' and 'q' not in params:
+            continue
+        data = {key: value if value is not None else samples[key] for key, value in params.items()}
+        data.update(sort=sort, per_page=per_page)
+        scenarios.append(Scenario(
+            f"car_list:{filter_name}:{sort}:{per_page}", 'get', reverse('car_list'), data
+        ))
+
+    scenarios += [
+        Scenario('car_detail', 'get', reverse('car_detail', args=[car.slug]), {}),
+        Scenario('car_detail_ajax', 'get', reverse('car_detail_ajax', args=[car.pk]), {}),
+        Scenario('get_models_by_brand', 'get', reverse('models_by_brand'), {'brand_id': str(brand.pk)}),
+        Scenario('submit_inquiry', 'post', reverse('submit_inquiry'), {
+            'car_id': str(car.pk),
+            'inquiry_type': 'purchase',
+            'customer_name': 'Benchmark',
+            'customer_phone': '0700000000',
+            'message': 'Is this car still available?',
+        }),
+        Scenario('newsletter_subscribe', 'post', reverse('newsletter_subscribe'), {'email': None}),
+    ]
+    return scenarios
+
+
+def _request(client, scenario, iteration):
+    data = dict(scenario.data)
+    if 'email' in data:
+        # A new address each time so every request takes the insert path
+        data['email'] = f"benchmark-{iteration}@example.com"
+    return getattr(client, scenario.method)(scenario.path, data)
+
+
+def measure(client, scenario, repeats=5):
+    """
+    Query count, median wall time and peak traced memory for one scenario
+    """
+    iteration = itertools.count()
+    response = _request(client, scenario, next(iteration))  # warm up
+
+    timings = []
+    for _ in range(repeats):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = _request(client, scenario, next(iteration))
+            timings.append((time.perf_counter() - started) * 1000)
+        # captured_queries reads the live log, which the next request resets
+        query_count = len(queries.captured_queries)
+
+    # Memory is traced in a separate run; tracemalloc skews timings
+    gc.collect()
+    tracemalloc.start()
+    try:
+        _request(client, scenario, next(iteration))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'queries': query_count,
+        'time_ms': round(statistics.median(timings), 3),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def run(repeats=5, scenarios=None, progress=None):
+    """
+    Measure every scenario and return a baseline dict
+    """
+    client = Client()
+    results = {}
+    for scenario in scenarios or build_scenarios():
+        results[scenario.name] = measure(client, scenario, repeats)
+        if progress:
+            progress(scenario.name, results[scenario.name])
+    return {
+        'meta': {
+            'cars': Car.objects.count(),
+            'repeats': repeats,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+        },
+        'views': results,
+    }
+
+
+def compare(baseline, current, threshold=0.25):
+    """
+    Regressions of ``current`` against ``baseline`` as readable strings.
+
+    Any extra query is a regression. Time and memory regress when they grow
+    by more than ``threshold`` (a fraction) of the baseline.
+    """
+    regressions = []
+    for name, before in baseline['views'].items():
+        after = current['views'].get(name)
+        if after is None:
+            continue
+        if after['status'] != before['status']:
+            regressions.append(f"{name}: status {before['status']} -> {after['status']}")
+        if after['queries'] > before['queries']:
+            regressions.append(f"{name}: queries {before['queries']} -> {after['queries']}")
+        time_limit = max(before['time_ms'] * (1 + threshold), before['time_ms'] + MIN_TIME_SLACK_MS)
+        if after['time_ms'] > time_limit:
+            regressions.append(f"{name}: time {before['time_ms']}ms -> {after['time_ms']}ms")
+        if after['peak_kib'] > before['peak_kib'] * (1 + threshold):
+            regressions.append(f"{name}: peak memory {before['peak_kib']}KiB -> {after['peak_kib']}KiB")
+    return regressions
+
+
+# ----------------------------------------------------------------------
+# Query plans
+# ----------------------------------------------------------------------
+
+# Tables that grow with the inventory; reading them must use an index
+PLAN_GUARDED_TABLES = ('mywebsite_car', 'mywebsite_carimage', 'mywebsite_customerinquiry')
+
+# Table (and optional alias) after FROM/JOIN in Django's quoted SQL
+TABLE_REFERENCE = re.compile(r'(?:FROM|JOIN)\s+"(\w+)"(?:\s+(?:AS\s+)?"?(\w+)"?)?', re.IGNORECASE)
+# "SCAN t" / "SCAN TABLE t" (SQLite < 3.36), without "USING ... INDEX"
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+
+
+def query_plan(sql):
+    """
+    SQLite's plan for an executed query, one detail line per step
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def scanned_tables(sql, plan):
+    """
+    Tables the plan reads row by row without an index
+    """
+    aliases = {}
+    for table, alias in TABLE_REFERENCE.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    tables = []
+    for detail in plan:
+        match = FULL_SCAN.match(detail)
+        if match:
+            tables.append(aliases.get(match.group(1), match.group(1)))
+    return tables
+
+
+def full_scans(scenarios, client=None, tables=PLAN_GUARDED_TABLES):
+    """
+    Run every scenario once and return {scenario name: [(table, sql), ...]}
+    for each full scan of ``tables``. Per-process caches are left as they
+    are, so the caller decides which cold paths are checked.
+    """
+    client = client or Client()
+    found = {}
+    for iteration, scenario in enumerate(scenarios):
+        with CaptureQueriesContext(connection) as queries:
+            _request(client, scenario, iteration)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            for table in scanned_tables(sql, query_plan(sql)):
+                if table in tables:
+                    found.setdefault(scenario.name, []).append((table, sql))
+    return found
+
+
+# ----------------------------------------------------------------------
+# Sync (WSGI) vs async (ASGI) throughput
+# ----------------------------------------------------------------------
+
+def build_throughput_scenarios():
+    """
+    Read-only async endpoints; SQLite serialises writes, which would
+    measure lock waits rather than the handlers
+    """
+    car = Car.objects.filter(status='available').order_by('pk').first()
+    if car is None:
+        raise ValueError("The benchmark database has no available cars")
+    return [
+        Scenario('car_detail_ajax', 'get', reverse('car_detail_ajax', args=[car.pk]), {}),
+        Scenario('get_models_by_brand', 'get', reverse('models_by_brand'), {'brand_id': str(car.brand_id)}),
+    ]
+
+
+def _wsgi_environ(scenario):
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': scenario.path,
+        'QUERY_STRING': urlencode(scenario.data),
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': BytesIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def _asgi_scope(scenario):
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': scenario.path,
+        'raw_path': scenario.path.encode(),
+        'query_string': urlencode(scenario.data).encode(),
+        'root_path': '',
+        'headers': [(b'host', b'testserver')],
+        'client': ('127.0.0.1', 50000),
+        'server': ('testserver', 80),
+    }
+
+
+def wsgi_throughput(scenario, concurrency, requests):
+    """
+    Requests per second through the WSGI handler with ``concurrency`` threads
+    """
+    handler = WSGIHandler()
+    statuses = []
+
+    def one(_):
+        def start_response(status, headers, exc_info=None):
+            statuses.append(int(status.split()[0]))
+        response = handler(_wsgi_environ(scenario), start_response)
+        try:
+            b''.join(response)
+        finally:
+            response.close()
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(concurrency)))  # warm up every thread
+        statuses.clear()
+        started = time.perf_counter()
+        list(pool.map(one, range(requests)))
+        elapsed = time.perf_counter() - started
+    return requests / elapsed, statuses
+
+
+def asgi_throughput(scenario, concurrency, requests):
+    """
+    Requests per second through the ASGI handler with ``concurrency``
+    requests in flight on one event loop
+    """
+    handler = ASGIHandler()
+    statuses = []
+
+    async def one():
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The handler listens for a disconnect until the response is sent
+            await asyncio.Future()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+        await handler(_asgi_scope(scenario), receive, send)
+
+    async def batch(count):
+        slots = asyncio.Semaphore(concurrency)
+
+        async def limited():
+            async with slots:
+                await one()
+        await asyncio.gather(*(limited() for _ in range(count)))
+
+    async def main():
+        await batch(concurrency)  # warm up
+        statuses.clear()
+        started = time.perf_counter()
+        await batch(requests)
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(main())
+    return requests / elapsed, statuses
+
+
+def throughput(concurrency_levels, requests=500, scenarios=None, progress=None):
+    """
+    WSGI vs ASGI requests per second for every scenario and concurrency level
+    """
+    results = {}
+    # The query budget middleware is a development tool and forces async
+    # views back onto the thread pool; measure the production stack
+    with override_settings(QUERY_BUDGET_ENABLED=False):
+        for scenario in scenarios or build_throughput_scenarios():
+            results[scenario.name] = {}
+            for concurrency in concurrency_levels:
+                result = {}
+                for name, measure_handler in (('wsgi', wsgi_throughput), ('asgi', asgi_throughput)):
+                    rps, statuses = measure_handler(scenario, concurrency, requests)
+                    result[f'{name}_rps'] = round(rps, 1)
+                    result[f'{name}_errors'] = sum(1 for status in statuses if status >= 500)
+                result['speedup'] = round(result['asgi_rps'] / result['wsgi_rps'], 2)
+                results[scenario.name][str(concurrency)] = result
+                if progress:
+                    progress(scenario.name, concurrency, result)
+    return {
+        'meta': {
+            'cars': Car.objects.count(),
+            'requests': requests,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+        },
+        'views': results,
+    }
+
+
+# ----------------------------------------------------------------------
+# Card fragment cache
+# ----------------------------------------------------------------------
+
+def _timed_requests(client, path, data, repeats, before=None):
+    timings = []
+    for _ in range(repeats):
+        if before:
+            before()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(path, data)
+            timings.append((time.perf_counter() - started) * 1000)
+        query_count = len(queries.captured_queries)
+    return {
+        'status': response.status_code,
+        'queries': query_count,
+        'time_ms': round(statistics.median(timings), 3),
+    }
+
+
+def card_cache(per_page=30, repeats=20):
+    """
+    Median car_list time with every card rendered (cold) and with every
+    card served from the fragment cache (warm)
+    """
+    client = Client()
+    path, data = reverse('car_list'), {'per_page': str(per_page)}
+    client.get(path, data)  # facet index, reference data
+    results = {
+        'cold': _timed_requests(client, path, data, repeats, before=cards.invalidate),
+        'warm': _timed_requests(client, path, data, repeats),
+    }
+    results['speedup'] = round(results['cold']['time_ms'] / results['warm']['time_ms'], 2)
+    return {
+        'meta': {
+            'cars': Car.objects.count(),
+            'cards': per_page,
+            'repeats': repeats,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+        },
+        'card_cache': results,
+    }
+
+
+def export_throughput(name, format='csv', queryset=None):
+    """
+    Rows per second and peak memory (KB) of streaming one export; timed
+    and memory-traced in separate passes, since tracing slows it down
+    """
+    export = exports.EXPORTS[name]
+    rows = (queryset if queryset is not None else export.model.objects.all()).count()
+
+    started = time.perf_counter()
+    size = sum(len(chunk) for chunk in export.stream(queryset, format))
+    elapsed = time.perf_counter() - started
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for _ in export.stream(queryset, format):
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'export': name,
+        'format': format,
+        'rows': rows,
+        'characters': size,
+        'time_ms': round(elapsed * 1000, 3),
+        'rows_per_sec': round(rows / elapsed) if elapsed else None,
+        'peak_kb': round(peak / 1024, 1),
+    }
@@ -0,0 +1,104 @@
+"""
+Cached car cards.
+
+The listing card of a car is rendered from ``cars/cards/<variant>.html``
+(``list`` on the car list, ``home`` on the homepage) by the ``car_cards``
+template tag and cached per car and variant, so a page only renders the
+cards of cars that changed since it was last served.
+
+A card's key is built from everything it shows:
+
+* ``Car.updated_at`` - bumped on every save, and by
+  ``conditional.touch_car()`` when the car's images or rental change;
+* the primary image and its renditions, which are rebuilt in the background;
+* the rental's ``updated_at``;
+* the reference data version, for brand and model names;
+* the card template itself, so changed markup is never served stale.
+
+Cards for a page are fetched with one ``get_many`` and the missing ones
+stored with one ``set_many``. ``invalidate()`` drops every card.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from . import reference
+
+VARIANTS = {
+    'list': 'cars/cards/list.html',
+    'home': 'cars/cards/home.html',
+}
+
+VERSION_KEY = 'mywebsite:cards:version'
+# Keys change with the car, so entries only need to expire to free memory
+CACHE_TIMEOUT = 24 * 60 * 60
+
+_fingerprints = {}
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+        cache.incr(VERSION_KEY)
+
+
+def _fingerprint(template):
+    """
+    Hash of a card template's source, recomputed when the loader reloads it
+    """
+    name = template.origin.name
+    cached = _fingerprints.get(name)
+    if cached is None or cached[0] is not template:
+        cached = (template, hashlib.md5(template.template.source.encode()).hexdigest()[:12])
+        _fingerprints[name] = cached
+    return cached[1]
+
+
+def _rental_updated_at(car):
+    # rental_info is select_related by every listing, so this runs no query
+    try:
+        return car.rental_info.updated_at
+    except ObjectDoesNotExist:
+        return None
+
+
+def card_key(car, variant, stamp):
+    image = car.primary_image
+    parts = (
+        car.pk, car.updated_at, car.primary_image_id,
+        image.renditions if image else None, _rental_updated_at(car),
+    )
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f"mywebsite:card:{variant}:{stamp}:{car.pk}:{digest}"
+
+
+def render_cards(cars, variant):
+    """
+    The cards of ``cars`` in order, from the cache where possible
+    """
+    template = get_template(VARIANTS[variant])
+    stamp = f"{_version()}.{reference.version()}.{_fingerprint(template)}"
+    keys = [card_key(car, variant, stamp) for car in cars]
+    cached = cache.get_many(keys)
+
+    rendered = {}
+    for key, car in zip(keys, cars):
+        if key not in cached and key not in rendered:
+            rendered[key] = template.render({'car': car})
+    if rendered:
+        cache.set_many(rendered, CACHE_TIMEOUT)
+    cached.update(rendered)
+    return mark_safe(''.join(cached[key] for key in keys))
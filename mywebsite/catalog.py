@@ -0,0 +1,92 @@
+"""
+Versioned brand -> models catalog for the search forms.
+
+One JSON document lists every brand, car model and body type with the
+number of available cars, so the brand/model dropdowns are filled in the
+browser without a request per brand change. It is served at a URL that
+contains a hash of its content (``catalog_url`` in every template), with
+immutable caching: a browser downloads each version once, and any change
+to the brands, models or inventory counts produces a new URL.
+
+The document is built from the reference data cache and the materialized
+inventory stats (at most one query), and rebuilt in-process when either
+the reference data or the inventory version changes.
+``ajax/models-by-brand/`` remains as the fallback.
+"""
+import hashlib
+import json
+import threading
+from collections import Counter
+
+from django.urls import reverse
+
+from . import conditional, reference, stats
+from .models import CarModel
+from .routers import use_primary
+
+
+class Catalog:
+    def __init__(self, key, data):
+        self.key = key
+        self.content = json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+        self.digest = hashlib.sha256(self.content).hexdigest()[:16]
+
+
+def build():
+    """
+    The catalog document as plain data
+    """
+    inventory = stats.snapshot()
+
+    def available(dimension, value):
+        stat = inventory[dimension].get(value)
+        return stat.available if stat else 0
+
+    models = []
+    body_type_counts = Counter()
+    for car_model in reference.car_models():
+        count = available('car_model', car_model.id)
+        body_type_counts[car_model.body_type] += count
+        models.append({
+            'id': car_model.id,
+            'brand': car_model.brand_id,
+            'name': car_model.name,
+            'body_type': car_model.body_type,
+            'count': count,
+        })
+
+    return {
+        'brands': [
+            {'id': brand.id, 'slug': brand.slug, 'name': brand.name, 'count': available('brand', brand.id)}
+            for brand in reference.brands()
+        ],
+        'models': models,
+        'body_types': [
+            {'value': value, 'label': str(label), 'count': body_type_counts[value]}
+            for value, label in CarModel._meta.get_field('body_type').choices
+        ],
+    }
+
+
+_lock = threading.Lock()
+_current = None
+
+
+def current():
+    """
+    The up-to-date catalog, rebuilt if the reference data or inventory changed
+    """
+    global _current
+    key = (reference.version(), conditional.inventory_version())
+    catalog = _current
+    if catalog is not None and catalog.key == key:
+        return catalog
+    with _lock:
+        if _current is None or _current.key != key:
+            with use_primary():
+                _current = Catalog(key, build())
+        return _current
+
+
+def url():
+    return reverse('catalog', args=[current().digest])
@@ -0,0 +1,206 @@
+"""
+Conditional GET (ETag / Last-Modified) for the car pages and AJAX endpoints.
+
+Each view gets a cheap validator that is checked before the view runs, so an
+unchanged resource is answered with 304 Not Modified without loading the
+car's related rows or touching the template engine:
+
+* ``car_detail_ajax`` - one query for the car's ``updated_at``, status and
+  its rental's ``updated_at``. CarImage changes (and rental deletion) touch
+  ``Car.updated_at`` through ``touch_car()``, so this covers the gallery too.
+* ``car_detail`` - the same plus the inventory version, because the page
+  also lists similar cars and cars from the same location.
+* ``car_list`` - the inventory version only (no SQL).
+* ``models_by_brand`` - the reference data version only (no SQL).
+* the car feeds and sitemap index - the inventory version (no SQL); each
+  sitemap shard has its own validator in ``mywebsite.sitemaps``.
+
+The inventory version is a stamp in the shared Django cache, bumped by the
+signal handlers in ``mywebsite.signals`` (and the bulk management commands)
+whenever a car, its images or its rental change. Every ETag also includes
+an epoch stored in the same cache, so restarting a local-memory cache can
+never bring an old version number (and a stale 304) back.
+"""
+import hashlib
+import time
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from . import reference
+from .models import Car
+
+VERSION_KEY = 'mywebsite:inventory:version'
+EPOCH_KEY = 'mywebsite:conditional:epoch'
+
+# Browsers and shared proxies may store the pages but must revalidate them
+CACHE_CONTROL = {'public': True, 'no_cache': True}
+
+
+def _get_or_add(key, default):
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, default, None)
+        value = cache.get(key)
+    return value
+
+
+def inventory_version():
+    return _get_or_add(VERSION_KEY, 0)
+
+
+def _bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 0, None)
+        cache.incr(VERSION_KEY)
+
+
+def invalidate():
+    """
+    Mark every inventory page changed (called from signals and commands)
+    """
+    _bump()
+    # Bump again once committed, or a page rendered from the uncommitted
+    # state would keep the new version's ETag
+    transaction.on_commit(_bump)
+
+
+def touch_car(car_id):
+    """
+    Record a change to a car's images or rental on the car itself
+    """
+    Car.objects.filter(pk=car_id).update(updated_at=timezone.now())
+    invalidate()
+
+
+def make_etag(*parts):
+    parts = (_get_or_add(EPOCH_KEY, time.time_ns()),) + parts
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def car_validator(request, **lookup):
+    """
+    The fields a car's validators are built from (one query, memoized on the
+    request since Django asks for the ETag and Last-Modified separately)
+    """
+    if not hasattr(request, '_car_validator'):
+        request._car_validator = _validator_queryset(lookup).first()
+    return request._car_validator
+
+
+async def acar_validator(request, **lookup):
+    if not hasattr(request, '_car_validator'):
+        request._car_validator = await _validator_queryset(lookup).afirst()
+    return request._car_validator
+
+
+def _validator_queryset(lookup):
+    return Car.objects.filter(**lookup).values('id', 'status', 'updated_at', 'rental_info__updated_at')
+
+
+def _last_modified(car):
+    return max(filter(None, [car['updated_at'], car['rental_info__updated_at']]))
+
+
+# Validators, called as Django's condition() etag_func / last_modified_func
+
+def car_detail_etag(request, slug):
+    car = car_validator(request, slug=slug)
+    if car is None:
+        return None
+    return make_etag(
+        'car_detail', car['id'], car['status'], car['updated_at'], car['rental_info__updated_at'],
+        inventory_version(), reference.version()
+    )
+
+
+def car_detail_ajax_etag(request, car_id):
+    car = car_validator(request, pk=car_id)
+    if car is None:
+        return None
+    return make_etag(
+        'car_detail_ajax', car['id'], car['status'], car['updated_at'], car['rental_info__updated_at'],
+        reference.version()
+    )
+
+
+def car_detail_ajax_last_modified(request, car_id):
+    car = car_validator(request, pk=car_id)
+    return _last_modified(car) if car else None
+
+
+async def load_quick_view(request, car_id):
+    await acar_validator(request, pk=car_id)
+
+
+def car_list_etag(request):
+    return make_etag('car_list', inventory_version(), reference.version())
+
+
+def models_by_brand_etag(request):
+    return make_etag('models_by_brand', reference.version())
+
+
+def car_feed_etag(request):
+    return make_etag('car_feed', request.path, inventory_version(), reference.version())
+
+
+def sitemap_etag(request):
+    return make_etag('sitemap', request.get_host(), inventory_version())
+
+
+def conditional_view(etag_func, last_modified_func=None, not_modified=None, load=None):
+    """
+    ``condition()`` plus revalidation Cache-Control headers. ``not_modified``
+    is called with the view arguments when a 304 is returned (e.g. to still
+    count a page view).
+
+    Async views may not run the ORM inside the (synchronous) validator
+    functions: pass ``load``, a coroutine function that fetches what they
+    need with the async ORM first, and an async ``not_modified``.
+    """
+    def decorator(view):
+        conditional = cache_control(**CACHE_CONTROL)(condition(etag_func, last_modified_func)(view))
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if load is not None:
+                    await load(request, *args, **kwargs)
+                response = await conditional(request, *args, **kwargs)
+                if response.status_code == 304 and not_modified is not None:
+                    await not_modified(request, *args, **kwargs)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            if response.status_code == 304 and not_modified is not None:
+                not_modified(request, *args, **kwargs)
+            return response
+        return wrapper
+    return decorator
+
+
+def count_car_view(request, *args, **kwargs):
+    """
+    Count a revalidated car page as a view, like a full render would
+    """
+    car = getattr(request, '_car_validator', None)
+    if car:
+        Car(pk=car['id']).increment_views()
+
+
+async def count_quick_view(request, *args, **kwargs):
+    # The quick view only counts (and shows) available cars
+    car = getattr(request, '_car_validator', None)
+    if car and car['status'] == 'available':
+        await Car(pk=car['id']).aincrement_views()
@@ -0,0 +1,15 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import catalog, reference
+
+
+def reference_data(request):
+    """
+    Business details and the brand/model catalog URL for every template,
+    served from the reference cache. Lazy, so pages that never use them
+    (e.g. the admin) don't load them.
+    """
+    return {
+        'business_config': SimpleLazyObject(reference.business_config),
+        'catalog_url': SimpleLazyObject(catalog.url),
+    }
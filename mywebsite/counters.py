@@ -0,0 +1,253 @@
+"""
+Write-behind view counters.
+
+``Car.increment_views()`` and ``BlogPost.increment_views()`` no longer write
+to the database on every page view. Increments are accumulated in a buffer
+and flushed as batched ``UPDATE ... SET views_count = views_count + n``
+statements, so concurrent views are never lost and the read path does not
+take the SQLite write lock.
+
+Two buffers are available, selected with ``settings.VIEW_COUNTER_BUFFER``:
+
+* ``'memory'`` (default) - per-process dict, flushed by the process itself.
+* ``'cache'`` - pending counts live in the shared Django cache so any
+  process (e.g. ``manage.py flush_view_counts`` from cron) can flush them.
+
+A buffer is flushed once ``VIEW_COUNTER_MAX_PENDING`` objects are pending,
+every ``VIEW_COUNTER_FLUSH_INTERVAL`` seconds by a daemon thread started with
+the first recorded view (``VIEW_COUNTER_BACKGROUND_FLUSH``), and drained at
+interpreter exit.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .routers import use_primary
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'mywebsite:views:pending'
+LOCK_KEY = 'mywebsite:views:lock'
+
+
+class MemoryBuffer:
+    """
+    Pending increments held in this process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = Counter()
+
+    def add(self, key, amount):
+        with self._lock:
+            self._pending[key] += amount
+            return len(self._pending)
+
+    def take(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        return pending
+
+    def restore(self, pending):
+        with self._lock:
+            self._pending.update(pending)
+
+
+class CacheBuffer:
+    """
+    Pending increments held in the shared Django cache.
+
+    Access to the pending dict is serialised with a short ``cache.add``
+    lock. If the lock cannot be taken the increment is written straight to
+    the database so it is never dropped.
+    """
+
+    lock_timeout = 5
+    lock_attempts = 50
+
+    def _acquire(self):
+        for _ in range(self.lock_attempts):
+            if cache.add(LOCK_KEY, 1, self.lock_timeout):
+                return True
+            time.sleep(0.002)
+        return False
+
+    def _release(self):
+        cache.delete(LOCK_KEY)
+
+    def add(self, key, amount):
+        if not self._acquire():
+            _write({key: amount})
+            return 0
+        try:
+            pending = cache.get(PENDING_KEY) or {}
+            pending[key] = pending.get(key, 0) + amount
+            cache.set(PENDING_KEY, pending, None)
+            return len(pending)
+        finally:
+            self._release()
+
+    def take(self):
+        if not self._acquire():
+            return Counter()
+        try:
+            pending = cache.get(PENDING_KEY) or {}
+            cache.delete(PENDING_KEY)
+        finally:
+            self._release()
+        return Counter(pending)
+
+    def restore(self, pending):
+        for key, amount in pending.items():
+            self.add(key, amount)
+
+
+def _write(pending):
+    """
+    Apply pending increments with one UPDATE per (model, amount) pair.
+    Returns the number of rows updated.
+    """
+    grouped = defaultdict(list)
+    for (label, pk), amount in pending.items():
+        if amount:
+            grouped[(label, amount)].append(pk)
+
+    updated = 0
+    with transaction.atomic():
+        for (label, amount), pks in grouped.items():
+            model = apps.get_model(label)
+            updated += model.objects.filter(pk__in=pks).update(
+                views_count=F('views_count') + amount
+            )
+    return updated
+
+
+class ViewCounter:
+    def __init__(self):
+        self._buffer = None
+        self._flush_lock = threading.Lock()
+        self._flusher_lock = threading.Lock()
+        self._flusher = None
+
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            kind = getattr(settings, 'VIEW_COUNTER_BUFFER', 'memory')
+            self._buffer = CacheBuffer() if kind == 'cache' else MemoryBuffer()
+        return self._buffer
+
+    def _add(self, instance, amount):
+        """
+        Buffer the increment; True if the buffer is due to be flushed
+        """
+        key = (instance._meta.label, instance.pk)
+        pending = self.buffer.add(key, amount)
+        self.ensure_flusher()
+        return pending >= getattr(settings, 'VIEW_COUNTER_MAX_PENDING', 1000)
+
+    def record(self, instance, amount=1):
+        """
+        Buffer a views_count increment for a model instance
+        """
+        if self._add(instance, amount):
+            self.flush()
+
+    async def arecord(self, instance, amount=1):
+        """
+        ``record()`` for async views: a due flush runs as a background task
+        instead of holding up the response
+        """
+        if isinstance(self.buffer, CacheBuffer):
+            due = await sync_to_async(self._add)(instance, amount)
+        else:
+            due = self._add(instance, amount)
+        if due:
+            fire_and_forget(sync_to_async(self.flush)())
+
+    def flush(self):
+        """
+        Write all buffered increments to the database. Returns rows updated.
+        """
+        if not self._flush_lock.acquire(blocking=False):
+            return 0  # another thread is already flushing
+        try:
+            pending = self.buffer.take()
+            if not pending:
+                return 0
+            try:
+                # Not the client's write: the request may still read replicas
+                with use_primary():
+                    return _write(pending)
+            except Exception:
+                # Keep the counts for the next attempt
+                self.buffer.restore(pending)
+                raise
+        finally:
+            self._flush_lock.release()
+
+    def ensure_flusher(self):
+        """
+        Start the periodic flush thread of this process, if enabled
+        """
+        if not getattr(settings, 'VIEW_COUNTER_BACKGROUND_FLUSH', True):
+            return
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._flusher_lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._run_flusher, name='view-counter-flusher', daemon=True)
+                self._flusher.start()
+
+    def _run_flusher(self):
+        from django.db import connection
+
+        while True:
+            time.sleep(getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 30))
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not flush buffered view counts")
+            finally:
+                connection.close()
+
+
+view_counter = ViewCounter()
+
+# Strong references to running background tasks; the event loop only
+# keeps weak ones
+_background_tasks = set()
+
+
+def fire_and_forget(coroutine):
+    """
+    Run a coroutine on the current event loop without awaiting it
+    """
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_task_done)
+    return task
+
+
+def _task_done(task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task failed", exc_info=task.exception())
+
+
+@atexit.register
+def _drain_at_exit():
+    try:
+        view_counter.flush()
+    except Exception:
+        logger.exception("Could not flush buffered view counts at shutdown")
@@ -0,0 +1,171 @@
+"""
+Streaming CSV / JSON Lines exports of cars, inquiries and newsletter
+subscribers.
+
+An export reads its rows with one ``values_list()`` query - the columns of
+related rows (brand, model, location, rental) are joined into it, and no
+model instances are built - consumed through ``iterator()``, so rows are
+fetched from the database in chunks (a server-side cursor on PostgreSQL)
+and written out ``CHUNK_SIZE`` at a time. Memory stays flat whatever the
+number of rows.
+
+The admin actions ``export_csv`` / ``export_jsonl`` stream the rows the
+action is applied to; with "Select all" that is the whole changelist,
+including its filters, search and ordering. ``manage.py export_data`` runs
+the same exports to a file, with ``--filter`` lookups.
+"""
+import csv
+import io
+import json
+import re
+from functools import partial
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Car, CustomerInquiry, NewsletterSubscription
+
+CHUNK_SIZE = 2000
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class Export:
+    """
+    An export of one model: ``columns`` maps column names to
+    ``values_list()`` lookups
+    """
+
+    def __init__(self, name, model, columns):
+        self.name = name
+        self.model = model
+        self.columns = columns
+
+    def rows(self, queryset=None):
+        """
+        Value tuples in column order, fetched CHUNK_SIZE at a time
+        """
+        if queryset is None:
+            queryset = self.model.objects.all()
+        if not queryset.ordered:
+            queryset = queryset.order_by('pk')
+        return queryset.values_list(*self.columns.values()).iterator(chunk_size=CHUNK_SIZE)
+
+    def stream(self, queryset=None, format='csv'):
+        """
+        The export as text chunks of CHUNK_SIZE rows
+        """
+        if format not in FORMATS:
+            raise ValueError(f"Unknown export format {format!r}")
+        names = list(self.columns)
+        if format == 'csv':
+            write_chunk = _csv_chunk
+            yield _csv_chunk([names])
+        else:
+            write_chunk = partial(_jsonl_chunk, names)
+        chunk = []
+        for row in self.rows(queryset):
+            chunk.append(row)
+            if len(chunk) == CHUNK_SIZE:
+                yield write_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield write_chunk(chunk)
+
+    def filename(self, format):
+        return f"{self.name}-{timezone.localdate():%Y%m%d}.{format}"
+
+    def response(self, queryset=None, format='csv'):
+        response = StreamingHttpResponse(self.stream(queryset, format), content_type=FORMATS[format])
+        response['Content-Disposition'] = f'attachment; filename="{self.filename(format)}"'
+        return response
+
+
+# Spreadsheets read a cell starting with one of these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Signed numbers and phone numbers ("+254 700 000000") are left as they are:
+# a spreadsheet reads them as numbers, never as anything that runs
+_PLAIN_NUMBER = re.compile(r'[+-]?\d[\d ]*(\.\d+)?')
+
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and not _PLAIN_NUMBER.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def _csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_csv_cell(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+def _jsonl_chunk(names, rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    return ''.join(encoder.encode(dict(zip(names, row))) + '\n' for row in rows)
+
+
+EXPORTS = {
+    'cars': Export('cars', Car, {
+        'id': 'pk',
+        'slug': 'slug',
+        'year': 'year',
+        'brand': 'brand__name',
+        'model': 'car_model__name',
+        'body_type': 'car_model__body_type',
+        'condition': 'condition',
+        'fuel_type': 'fuel_type',
+        'transmission': 'transmission',
+        'drive_type': 'drive_type',
+        'engine_size': 'engine_size',
+        'mileage': 'mileage',
+        'color': 'color',
+        'doors': 'doors',
+        'seats': 'seats',
+        'price': 'price',
+        'negotiable': 'negotiable',
+        'status': 'status',
+        'location': 'location__name',
+        'county': 'location__county',
+        'is_featured': 'is_featured',
+        'views_count': 'views_count',
+        'rental_daily_rate': 'rental_info__daily_rate',
+        'rental_weekly_rate': 'rental_info__weekly_rate',
+        'rental_monthly_rate': 'rental_info__monthly_rate',
+        'rental_status': 'rental_info__rental_status',
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+    }),
+    'inquiries': Export('inquiries', CustomerInquiry, {
+        'id': 'pk',
+        'created_at': 'created_at',
+        'status': 'status',
+        'inquiry_type': 'inquiry_type',
+        'customer_name': 'customer_name',
+        'customer_phone': 'customer_phone',
+        'customer_email': 'customer_email',
+        'preferred_contact_method': 'preferred_contact_method',
+        'car_id': 'car_id',
+        'car_year': 'car__year',
+        'car_brand': 'car__brand__name',
+        'car_model': 'car__car_model__name',
+        'message': 'message',
+        'notes': 'notes',
+    }),
+    'subscribers': Export('subscribers', NewsletterSubscription, {
+        'email': 'email',
+        'is_active': 'is_active',
+        'subscribed_at': 'subscribed_at',
+    }),
+}
+
+
+def for_model(model):
+    for export in EXPORTS.values():
+        if export.model is model:
+            return export
+    raise LookupError(f"No export for {model.__name__}")
@@ -0,0 +1,487 @@
+"""
+Faceted inventory search.
+
+Keeps an in-memory posting index of every car (facet value -> set of car ids)
+so listing pages can answer "which cars match" and "how many cars per facet
+value" without re-running a chain of joined filters for every request.
+
+The index is built lazily on first use and kept current by the Car, CarModel
+and CarRental signal handlers in ``mywebsite.signals``. Each change is
+published, once its transaction commits, as a numbered entry in a change
+journal in the shared cache (the version stamp is the latest entry number).
+Other worker processes catch up by re-reading just the journalled cars in
+one query; they only rebuild the whole index when they fell too far behind,
+an entry expired, or a change (e.g. a body type rename) asks for a rebuild.
+"""
+import base64
+import binascii
+import bisect
+import json
+import threading
+from datetime import datetime
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import transaction
+
+from .models import Car
+from .routers import use_primary
+
+
+FACETS = (
+    'brand', 'model', 'body_type', 'condition', 'transmission',
+    'fuel_type', 'location', 'status', 'listing', 'year', 'price_band',
+)
+
+# (key, lower bound inclusive, upper bound exclusive) in KES
+PRICE_BANDS = [
+    ('under-500k', 0, 500000),
+    ('500k-1m', 500000, 1000000),
+    ('1m-2m', 1000000, 2000000),
+    ('2m-5m', 2000000, 5000000),
+    ('5m-10m', 5000000, 10000000),
+    ('over-10m', 10000000, None),
+]
+
+SORT_KEYS = {
+    'created_at': 'created_at',
+    'price': 'price',
+    'year': 'year',
+}
+
+VERSION_KEY = 'mywebsite:facets:version'
+CHANGE_KEY = 'mywebsite:facets:change:%d'
+# Journal entry that makes every worker rebuild
+REBUILD = 'rebuild'
+# A worker further behind than this rebuilds instead of catching up
+MAX_CATCH_UP = 1000
+# Long enough for any worker serving requests to catch up
+CHANGE_TIMEOUT = 24 * 60 * 60
+
+# Car fields whose change requires re-reading the car into the index
+INDEXED_FIELDS = frozenset([
+    'brand', 'car_model', 'condition', 'transmission', 'fuel_type',
+    'location', 'status', 'year', 'price', 'mileage', 'created_at',
+])
+
+_ROW_FIELDS = (
+    'id', 'brand_id', 'car_model_id', 'car_model__body_type', 'condition',
+    'transmission', 'fuel_type', 'location_id', 'status', 'year', 'price',
+    'mileage', 'created_at', 'rental_info__id',
+)
+
+
+def price_band(price):
+    """
+    Return the PRICE_BANDS key a price falls into
+    """
+    for key, low, high in PRICE_BANDS:
+        if price >= low and (high is None or price < high):
+            return key
+    return None
+
+
+class FacetResult:
+    """
+    Matching car ids plus per-facet value counts.
+
+    ``ids`` (the full listing order) is computed on first access; use
+    ``cursor_page()`` to read one page after a cursor without ordering the
+    whole result.
+    """
+
+    def __init__(self, matched, counts, sort='-created_at', ranked=None, sorted_keys=None):
+        self.matched = matched
+        self.counts = counts
+        self.sort = sort
+        self._ranked = ranked
+        self._sorted_keys = sorted_keys
+        self._ids = None
+
+    def __len__(self):
+        return len(self.matched)
+
+    @property
+    def count(self):
+        return len(self.matched)
+
+    @property
+    def descending(self):
+        return self.sort.startswith('-')
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            if self._ranked is not None:
+                self._ids = [car_id for car_id in self._ranked if car_id in self.matched]
+            else:
+                entries = reversed(self._sorted_keys) if self.descending else self._sorted_keys
+                self._ids = [car_id for _, car_id in entries if car_id in self.matched]
+        return self._ids
+
+    def page(self, number, per_page, queryset=None):
+        """
+        Paginate the matching ids and load only the cars on that page.
+        No COUNT(*) or OFFSET query is issued.
+        """
+        paginator = Paginator(self.ids, per_page)
+        page_obj = paginator.get_page(number)
+        page_obj.object_list = load_cars(page_obj.object_list, queryset)
+        return page_obj
+
+    def cursor_page(self, cursor, per_page, queryset=None):
+        """
+        Keyset pagination: return the ``per_page`` cars after (or, for a
+        'prev' cursor, before) the cursor position. Cost depends on the
+        page size, not on how deep the cursor is.
+        """
+        if self._sorted_keys is None:
+            raise ValueError("Cursor pagination needs a column sort, not %r" % self.sort)
+
+        entries = self._sorted_keys
+        backwards = cursor is not None and cursor.direction == 'prev'
+        # Walking "forward" in listing order means walking down the
+        # ascending array for descending sorts.
+        step = -1 if self.descending != backwards else 1
+
+        if cursor is None:
+            start = len(entries) - 1 if step < 0 else 0
+        elif step > 0:
+            start = bisect.bisect_right(entries, cursor.position)
+        else:
+            start = bisect.bisect_left(entries, cursor.position) - 1
+
+        found = []
+        i = start
+        while 0 <= i < len(entries) and len(found) <= per_page:
+            if entries[i][1] in self.matched:
+                found.append(entries[i])
+            i += step
+
+        more = len(found) > per_page
+        found = found[:per_page]
+        if backwards:
+            found.reverse()
+
+        page = CursorPage(
+            load_cars([car_id for _, car_id in found], queryset),
+            count=self.count,
+            has_next=more if not backwards else True,
+            has_previous=(cursor is not None) if not backwards else more,
+        )
+        if found:
+            page.next_cursor = Cursor(self.sort, found[-1], 'next')
+            page.previous_cursor = Cursor(self.sort, found[0], 'prev')
+        return page
+
+
+class Cursor:
+    """
+    Opaque keyset position: the (sort key, car id) of a boundary car
+    """
+
+    def __init__(self, sort, position, direction='next'):
+        self.sort = sort
+        self.position = tuple(position)
+        self.direction = direction
+
+    def encode(self):
+        key, car_id = self.position
+        if isinstance(key, datetime):
+            key = key.isoformat()
+        payload = json.dumps([self.sort, key, car_id, self.direction], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, token, sort):
+        """
+        Parse a cursor token; returns None if it is invalid or was issued
+        for a different sort order.
+        """
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            token_sort, key, car_id, direction = json.loads(base64.urlsafe_b64decode(padded))
+            if token_sort != sort or direction not in ('next', 'prev'):
+                return None
+            if SORT_KEYS.get(sort.lstrip('-')) == 'created_at':
+                key = datetime.fromisoformat(key)
+            elif not isinstance(key, (int, float)):
+                return None
+            return cls(sort, (key, int(car_id)), direction)
+        except (ValueError, TypeError, binascii.Error):
+            return None
+
+
+class CursorPage:
+    """
+    One keyset page; quacks enough like a Paginator page for templates
+    """
+
+    def __init__(self, object_list, count, has_next, has_previous):
+        self.object_list = object_list
+        self.count = count
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = None
+        self.previous_cursor = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next and self.next_cursor is not None
+
+    def has_previous(self):
+        return self._has_previous and self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def load_cars(ids, queryset=None):
+    """
+    Fetch cars by id and return them in the order of ``ids``
+    """
+    if queryset is None:
+        queryset = Car.objects.select_related('brand', 'car_model', 'location')
+    ids = list(ids)
+    cars = queryset.order_by().in_bulk(ids)
+    return [cars[car_id] for car_id in ids if car_id in cars]
+
+
+class FacetIndex:
+    """
+    Posting index over the car inventory.
+
+    ``postings[facet][value]`` is the set of car ids having that value and
+    ``rows[car_id]`` holds the facet values and sort keys of each car.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self.postings = {}
+        self.rows = {}
+        # sort field -> ascending list of (value, car id), built on demand
+        self._sorted = {}
+
+    # ------------------------------------------------------------------
+    # Building and maintenance
+    # ------------------------------------------------------------------
+
+    def _row_from_values(self, values):
+        price = float(values['price'])
+        return {
+            'brand': values['brand_id'],
+            'model': values['car_model_id'],
+            'body_type': values['car_model__body_type'],
+            'condition': values['condition'],
+            'transmission': values['transmission'],
+            'fuel_type': values['fuel_type'],
+            'location': values['location_id'],
+            'status': values['status'],
+            'listing': 'rental' if values['rental_info__id'] else 'sale',
+            'year': values['year'],
+            'price_band': price_band(price),
+            'price': price,
+            'mileage': values['mileage'],
+            'created_at': values['created_at'],
+        }
+
+    def _add(self, car_id, row):
+        self._sorted = {}
+        self.rows[car_id] = row
+        for facet in FACETS:
+            self.postings[facet].setdefault(row[facet], set()).add(car_id)
+
+    def _remove(self, car_id):
+        row = self.rows.pop(car_id, None)
+        if row is None:
+            return
+        self._sorted = {}
+        for facet in FACETS:
+            posting = self.postings[facet].get(row[facet])
+            if posting is not None:
+                posting.discard(car_id)
+                if not posting:
+                    del self.postings[facet][row[facet]]
+
+    def build(self):
+        """
+        (Re)build the whole index with a single query
+        """
+        with self._lock:
+            cache.add(VERSION_KEY, 0, None)
+            version = cache.get(VERSION_KEY)
+            self.postings = {facet: {} for facet in FACETS}
+            self.rows = {}
+            self._sorted = {}
+            # From the primary: a lagging replica must not be cached as this version
+            with use_primary():
+                for values in Car.objects.values(*_ROW_FIELDS).order_by().iterator(chunk_size=2000):
+                    self._add(values['id'], self._row_from_values(values))
+            self._version = version
+
+    def _ensure_current(self):
+        version = cache.get(VERSION_KEY)
+        if self._version is not None and self._version == version:
+            return
+        if self._version is None or version is None or not self._catch_up(version):
+            self.build()
+
+    def _catch_up(self, version):
+        """
+        Apply the journalled changes since the index's version; False if
+        they are not all available (the caller rebuilds instead)
+        """
+        if not 0 < version - self._version <= MAX_CATCH_UP:
+            return False
+        keys = [CHANGE_KEY % number for number in range(self._version + 1, version + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys) or REBUILD in changes.values():
+            return False
+        car_ids = set(changes.values())
+        with use_primary():
+            rows = {values['id']: values for values in Car.objects.filter(pk__in=car_ids).values(*_ROW_FIELDS)}
+        for car_id in car_ids:
+            self._remove(car_id)
+            if car_id in rows:
+                self._add(car_id, self._row_from_values(rows[car_id]))
+        self._version = version
+        return True
+
+    def _publish(self, change):
+        """
+        Append a change (a car id, or REBUILD) to the shared journal
+        """
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            # No stamp (first use, or evicted): workers rebuild anyway
+            cache.add(VERSION_KEY, 0, None)
+            version = cache.incr(VERSION_KEY)
+        cache.set(CHANGE_KEY % version, change, CHANGE_TIMEOUT)
+
+    def refresh_car(self, car_id):
+        """
+        Re-read a single car into the index (after save or rental change)
+        """
+        with self._lock:
+            # This process sees its own write at once; the others once the
+            # transaction commits, so they never read it before it exists
+            if self._version is not None:
+                self._remove(car_id)
+                with use_primary():
+                    values = Car.objects.filter(pk=car_id).values(*_ROW_FIELDS).first()
+                if values is not None:
+                    self._add(car_id, self._row_from_values(values))
+        transaction.on_commit(lambda: self._publish(car_id))
+
+    def remove_car(self, car_id):
+        with self._lock:
+            self._remove(car_id)
+        transaction.on_commit(lambda: self._publish(car_id))
+
+    def invalidate(self):
+        """
+        Force a full rebuild on next use (e.g. a body type was renamed)
+        """
+        with self._lock:
+            self._version = None
+        transaction.on_commit(lambda: self._publish(REBUILD))
+
+    # ------------------------------------------------------------------
+    # Querying
+    # ------------------------------------------------------------------
+
+    def search(self, filters=None, min_price=None, max_price=None,
+               max_mileage=None, candidates=None, sort='-created_at'):
+        """
+        Return a FacetResult for cars matching every filter.
+
+        ``filters`` maps facet names to a single value. Counts for a facet
+        are computed with that facet's own filter left out, so a dropdown
+        shows how many cars each alternative value would give.
+
+        ``candidates`` restricts the search to the given car ids; with
+        ``sort='relevance'`` results keep the candidates' order.
+        """
+        filters = {k: v for k, v in (filters or {}).items() if v not in (None, '')}
+
+        with self._lock:
+            self._ensure_current()
+
+            # Range filters and external candidates (e.g. keyword matches)
+            base = None
+            if candidates is not None:
+                candidates = list(candidates)
+                base = set(candidates) & self.rows.keys()
+            if min_price is not None or max_price is not None or max_mileage is not None:
+                pool = base if base is not None else self.rows.keys()
+                base = {
+                    car_id for car_id in pool
+                    if (min_price is None or self.rows[car_id]['price'] >= min_price)
+                    and (max_price is None or self.rows[car_id]['price'] <= max_price)
+                    and (max_mileage is None or self.rows[car_id]['mileage'] <= max_mileage)
+                }
+
+            postings = {
+                facet: self.postings[facet].get(value, set())
+                for facet, value in filters.items()
+            }
+
+            def intersect(skip=None):
+                sets = [s for facet, s in postings.items() if facet != skip]
+                if base is not None:
+                    sets.append(base)
+                if not sets:
+                    return None
+                sets.sort(key=len)
+                result = set(sets[0])
+                for s in sets[1:]:
+                    result &= s
+                return result
+
+            matched = intersect()
+            unfiltered = matched is None
+            if unfiltered:
+                # Every car: the (read-only) key view, not a copy of it
+                matched = self.rows.keys()
+
+            counts = {}
+            for facet in FACETS:
+                if unfiltered:
+                    pool = None
+                else:
+                    pool = intersect(skip=facet) if facet in filters else matched
+                if pool is None:
+                    counts[facet] = {value: len(ids) for value, ids in self.postings[facet].items()}
+                else:
+                    counts[facet] = {}
+                    for value, ids in self.postings[facet].items():
+                        n = len(ids & pool)
+                        if n:
+                            counts[facet][value] = n
+
+            if sort == 'relevance' and candidates is not None:
+                # Keep the order of the ranked candidate list (e.g. BM25 rank)
+                return FacetResult(matched, counts, sort, ranked=candidates)
+            if sort.lstrip('-') not in SORT_KEYS:
+                sort = '-created_at'
+            return FacetResult(matched, counts, sort, sorted_keys=self._sorted_keys(sort))
+
+    def _sorted_keys(self, sort):
+        """
+        Ascending (value, car id) list for a sort field. The list is
+        replaced, never mutated, so results can keep using it unlocked.
+        """
+        field = SORT_KEYS[sort.lstrip('-')]
+        if field not in self._sorted:
+            self._sorted[field] = sorted((row[field], car_id) for car_id, row in self.rows.items())
+        return self._sorted[field]
+
+
+facet_index = FacetIndex()
@@ -0,0 +1,56 @@
+"""
+RSS and Atom feeds of the newest available cars.
+
+The items come from one query with their brand, model, location and rental
+joined in. The feed URLs are wrapped in ``conditional.conditional_view`` so
+feed readers polling an unchanged inventory get 304 Not Modified.
+"""
+from django.contrib.humanize.templatetags.humanize import intcomma
+from django.contrib.syndication.views import Feed
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+
+from .sitemaps import listed_cars
+
+FEED_ITEMS = 50
+
+
+class LatestCarsFeed(Feed):
+    title = "CarSoko - Latest cars"
+    description = "The newest cars for sale and rent on CarSoko."
+
+    def link(self):
+        return reverse('car_list')
+
+    def items(self):
+        return listed_cars().select_related(
+            'brand', 'car_model', 'location', 'rental_info'
+        ).order_by('-created_at')[:FEED_ITEMS]
+
+    def item_title(self, car):
+        return str(car)
+
+    def item_description(self, car):
+        rental = getattr(car, 'rental_info', None)
+        if rental is not None:
+            price = f"KES {intcomma(rental.daily_rate)} per day"
+        else:
+            price = f"KES {intcomma(car.price)}"
+        return (
+            f"{price} - {intcomma(car.mileage)} km, {car.get_transmission_display()}, "
+            f"{car.get_fuel_type_display()}, {car.location.name}"
+        )
+
+    def item_link(self, car):
+        return reverse('car_detail', args=[car.slug])
+
+    def item_pubdate(self, car):
+        return car.created_at
+
+    def item_updateddate(self, car):
+        return car.updated_at
+
+
+class LatestCarsAtomFeed(LatestCarsFeed):
+    feed_type = Atom1Feed
+    subtitle = LatestCarsFeed.description
@@ -0,0 +1,145 @@
+"""
+Full-text keyword search over the car inventory.
+
+Backed by an SQLite FTS5 table (``mywebsite_car_fts``, created in migration
+0004) whose rowid is the car id. The table is kept in sync by the signal
+handlers in ``mywebsite.signals`` and can be rebuilt from scratch with
+``manage.py rebuild_search_index``. On other database backends, or when the
+SQLite build lacks FTS5, searches fall back to ``icontains`` lookups.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Car
+
+
+FTS_TABLE = 'mywebsite_car_fts'
+
+# Column weights for bm25(): brand, model, description, features
+BM25_WEIGHTS = (10.0, 10.0, 1.0, 2.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_SOURCE_SQL = """
+    SELECT c.id, b.name, m.name, COALESCE(c.description, ''), COALESCE(c.features, '')
+    FROM mywebsite_car c
+    INNER JOIN mywebsite_brand b ON b.id = c.brand_id
+    INNER JOIN mywebsite_carmodel m ON m.id = c.car_model_id
+"""
+
+
+def is_available():
+    """
+    Whether the FTS5 table can be used on the current connection
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    if getattr(connection, '_car_fts_available', False):
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE]
+        )
+        available = cursor.fetchone() is not None
+    # Only remember success; the table may be created later by migrate
+    if available:
+        connection._car_fts_available = True
+    return available
+
+
+def build_match_query(text):
+    """
+    Turn free text into a safe FTS5 MATCH expression.
+
+    Every word must match (as a prefix, so "toyo" finds "Toyota"); quotes
+    and FTS operators typed by the user are treated as plain text.
+    """
+    tokens = _TOKEN_RE.findall(text or '')
+    return ' '.join('"%s"*' % token for token in tokens)
+
+
+def search_ids(text, limit=None):
+    """
+    Return ids of cars matching ``text``, best BM25 match first
+    """
+    match = build_match_query(text)
+    if not match:
+        return []
+
+    if not is_available():
+        # Every word must match, like the MATCH query, in any indexed field
+        cars = Car.objects.all()
+        for token in _TOKEN_RE.findall(text):
+            cars = cars.filter(
+                Q(brand__name__icontains=token) |
+                Q(car_model__name__icontains=token) |
+                Q(description__icontains=token) |
+                Q(features__icontains=token)
+            )
+        return list(cars.order_by('-created_at').values_list('id', flat=True))
+
+    sql = "SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY bm25({table}, {weights})".format(
+        table=FTS_TABLE,
+        weights=', '.join(str(w) for w in BM25_WEIGHTS),
+    )
+    params = [match]
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _reindex(where, params):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM {table} WHERE rowid IN (SELECT c.id FROM mywebsite_car c WHERE {where})".format(
+                table=FTS_TABLE, where=where),
+            params,
+        )
+        cursor.execute(
+            "INSERT INTO {table} (rowid, brand, model, description, features) {source} WHERE {where}".format(
+                table=FTS_TABLE, source=_SOURCE_SQL, where=where),
+            params,
+        )
+
+
+def index_car(car_id):
+    _reindex('c.id = %s', [car_id])
+
+
+def index_brand(brand_id):
+    _reindex('c.brand_id = %s', [brand_id])
+
+
+def index_car_model(car_model_id):
+    _reindex('c.car_model_id = %s', [car_model_id])
+
+
+def remove_car(car_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {table} WHERE rowid = %s".format(table=FTS_TABLE), [car_id])
+
+
+def rebuild():
+    """
+    Repopulate the whole index from the car table. Returns the row count.
+    """
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {table}".format(table=FTS_TABLE))
+        cursor.execute(
+            "INSERT INTO {table} (rowid, brand, model, description, features) {source}".format(
+                table=FTS_TABLE, source=_SOURCE_SQL)
+        )
+        cursor.execute("INSERT INTO {table}({table}) VALUES ('optimize')".format(table=FTS_TABLE))
+        cursor.execute("SELECT COUNT(*) FROM {table}".format(table=FTS_TABLE))
+        return cursor.fetchone()[0]
@@ -0,0 +1,183 @@
+"""
+Cached data layer for the homepage.
+
+The homepage needs featured cars, filter options, stats, testimonials and
+blog posts. Filter options and counts come from the materialized
+``InventoryStat`` rows and the reference data cache, business config from
+the reference data context processor. ``get_homepage_data()`` computes
+that bundle once and keeps it in the Django cache under a versioned key.
+The signal handlers in ``mywebsite.signals`` call ``invalidate()`` whenever a
+row the page depends on changes, which bumps the version so the next request
+rebuilds the bundle.
+"""
+from copy import copy
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import reference, stats
+from .models import Car, Testimonial, BlogPost
+from .routers import use_primary
+
+
+VERSION_KEY = 'mywebsite:homepage:version'
+DATA_KEY = 'mywebsite:homepage:data:%s'
+HITS_KEY = 'mywebsite:homepage:hits'
+MISSES_KEY = 'mywebsite:homepage:misses'
+
+# Upper bound on staleness for time-based changes (scheduled blog posts)
+CACHE_TIMEOUT = 300
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate():
+    """
+    Drop the cached homepage bundle (called from model signals)
+    """
+    _incr(VERSION_KEY)
+    # Bump again once committed, or a miss in another process could cache
+    # the uncommitted state's old rows under the new version
+    transaction.on_commit(lambda: _incr(VERSION_KEY))
+
+
+def cache_stats():
+    """
+    Hit/miss counters for the homepage cache
+    """
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0.0,
+    }
+
+
+def get_homepage_data():
+    """
+    Return the homepage context bundle, computing it on a cache miss
+    """
+    key = DATA_KEY % _version()
+    data = cache.get(key)
+    if data is not None:
+        _incr(HITS_KEY)
+        return data
+
+    _incr(MISSES_KEY)
+    # Cached under the current version, so built from the primary
+    with use_primary():
+        data = build_homepage_data()
+    cache.set(key, data, CACHE_TIMEOUT)
+    return data
+
+
+def build_homepage_data():
+    """
+    Compute the homepage bundle from the database. Everything is evaluated
+    to plain lists/dicts so the result can be pickled into the cache.
+    """
+    # Get available cars for display
+    available_cars = Car.objects.filter(
+        status='available'
+    ).select_related(
+        'brand', 'car_model', 'location', 'rental_info', 'primary_image'
+    )
+
+    # Get featured cars (limit to 8 for homepage display)
+    featured_cars = list(available_cars.filter(is_featured=True)[:8])
+
+    # If not enough featured cars, fill with recent cars
+    if len(featured_cars) < 8:
+        featured_car_ids = [car.id for car in featured_cars]
+        additional_cars = list(available_cars.exclude(
+            id__in=featured_car_ids
+        ).order_by('-created_at')[:8 - len(featured_cars)])
+        homepage_cars = featured_cars + additional_cars
+    else:
+        homepage_cars = featured_cars
+
+    # Separate cars for sale and rent (rental_info is select_related above)
+    cars_for_sale = []
+    cars_for_rent = []
+    for car in homepage_cars:
+        if getattr(car, 'rental_info', None) is not None:
+            cars_for_rent.append(car)
+        else:
+            cars_for_sale.append(car)
+
+    # Filter options, counts and price range from the materialized stats
+    inventory = stats.snapshot()
+
+    def available(dimension, value):
+        stat = inventory[dimension].get(value)
+        return stat.available if stat else 0
+
+    years = sorted((year for year, stat in inventory['year'].items() if stat.cars), reverse=True)
+
+    brands = [brand for brand in reference.brands() if available('brand', brand.id)]
+
+    popular_models = []
+    for car_model in sorted(reference.car_models(), key=lambda m: -available('car_model', m.id))[:10]:
+        if not available('car_model', car_model.id):
+            break
+        car_model = copy(car_model)
+        car_model.car_count = available('car_model', car_model.id)
+        popular_models.append(car_model)
+
+    totals = inventory['all'][0]
+    price_range = {
+        'min_price': totals.available_min_price,
+        'max_price': totals.available_max_price,
+    }
+
+    locations = [location for location in reference.locations() if available('location', location.id)]
+
+    testimonials = list(Testimonial.objects.filter(
+        is_approved=True,
+        is_featured=True
+    ).select_related(
+        'car_purchased__brand', 'car_purchased__car_model'
+    ).order_by('-created_at')[:3])
+
+    latest_posts = list(BlogPost.objects.filter(
+        is_published=True,
+        published_at__lte=timezone.now()
+    ).order_by('-published_at')[:3])
+
+    car_stats = {
+        'total_cars': totals.available,
+        'cars_for_sale': totals.available - totals.available_for_rent,
+        'cars_for_rent': totals.available_for_rent,
+        'total_brands': len(brands),
+    }
+
+    return {
+        'homepage_cars': homepage_cars,
+        'cars_for_sale': cars_for_sale,
+        'cars_for_rent': cars_for_rent,
+        'years': years,
+        'brands': brands,
+        'popular_models': popular_models,
+        'locations': locations,
+        'price_range': price_range,
+        'testimonials': testimonials,
+        'latest_posts': latest_posts,
+        'car_stats': car_stats,
+    }
@@ -0,0 +1,155 @@
+"""
+Car image rendition pipeline.
+
+Uploading a CarImage stores the original untouched and schedules a job on a
+small worker pool that writes fixed-size renditions (thumb, card, hero) as
+progressive JPEG and WebP next to it. The resulting paths and sizes are
+recorded in ``CarImage.renditions`` and exposed to templates through
+``CarImage.card_url``, ``CarImage.srcset`` and friends.
+
+Jobs are submitted after the transaction commits. Set
+``IMAGE_RENDITIONS_ASYNC = False`` to run them inline (tests, management
+commands). ``manage.py generate_image_renditions`` backfills existing images;
+with ``--check`` it only lists those whose renditions are missing or stale.
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# name -> (max width, max height); the image is scaled down to fit
+RENDITIONS = {
+    'thumb': (160, 120),
+    'card': (500, 375),
+    'hero': (1600, 1000),
+}
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 78
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        workers = getattr(settings, 'IMAGE_RENDITIONS_WORKERS', 2)
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='car-image')
+    return _executor
+
+
+def file_hash(field_file):
+    """
+    SHA-1 of an uploaded image, used to skip re-processing unchanged files
+    """
+    digest = hashlib.sha1()
+    field_file.open('rb')
+    try:
+        for chunk in field_file.chunks():
+            digest.update(chunk)
+    finally:
+        field_file.close()
+    return digest.hexdigest()
+
+
+def rendition_path(image_name, car_image_id, rendition, extension):
+    base = os.path.splitext(os.path.basename(image_name))[0]
+    return f"car_images/renditions/{car_image_id}/{base}-{rendition}.{extension}"
+
+
+def _encode(img, fmt, quality):
+    buffer = BytesIO()
+    if fmt == 'JPEG':
+        img.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(buffer, 'WEBP', quality=quality, method=4)
+    return ContentFile(buffer.getvalue())
+
+
+def build_renditions(car_image):
+    """
+    Write every rendition for ``car_image`` and return the renditions dict
+    """
+    with car_image.image.open('rb') as source:
+        original = Image.open(source)
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'L'):
+            original = original.convert('RGB')
+        original.load()
+
+    renditions = {}
+    for name, size in RENDITIONS.items():
+        img = original.copy()
+        img.thumbnail(size, Image.LANCZOS)
+        entry = {'width': img.width, 'height': img.height}
+        for fmt, extension, quality in (('JPEG', 'jpg', JPEG_QUALITY), ('WEBP', 'webp', WEBP_QUALITY)):
+            path = rendition_path(car_image.image.name, car_image.pk, name, extension)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            entry[extension] = default_storage.save(path, _encode(img, fmt, quality))
+        renditions[name] = entry
+    return renditions
+
+
+def process_car_image(car_image_id):
+    """
+    (Re)build renditions for one CarImage. Returns the renditions dict, or
+    None if the image is missing or could not be processed.
+    """
+    from . import conditional, homepage
+    from .models import CarImage
+
+    try:
+        car_image = CarImage.objects.filter(pk=car_image_id).first()
+        if car_image is None or not car_image.image:
+            return None
+        source_hash = file_hash(car_image.image)
+        renditions = build_renditions(car_image)
+    except Exception:
+        logger.exception("Could not build renditions for CarImage %s", car_image_id)
+        return None
+
+    # update() so the model's save() hooks do not run again
+    CarImage.objects.filter(pk=car_image_id).update(
+        renditions=renditions, source_hash=source_hash
+    )
+    # The cached homepage and validated pages still point at the original file
+    homepage.invalidate()
+    conditional.touch_car(car_image.car_id)
+    return renditions
+
+
+def _run_in_worker(car_image_id):
+    # Worker threads open their own connection; don't leak it
+    close_old_connections()
+    try:
+        return process_car_image(car_image_id)
+    finally:
+        close_old_connections()
+
+
+def schedule(car_image_id):
+    """
+    Queue rendition generation once the current transaction commits
+    """
+    if getattr(settings, 'IMAGE_RENDITIONS_ASYNC', True):
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_worker, car_image_id))
+    else:
+        transaction.on_commit(lambda: process_car_image(car_image_id))
+
+
+def delete_renditions(renditions):
+    for entry in (renditions or {}).values():
+        for extension in ('jpg', 'webp'):
+            path = entry.get(extension)
+            if path and default_storage.exists(path):
+                default_storage.delete(path)
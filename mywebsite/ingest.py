@@ -0,0 +1,364 @@
+"""
+Write-behind ingestion for customer inquiries and newsletter signups.
+
+``submit_inquiry`` and ``newsletter_subscribe`` validate the submission,
+append it to a durable local spool and answer straight away, so a campaign
+spike never queues requests on the SQLite write lock. A background flusher
+(a daemon thread per process, or ``manage.py flush_ingest_spool`` from cron)
+writes the spooled records to CustomerInquiry and NewsletterSubscription in
+batched transactions.
+
+The spool is a directory (``settings.INGEST_SPOOL_DIR``) of JSON-lines files:
+submissions are appended to ``active.jsonl`` under an exclusive ``flock`` and
+fsync'ed; a flush first renames the active file to a new segment and then
+writes each segment in order, deleting it only after its transaction has
+committed. Every record carries an idempotency key (the client's
+``Idempotency-Key`` header hashed with the submission, or a generated one)
+stored on CustomerInquiry with a unique index, and signups are keyed by
+their unique email, so a segment replayed after a crash never creates
+duplicates. Hashing in the submission keeps two customers who send the same
+common key ("1", "abc") from dropping each other's inquiries.
+
+A record the database rejects (a poison record) would fail its batch on
+every flush and hold up the records behind it. When a batch fails, its
+records are written one at a time and the ones that still fail are moved to
+``dead-letter.jsonl`` with the error, logged, and skipped. A database that
+is unavailable is not the records' fault: the flush stops and they stay
+spooled.
+
+``metrics()`` reports the backlog (records waiting), the lag (age of the
+oldest one), the totals of the last flush and the number of dead letters.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+
+from .routers import use_primary
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_FILE = 'active.jsonl'
+SEGMENT_PREFIX = 'segment-'
+STATE_FILE = 'flush-state.json'
+DEAD_LETTER_FILE = 'dead-letter.jsonl'
+
+INQUIRY = 'inquiry'
+NEWSLETTER = 'newsletter'
+
+def new_key(client_key=None, data=None):
+    """
+    The key of a submission: the client's idempotency key hashed with the
+    submitted ``data`` (so a retry maps to the same key), else a fresh one
+    """
+    if client_key:
+        payload = json.dumps([client_key, data], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+    return uuid.uuid4().hex
+
+
+class Spool:
+    @property
+    def directory(self):
+        directory = settings.INGEST_SPOOL_DIR
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self, name, blocking=True):
+        with open(self._path(name), 'a') as lock_file:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def append(self, kind, key, data):
+        """
+        Durably record one submission
+        """
+        line = json.dumps({
+            'kind': kind,
+            'key': key,
+            'received_at': time.time(),
+            'data': data,
+        }, separators=(',', ':')) + '\n'
+        with self._locked('append.lock'):
+            with open(self._path(ACTIVE_FILE), 'a') as f:
+                f.write(line)
+                f.flush()
+                if getattr(settings, 'INGEST_SPOOL_FSYNC', True):
+                    os.fsync(f.fileno())
+
+    def rotate(self):
+        """
+        Close the active file as a new segment so appends continue elsewhere
+        """
+        with self._locked('append.lock'):
+            active = self._path(ACTIVE_FILE)
+            if os.path.exists(active) and os.path.getsize(active):
+                os.rename(active, self._path(f"{SEGMENT_PREFIX}{time.time_ns():020d}.jsonl"))
+
+    def segments(self):
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith('.jsonl')
+        )
+
+    def read(self, name):
+        records = []
+        with open(self._path(name)) as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A torn final line from a crash mid-append
+                    logger.error("Skipping unreadable spool record %s:%d", name, number)
+        return records
+
+    def dead_letter(self, name, record, error):
+        """
+        Set aside a record the database rejected
+        """
+        line = json.dumps({'segment': name, 'error': repr(error), 'record': record}, separators=(',', ':')) + '\n'
+        with open(self._path(DEAD_LETTER_FILE), 'a') as f:
+            f.write(line)
+            f.flush()
+            if getattr(settings, 'INGEST_SPOOL_FSYNC', True):
+                os.fsync(f.fileno())
+
+    def dead_letters(self):
+        try:
+            return self.read(DEAD_LETTER_FILE)
+        except FileNotFoundError:
+            return []
+
+    def remove(self, name):
+        os.remove(self._path(name))
+
+    def read_state(self):
+        try:
+            with open(self._path(STATE_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_state(self, state):
+        path = self._path(STATE_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+
+spool = Spool()
+
+
+# ----------------------------------------------------------------------
+# Writing spooled records
+# ----------------------------------------------------------------------
+
+def _write_inquiries(records):
+    from .models import Car, CustomerInquiry
+
+    car_ids = {record['data']['car_id'] for record in records if record['data'].get('car_id')}
+    existing_cars = set(Car.objects.filter(pk__in=car_ids).values_list('pk', flat=True))
+    inquiries = []
+    for record in records:
+        data = dict(record['data'])
+        if data.get('car_id') not in existing_cars:
+            # Unknown or since deleted: keep the inquiry without the car
+            data['car_id'] = None
+        inquiries.append(CustomerInquiry(idempotency_key=record['key'], **data))
+    # Rows already written by an interrupted flush are skipped
+    CustomerInquiry.objects.bulk_create(inquiries, ignore_conflicts=True)
+
+
+def _write_signups(records):
+    from .models import NewsletterSubscription
+
+    emails = list(dict.fromkeys(record['data']['email'] for record in records))
+    existing = set(NewsletterSubscription.objects.filter(email__in=emails).values_list('email', flat=True))
+    NewsletterSubscription.objects.bulk_create(
+        [NewsletterSubscription(email=email, is_active=True) for email in emails if email not in existing],
+        ignore_conflicts=True,
+    )
+    # Signing up again reactivates a lapsed subscription
+    NewsletterSubscription.objects.filter(email__in=existing, is_active=False).update(is_active=True)
+
+
+WRITERS = {
+    INQUIRY: _write_inquiries,
+    NEWSLETTER: _write_signups,
+}
+
+# The database being unreachable or locked; the records are not at fault
+UNAVAILABLE = (OperationalError, InterfaceError)
+
+
+def _write(records):
+    """
+    Write records of any kind in one transaction. Returns {kind: records}.
+    """
+    unknown = {record.get('kind') for record in records} - WRITERS.keys()
+    if unknown:
+        raise ValueError(f"Unknown record kind {unknown.pop()!r}")
+    written = Counter()
+    with transaction.atomic():
+        for kind, writer in WRITERS.items():
+            rows = [record for record in records if record['kind'] == kind]
+            if rows:
+                writer(rows)
+                written[kind] += len(rows)
+    return written
+
+
+def _write_batch(name, batch):
+    """
+    Write a batch from segment ``name``, setting aside the records that
+    make it fail. Returns {kind: records written}.
+    """
+    try:
+        return _write(batch)
+    except UNAVAILABLE:
+        raise
+    except Exception as error:
+        if len(batch) > 1:
+            # Retry the records one by one to find the culprits
+            written = Counter()
+            for record in batch:
+                written += _write_batch(name, [record])
+            return written
+        logger.error("Moving spool record %s from %s to the dead letters: %r", batch[0].get('key'), name, error)
+        spool.dead_letter(name, batch[0], error)
+        return Counter()
+
+
+def flush():
+    """
+    Write every spooled record to the database. Returns {kind: records};
+    empty if another process is already flushing.
+    """
+    batch_size = getattr(settings, 'INGEST_BATCH_SIZE', 500)
+    written = {kind: 0 for kind in WRITERS}
+    # Not the client's write, if run inside a request
+    with spool._locked('flush.lock', blocking=False) as acquired, use_primary():
+        if not acquired:
+            return {}
+        spool.rotate()
+        for name in spool.segments():
+            records = spool.read(name)
+            for start in range(0, len(records), batch_size):
+                for kind, count in _write_batch(name, records[start:start + batch_size]).items():
+                    written[kind] += count
+            spool.remove(name)
+        spool.write_state({'last_flush': time.time(), 'written': written})
+    return written
+
+
+def metrics():
+    """
+    Backlog (records waiting), lag (seconds since the oldest was received),
+    the last flush and the records set aside as dead letters
+    """
+    names = spool.segments()
+    if os.path.exists(spool._path(ACTIVE_FILE)):
+        names.append(ACTIVE_FILE)
+    backlog = 0
+    oldest = None
+    for name in names:
+        records = spool.read(name)
+        backlog += len(records)
+        if records and oldest is None:
+            oldest = records[0]['received_at']
+    state = spool.read_state()
+    return {
+        'backlog': backlog,
+        'lag_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+        'segments': len(names),
+        'last_flush': state.get('last_flush'),
+        'last_written': state.get('written', {}),
+        'dead_letters': len(spool.dead_letters()),
+    }
+
+
+# ----------------------------------------------------------------------
+# Background flusher
+# ----------------------------------------------------------------------
+
+class Flusher:
+    """
+    Daemon thread flushing the spool every INGEST_FLUSH_INTERVAL seconds
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_started(self):
+        if not getattr(settings, 'INGEST_BACKGROUND_FLUSH', True):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ingest-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        from django.db import connection
+
+        while True:
+            time.sleep(getattr(settings, 'INGEST_FLUSH_INTERVAL', 2))
+            try:
+                flush()
+            except Exception:
+                # The records stay spooled for the next attempt
+                logger.exception("Could not flush the ingestion spool")
+            finally:
+                connection.close()
+
+
+flusher = Flusher()
+
+
+def submit(kind, key, data):
+    """
+    Spool one validated submission and make sure it will be flushed
+    """
+    spool.append(kind, key, data)
+    flusher.ensure_started()
+
+
+# ----------------------------------------------------------------------
+# Validation (no database access)
+# ----------------------------------------------------------------------
+
+def clean_inquiry(fields):
+    """
+    Model-level validation of an inquiry; raises ValidationError
+    """
+    from .models import CustomerInquiry
+
+    inquiry = CustomerInquiry(**fields)
+    inquiry.full_clean(exclude=['car', 'idempotency_key'], validate_unique=False, validate_constraints=False)
+
+
+def clean_signup(email):
+    from .models import NewsletterSubscription
+
+    NewsletterSubscription(email=email).full_clean(validate_unique=False, validate_constraints=False)
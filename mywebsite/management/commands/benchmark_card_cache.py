@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand
+from mywebsite import benchmarks
+from mywebsite.management.commands.benchmark_views import seeded_database
+
+class Command(BaseCommand):
+    help = 'Time a car_list page with the card fragment cache cold and warm on a seeded test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cars', type=int, default=5000, help='Cars in the seeded dataset')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument('--cards', type=int, default=30, help='Cards on the page (per_page)')
+        parser.add_argument('--repeats', type=int, default=20, help='Timed requests per cache state')
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        with seeded_database(options):
+            results = benchmarks.card_cache(options['cards'], options['repeats'])
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        for state in ('cold', 'warm'):
+            result = results['card_cache'][state]
+            self.stdout.write(
+                f"car_list, {options['cards']} cards, {state} cache: {result['time_ms']:.1f}ms, "
+                f"{result['queries']} queries (HTTP {result['status']})"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Total speedup with a warm card cache: x{results['card_cache']['speedup']}"))
@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand
+from mywebsite import benchmarks
+from mywebsite.management.commands.benchmark_views import seeded_database
+
+class Command(BaseCommand):
+    help = 'Compare sync (WSGI) and async (ASGI) throughput of the async views on a seeded test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cars', type=int, default=5000, help='Cars in the seeded dataset')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument('--requests', type=int, default=500, help='Timed requests per handler and level')
+        parser.add_argument('--concurrency', default='1,10,50,200',
+                            help='Comma-separated numbers of requests in flight')
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options['concurrency'].split(',')]
+
+        with seeded_database(options):
+            results = benchmarks.throughput(levels, options['requests'], progress=self.report)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"Total runs: {len(results['views']) * len(levels) * 2} "
+            f"({options['requests']} requests each)"))
+
+    def report(self, name, concurrency, result):
+        self.stdout.write(
+            f"{name} @ {concurrency}: WSGI {result['wsgi_rps']:.0f} req/s, "
+            f"ASGI {result['asgi_rps']:.0f} req/s (x{result['speedup']}), "
+            f"errors {result['wsgi_errors']}/{result['asgi_errors']}"
+        )
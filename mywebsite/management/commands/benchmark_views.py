@@ -0,0 +1,97 @@
+import json
+import tempfile
+from contextlib import ExitStack, contextmanager
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases,
+    teardown_test_environment
+)
+from mywebsite import benchmarks
+from mywebsite.counters import view_counter
+
+@contextmanager
+def seeded_database(options):
+    """
+    A throwaway test database seeded with ``options['cars']`` cars. Spooled
+    submissions, generated logos and images, and cached data (version stamps
+    included) go to temporary directories, away from the site's own, and
+    buffered view counts are dropped with the database.
+    """
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        with ExitStack() as stack:
+            spool_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            media_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            cache_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            cache = {**settings.CACHES['default'], 'LOCATION': cache_dir}
+            if not cache['BACKEND'].endswith('FileBasedCache'):
+                # A server cache can't be given a private namespace to clear
+                # afterwards; the benchmarks run in this one process anyway
+                cache = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmarks'}
+            stack.enter_context(override_settings(
+                INGEST_SPOOL_DIR=spool_dir, INGEST_BACKGROUND_FLUSH=False, MEDIA_ROOT=media_dir,
+                CACHES={'default': cache}, VIEW_COUNTER_BACKGROUND_FLUSH=False,
+            ))
+            Command().seed(options)
+            yield
+    finally:
+        # Flushed at exit, they would land in the real database
+        view_counter.buffer.take()
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the public views on a seeded test database and compare against a JSON baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cars', type=int, default=5000, help='Cars in the seeded dataset')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset')
+        parser.add_argument('--repeats', type=int, default=5, help='Timed requests per scenario')
+        parser.add_argument('--output', default='benchmark-baseline.json', help='Where to write the results')
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help='Fail if any view regressed against this baseline file')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed time/memory growth as a fraction of the baseline')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        with seeded_database(options):
+            results = benchmarks.run(options['repeats'], progress=self.report)
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS(
+            f"Total scenarios benchmarked: {len(results['views'])} (written to {options['output']})"))
+
+        if baseline is not None:
+            regressions = benchmarks.compare(baseline, results, options['threshold'])
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['compare']}")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def seed(self, options):
+        output = StringIO()
+        for command in ('generate_locations', 'generate_brands', 'generate_car_models', 'generate_business_data'):
+            call_command(command, stdout=output)
+        call_command(
+            'generate_inventory', cars=options['cars'], seed=options['seed'],
+            inquiries=options['cars'], stdout=output,
+        )
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name}: {result['queries']} queries, {result['time_ms']:.1f}ms, "
+            f"{result['peak_kib']:.0f}KiB (HTTP {result['status']})"
+        )
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mywebsite import sitemaps
+
+class Command(BaseCommand):
+    help = 'Regenerate the cached sitemap shards whose cars changed since they were built'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--base-url', default=settings.SITE_URL,
+            help='Scheme and host the sitemaps are served from (default: SITE_URL)'
+        )
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+        rebuilt, unchanged = sitemaps.build(base_url)
+        self.stdout.write(f"{unchanged} shards unchanged")
+        self.stdout.write(self.style.SUCCESS(f"Total sitemap shards regenerated: {rebuilt}"))
@@ -0,0 +1,51 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+
+from mywebsite import assets
+
+
+class Command(BaseCommand):
+    help = 'Collect static files with content hashes, drop unreferenced ones and precompress the rest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-prune', action='store_true', help='Keep files no template references')
+        parser.add_argument('--clear', action='store_true', help='Empty STATIC_ROOT before collecting')
+        parser.add_argument(
+            '--report', nargs='*', metavar='PATH',
+            help='Report static bytes per page for these paths (default: / and /cars/list)'
+        )
+
+    def handle(self, *args, **options):
+        call_command('collectstatic', interactive=False, clear=options['clear'], verbosity=0)
+
+        removed = 0
+        if not options['no_prune']:
+            removed = assets.prune(assets.referenced_assets())
+            self.stdout.write(f"Removed {removed} unreferenced file(s)")
+
+        if assets.brotli is None:
+            self.stdout.write(self.style.WARNING("brotli is not installed; writing gzip variants only"))
+        written = assets.compress_all()
+        self.stdout.write(f"Wrote {written} precompressed variant(s)")
+
+        if options['report'] is not None:
+            self.report(options['report'] or ['/', '/cars/list'])
+
+        self.stdout.write(self.style.SUCCESS(f"Total files removed: {removed}, variants written: {written}"))
+
+    def report(self, paths):
+        # Rendered as in production, so the pages link the hashed names
+        pages = {}
+        with override_settings(DEBUG=False):
+            client = Client()
+            for path in paths:
+                pages[path] = client.get(path).content.decode()
+
+        self.stdout.write(f"{'Page':<30} {'Files':>5} {'Identity':>12} {'Gzip':>12} {'Brotli':>12} {'Saved':>12}")
+        for path, totals in assets.page_report(pages).items():
+            self.stdout.write(
+                f"{path:<30} {totals['files']:>5} {totals['identity']:>12,} {totals['gzip']:>12,} "
+                f"{totals['br']:>12,} {totals['saved']:>12,}"
+            )
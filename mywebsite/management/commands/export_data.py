@@ -0,0 +1,47 @@
+import time
+
+from django.core.exceptions import FieldError, ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from mywebsite import exports
+
+class Command(BaseCommand):
+    help = 'Stream cars, inquiries or newsletter subscribers to CSV or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=sorted(exports.EXPORTS), help='What to export')
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--output', default='-', help='File to write (default: stdout)')
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='LOOKUP=VALUE',
+            help='Queryset filter, e.g. status=available or brand__name=Toyota (repeatable)'
+        )
+
+    def handle(self, *args, **options):
+        export = exports.EXPORTS[options['export']]
+        filters = {}
+        for item in options['filter']:
+            lookup, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f"Filters are LOOKUP=VALUE, got {item!r}")
+            filters[lookup] = value
+        try:
+            queryset = export.model.objects.filter(**filters)
+            rows = queryset.count()
+        except (FieldError, ValidationError) as e:
+            raise CommandError(e)
+
+        to_stdout = options['output'] == '-'
+        started = time.perf_counter()
+        if to_stdout:
+            for chunk in export.stream(queryset, options['format']):
+                self.stdout.write(chunk, ending='')
+        else:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                for chunk in export.stream(queryset, options['format']):
+                    f.write(chunk)
+        elapsed = time.perf_counter() - started
+
+        # Keep the summary out of the data when that goes to stdout
+        report = self.stderr if to_stdout else self.stdout
+        report.write(f"{rows / elapsed if elapsed else 0:,.0f} rows/s")
+        report.write(self.style.SUCCESS(f"Total {export.name} exported: {rows}"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from mywebsite import ingest
+
+class Command(BaseCommand):
+    help = 'Write spooled inquiries and newsletter signups to the database and report the backlog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats', action='store_true', help='Only report backlog and lag')
+
+    def handle(self, *args, **options):
+        written = {}
+        if not options['stats']:
+            written = ingest.flush()
+            for kind, count in written.items():
+                self.stdout.write(f"{kind}: {count} written")
+
+        metrics = ingest.metrics()
+        self.stdout.write(
+            f"Backlog: {metrics['backlog']} records in {metrics['segments']} file(s), "
+            f"lag {metrics['lag_seconds']:.1f}s, {metrics['dead_letters']} dead letter(s)"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Total records written: {sum(written.values())}"))
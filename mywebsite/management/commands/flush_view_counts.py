@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from mywebsite.counters import view_counter
+
+class Command(BaseCommand):
+    help = 'Write buffered car and blog post view counts to the database'
+
+    def handle(self, *args, **kwargs):
+        if getattr(settings, 'VIEW_COUNTER_BUFFER', 'memory') != 'cache':
+            # A memory buffer lives in each web process; this one's is empty
+            raise CommandError(
+                "VIEW_COUNTER_BUFFER is 'memory', so every process flushes its own counts. "
+                "Set it to 'cache' to flush them from this command."
+            )
+        updated = view_counter.flush()
+        self.stdout.write(self.style.SUCCESS(f"Total rows updated: {updated}"))
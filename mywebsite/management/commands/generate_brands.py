@@ -43,7 +43,9 @@ class Command(BaseCommand):
             if created:
                 # Create placeholder image
                 logo_path = os.path.join(logos_dir, f"{name.lower().replace(' ', '_')}.png")
-                self.generate_logo(name, logo_path)
+                # Keep a logo that is already there
+                if not os.path.exists(logo_path):
+                    self.generate_logo(name, logo_path)
                 brand.logo.name = f"brand_logos/{os.path.basename(logo_path)}"
                 brand.save()
                 self.stdout.write(self.style.SUCCESS(f"Added brand: {name}"))
@@ -61,4 +63,4 @@ class Command(BaseCommand):
             font = ImageFont.load_default()
 
         draw.text((10, 35), text, fill=(255, 255, 255), font=font)
-        img.save(path)
+        img.save(path, optimize=True)
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from mywebsite.images import file_hash, process_car_image, RENDITIONS
+from mywebsite.models import CarImage
+
+class Command(BaseCommand):
+    help = 'Build thumb/card/hero JPEG and WebP renditions for car images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild even if the source image is unchanged')
+        parser.add_argument(
+            '--check', action='store_true',
+            help='List images with missing or stale renditions without building them; fails if there are any'
+        )
+
+    def handle(self, *args, **options):
+        built = skipped = failed = stale = 0
+
+        for car_image in CarImage.objects.exclude(image='').iterator(chunk_size=200):
+            up_to_date = (
+                not options['force']
+                and car_image.source_hash
+                and set(RENDITIONS) <= set(car_image.renditions or {})
+            )
+            if up_to_date:
+                try:
+                    up_to_date = file_hash(car_image.image) == car_image.source_hash
+                except OSError:
+                    up_to_date = False
+            if up_to_date:
+                skipped += 1
+                continue
+
+            if options['check']:
+                stale += 1
+                self.stdout.write(self.style.WARNING(f"Stale: {car_image.image.name}"))
+                continue
+
+            if process_car_image(car_image.pk) is None:
+                failed += 1
+                self.stdout.write(self.style.WARNING(f"Failed: {car_image.image.name}"))
+            else:
+                built += 1
+                self.stdout.write(self.style.SUCCESS(f"Built renditions: {car_image.image.name}"))
+
+        if options['check']:
+            if stale:
+                raise CommandError(f"{stale} images have missing or stale renditions")
+            self.stdout.write(self.style.SUCCESS(f"Total images checked: {skipped} (all renditions up to date)"))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Total images processed: {built} (skipped {skipped} unchanged, {failed} failed)"))
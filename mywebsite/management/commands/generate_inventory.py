@@ -0,0 +1,229 @@
+import random
+import time
+from array import array
+from decimal import Decimal
+from io import BytesIO
+from multiprocessing import Pool
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils.text import slugify
+from PIL import Image
+
+from mywebsite import conditional, fulltext, homepage, stats
+from mywebsite.facets import facet_index
+from mywebsite.models import (
+    Car, CarImage, CarModel, CarRental, CustomerInquiry, Location
+)
+from mywebsite.slugs import SlugAllocator
+
+CONDITIONS = [c[0] for c in Car.CONDITION_CHOICES]
+FUEL_TYPES = [f[0] for f in Car.FUEL_TYPE_CHOICES]
+TRANSMISSIONS = [t[0] for t in Car.TRANSMISSION_CHOICES]
+DRIVE_TYPES = [d[0] for d in Car.DRIVE_TYPE_CHOICES]
+STATUSES = [s[0] for s in Car.STATUS_CHOICES]
+RENTAL_STATUSES = [s[0] for s in CarRental.RENTAL_STATUS_CHOICES]
+INQUIRY_TYPES = [i[0] for i in CustomerInquiry.INQUIRY_TYPE_CHOICES]
+PLACEHOLDER_IMAGE = 'car_images/placeholder.jpg'
+COLORS = ["White", "Black", "Silver", "Blue", "Red", "Grey"]
+FEATURES = "Power Steering,Airbags,ABS,Alloy Wheels,Reverse Camera"
+NAMES = ["John Mwangi", "Faith Wanjiru", "Alex Mutua", "Diana Otieno", "Brian Kipkoech"]
+MESSAGES = [
+    "Is this car still available?",
+    "Can I book a viewing this weekend?",
+    "What is your best price?",
+    "Do you offer financing on this one?",
+]
+
+
+def chunk_rng(seed, chunk):
+    # One RNG per chunk so output does not depend on the number of workers
+    return random.Random(seed * 1_000_003 + chunk)
+
+
+def build_car_rows(args):
+    """
+    Plain field dicts for one chunk of cars. Runs in worker processes, so it
+    only touches the picklable reference data it is given.
+    """
+    seed, chunk, size, car_models, location_ids = args
+    rng = chunk_rng(seed, chunk)
+    rows = []
+    for _ in range(size):
+        brand_id, car_model_id, brand_name, model_name = rng.choice(car_models)
+        year = rng.randint(2005, 2023)
+        condition = rng.choice(CONDITIONS)
+        rows.append({
+            'brand_id': brand_id,
+            'car_model_id': car_model_id,
+            'year': year,
+            'condition': condition,
+            'engine_size': Decimal(str(round(rng.uniform(1.0, 5.0), 1))),
+            'fuel_type': rng.choice(FUEL_TYPES),
+            'transmission': rng.choice(TRANSMISSIONS),
+            'drive_type': rng.choice(DRIVE_TYPES),
+            'mileage': rng.randint(10000, 150000),
+            'color': rng.choice(COLORS),
+            'doors': rng.randint(2, 5),
+            'seats': rng.randint(4, 7),
+            'price': Decimal(rng.randint(800000, 8000000)),
+            'negotiable': rng.random() < 0.5,
+            'status': rng.choice(STATUSES),
+            'location_id': rng.choice(location_ids),
+            'description': f"A well-maintained {year} {brand_name} {model_name}.",
+            'features': FEATURES,
+            'country_of_import': "Japan" if condition == 'used_foreign' else "",
+            'import_duty_paid': condition == 'used_foreign' and rng.random() < 0.5,
+            'is_featured': rng.random() < 0.05,
+            'slug_base': slugify(f"{year}-{brand_name}-{model_name}"),
+        })
+    return rows
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate a synthetic inventory (cars, images, rentals, inquiries) for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cars', type=int, default=1000, help='Number of cars to create')
+        parser.add_argument('--images-per-car', type=int, default=3, help='CarImage rows per car')
+        parser.add_argument('--rental-ratio', type=float, default=0.1, help='Fraction of cars offered for rent')
+        parser.add_argument('--inquiries', type=int, default=0, help='Number of customer inquiries to create')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per INSERT batch')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to build rows')
+        parser.add_argument('--image-path', default=PLACEHOLDER_IMAGE,
+                            help='Image in MEDIA_ROOT stored on every generated CarImage '
+                                 '(the default placeholder is created if missing)')
+
+    def handle(self, *args, **options):
+        car_models = list(CarModel.objects.values_list('brand_id', 'id', 'brand__name', 'name'))
+        location_ids = list(Location.objects.values_list('id', flat=True))
+        if not car_models or not location_ids:
+            self.stdout.write(self.style.ERROR(
+                "Please run generate_brands, generate_car_models and generate_locations first."))
+            return
+        if options['images_per_car']:
+            self.ensure_image(options['image_path'])
+
+        started = time.monotonic()
+        self.options = options
+        self.slugs = SlugAllocator(Car).preload()
+        car_ids = array('q')
+
+        batch_size = options['batch_size']
+        total = options['cars']
+        chunks = [
+            (options['seed'], chunk, min(batch_size, total - start), car_models, location_ids)
+            for chunk, start in enumerate(range(0, total, batch_size))
+        ]
+
+        pool = Pool(options['workers']) if options['workers'] > 1 else None
+        try:
+            row_chunks = pool.imap(build_car_rows, chunks) if pool else map(build_car_rows, chunks)
+            for chunk, rows in enumerate(row_chunks):
+                car_ids.extend(self.insert_cars(chunk, rows))
+                self.stdout.write(f"Cars: {len(car_ids)}/{total}")
+
+            inquiries = self.insert_inquiries(car_ids)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        # bulk_create skips the signals that keep these in sync
+        if fulltext.is_available():
+            fulltext.rebuild()
+        stats.rebuild()
+        facet_index.invalidate()
+        homepage.invalidate()
+        conditional.invalidate()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Total cars created: {len(car_ids)} "
+            f"({len(car_ids) * options['images_per_car']} images, {inquiries} inquiries) "
+            f"in {elapsed:.1f}s"))
+
+    def ensure_image(self, path):
+        if default_storage.exists(path):
+            return
+        if path != PLACEHOLDER_IMAGE:
+            raise CommandError(f"--image-path {path} does not exist in MEDIA_ROOT")
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), color=(200, 200, 200)).save(buffer, 'JPEG', quality=80)
+        default_storage.save(path, ContentFile(buffer.getvalue()))
+        self.stdout.write(f"Created placeholder image: {path}")
+
+    def insert_cars(self, chunk, rows):
+        options = self.options
+        rng = chunk_rng(options['seed'] + 1, chunk)
+        cars = []
+        for row in rows:
+            slug = self.slugs.allocate(row.pop('slug_base'))
+            cars.append(Car(slug=slug, **row))
+
+        with transaction.atomic():
+            cars = Car.objects.bulk_create(cars, batch_size=options['batch_size'])
+            ids = [car.pk for car in cars]
+
+            images = [
+                CarImage(car_id=car_id, image=options['image_path'], is_primary=order == 0, order=order)
+                for car_id in ids
+                for order in range(options['images_per_car'])
+            ]
+            CarImage.objects.bulk_create(images, batch_size=options['batch_size'])
+            if images:
+                first_image = CarImage.objects.filter(
+                    car_id=OuterRef('pk'), is_primary=True
+                ).order_by('order', 'id').values('id')[:1]
+                Car.objects.filter(pk__in=ids).update(primary_image=Subquery(first_image))
+
+            rentals = []
+            for car_id in ids:
+                if rng.random() >= options['rental_ratio']:
+                    continue
+                daily_rate = Decimal(rng.randint(3000, 10000))
+                rentals.append(CarRental(
+                    car_id=car_id,
+                    daily_rate=daily_rate,
+                    weekly_rate=daily_rate * 7 * Decimal('0.9'),
+                    monthly_rate=daily_rate * 30 * Decimal('0.8'),
+                    minimum_age=rng.choice([21, 23, 25]),
+                    requires_deposit=True,
+                    deposit_amount=daily_rate * 2,
+                    max_rental_days=rng.randint(15, 60),
+                    mileage_limit_per_day=rng.choice([100, 150, 200]),
+                    extra_mileage_charge=Decimal(rng.choice([10, 15, 20])),
+                    rental_status=rng.choice(RENTAL_STATUSES),
+                ))
+            CarRental.objects.bulk_create(rentals, batch_size=options['batch_size'])
+        return ids
+
+    def insert_inquiries(self, car_ids):
+        options = self.options
+        total = options['inquiries']
+        if not total or not car_ids:
+            return 0
+
+        batch_size = options['batch_size']
+        created = 0
+        for chunk, start in enumerate(range(0, total, batch_size)):
+            rng = chunk_rng(options['seed'] + 2, chunk)
+            inquiries = [
+                CustomerInquiry(
+                    car_id=car_ids[rng.randrange(len(car_ids))],
+                    inquiry_type=rng.choice(INQUIRY_TYPES),
+                    customer_name=rng.choice(NAMES),
+                    customer_phone=f"07{rng.randint(0, 99999999):08d}",
+                    message=rng.choice(MESSAGES),
+                )
+                for _ in range(min(batch_size, total - start))
+            ]
+            with transaction.atomic():
+                CustomerInquiry.objects.bulk_create(inquiries, batch_size=batch_size)
+            created += len(inquiries)
+            self.stdout.write(f"Inquiries: {created}/{total}")
+        return created
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from mywebsite import optimize
+
+
+class Command(BaseCommand):
+    help = 'Re-encode uploaded images in MEDIA_ROOT in parallel, skipping files already optimized'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Worker processes (default: one per CPU)')
+        parser.add_argument(
+            '--format', choices=['auto', 'jpeg', 'webp'], default='auto',
+            help='auto keeps JPEGs as JPEG and lossless PNGs as PNG'
+        )
+        parser.add_argument('--max-size', type=int, help='Longest edge in pixels (default: MEDIA_OPTIMIZE_MAX_SIZE)')
+        parser.add_argument('--dry-run', action='store_true', help='Report the savings without writing anything')
+
+    def handle(self, *args, **options):
+        def progress(result):
+            if result['status'] == 'optimized':
+                self.stdout.write(
+                    f"{result['name']}: {result['source_bytes']:,} -> {result['bytes']:,} bytes ({result['format']})"
+                )
+            elif result['status'] == 'failed':
+                self.stdout.write(self.style.WARNING(f"Failed: {result['name']} ({result['error']})"))
+
+        totals = optimize.run(
+            workers=options['workers'], target_format=options['format'],
+            max_size=options['max_size'], dry_run=options['dry_run'], progress=progress,
+        )
+
+        saved = totals['source_bytes'] - totals['bytes']
+        seconds = totals['seconds'] or 1e-9
+        self.stdout.write(
+            f"Optimized {totals['optimized']} ({totals['renamed']} renamed), kept {totals['kept']}, "
+            f"skipped {totals['unchanged']} unchanged, {totals['failed']} failed"
+        )
+        self.stdout.write(
+            f"Throughput: {totals['files'] / seconds:.1f} files/s, "
+            f"{totals['source_bytes'] / seconds / 2 ** 20:.1f} MiB/s over {totals['seconds']:.1f}s"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Total bytes saved: {saved:,} of {totals['source_bytes']:,}"
+            + (" (dry run)" if options['dry_run'] else "")
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from mywebsite import conditional, homepage, stats
+from mywebsite.models import InventoryStat
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized inventory statistics from the car table'
+
+    def handle(self, *args, **kwargs):
+        drifted = stats.rebuild()
+        homepage.invalidate()
+        conditional.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f"Total stat rows: {InventoryStat.objects.count()} ({drifted} corrected)"))
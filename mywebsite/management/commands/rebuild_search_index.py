@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from mywebsite import fulltext
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text (FTS5) car search index from the car table'
+
+    def handle(self, *args, **kwargs):
+        if not fulltext.is_available():
+            self.stdout.write(self.style.ERROR(
+                "Full-text index table not found. Run migrate on an SQLite database with FTS5."))
+            return
+
+        total = fulltext.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Total cars indexed: {total}"))
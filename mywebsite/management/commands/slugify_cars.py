@@ -1,23 +1,54 @@
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.text import slugify
+from mywebsite import cards, conditional, homepage
 from mywebsite.models import Car
+from mywebsite.slugs import SlugAllocator
 
 class Command(BaseCommand):
     help = "Generate unique slugs for all cars that don't have one"
 
-    def handle(self, *args, **kwargs):
-        updated = 0
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Cars updated per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        allocator = SlugAllocator(Car).preload()
+        missing = Car.objects.filter(Q(slug__isnull=True) | Q(slug='')).order_by('pk').values_list(
+            'pk', 'year', 'brand__name', 'car_model__name'
+        )
 
-        for car in Car.objects.filter(slug__isnull=True):
-            base_slug = slugify(f"{car.year}-{car.brand.name}-{car.car_model.name}")
-            slug = base_slug
-            counter = 1
-            while Car.objects.filter(slug=slug).exclude(pk=car.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            car.slug = slug
-            car.save(update_fields=['slug'])
-            updated += 1
-            self.stdout.write(self.style.SUCCESS(f"Updated slug: {car} → {slug}"))
+        updated = 0
+        last_pk = 0
+        while True:
+            rows = list(missing.filter(pk__gt=last_pk)[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            updated += self.write([
+                (allocator.allocate(slugify(f"{year}-{brand_name}-{model_name}")), pk)
+                for pk, year, brand_name, model_name in rows
+            ])
 
+        if updated:
+            # Raw UPDATEs skip the signals that invalidate these
+            homepage.invalidate()
+            conditional.invalidate()
+            cards.invalidate()
         self.stdout.write(self.style.SUCCESS(f"Total cars updated with slugs: {updated}"))
+
+    def write(self, slugs):
+        # One prepared UPDATE for the batch; bulk_update's CASE expressions
+        # cost more than the writes themselves. updated_at moves too, so the
+        # sitemap shards, card keys and validators built from it change.
+        table = connection.ops.quote_name(Car._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {table} SET slug = %s, updated_at = %s WHERE id = %s",
+                [(slug, now, pk) for slug, pk in slugs],
+            )
+        self.stdout.write(f"Updated slugs: {slugs[0][0]} … {slugs[-1][0]}")
+        return len(slugs)
@@ -0,0 +1,49 @@
+import sqlite3
+import time
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+def replica_path(name):
+    # Replicas are configured as read-only file: URIs
+    if name.startswith('file:'):
+        return unquote(urlsplit(name).path)
+    return name
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database into the local replica files (a stand-in for replication)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep copying every this many seconds (0 copies once)')
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if 'sqlite3' not in primary['ENGINE']:
+            raise CommandError("Only SQLite primaries can be copied; use real replication for other databases")
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured (set CARSOKO_REPLICA_DATABASES)")
+
+        copies = 0
+        while True:
+            for alias in settings.DATABASE_REPLICAS:
+                self.copy(primary['NAME'], replica_path(settings.DATABASES[alias]['NAME']))
+                copies += 1
+                self.stdout.write(f"{alias}: copied from {primary['NAME']}")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Total replica copies: {copies}"))
+
+    def copy(self, source_path, target_path):
+        # The backup API gives a consistent snapshot while the primary is in use
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
@@ -0,0 +1,252 @@
+"""
+Request middleware: replica read routing, and a query budget / N+1
+detector for development and staging.
+
+``ReplicaRoutingMiddleware`` lets the listing views in ``REPLICA_READ_VIEWS``
+read from the replica databases (see ``mywebsite.routers``) and keeps a
+client that has just written (with a POST or other non-safe method, or
+``routers.mark_written()``) on the primary for ``REPLICA_STICKY_SECONDS``.
+
+``QueryBudgetMiddleware`` counts the SQL queries run while a view builds its
+response and groups them by shape (the SQL with parameters and ``IN`` lists
+collapsed). A shape that repeats ``QUERY_BUDGET_REPEAT_THRESHOLD`` times is
+reported as a likely N+1, with the template line or Python frame that issued
+it. The numbers are attached as ``X-Query-Count``, ``X-Query-Time-Ms`` and
+``X-Query-Repeated`` response headers.
+
+``QUERY_BUDGETS`` maps URL names to the most queries a request may run.
+Exceeding a budget is logged, or raises ``QueryBudgetExceeded`` when
+``QUERY_BUDGET_RAISE`` is set (tests).
+
+Async views run their queries in ``sync_to_async`` threads, on those
+threads' connections, so the budget hook is installed on every connection
+(as it is opened) and finds the request's ``QueryLog`` through a context
+variable, which ``sync_to_async`` carries into the thread.
+"""
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Node
+from django.urls import Resolver404, resolve
+
+from . import routers
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+_NUMBER = re.compile(r'\b\d+\b')
+
+_RENDER_CODE = Node.render_annotated.__code__
+_PROJECT_DIR = str(settings.BASE_DIR)
+
+# Methods whose writes are incidental (view counts), not the client's
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+# The QueryLog of the request being handled, if any
+_query_log = ContextVar('mywebsite_query_log', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def sql_shape(sql):
+    """
+    The SQL with the parts that vary between N+1 siblings collapsed
+    """
+    return _NUMBER.sub('N', _IN_LIST.sub('(...)', sql))
+
+
+def query_origin():
+    """
+    Where the current query comes from: the template line being rendered,
+    or else the innermost frame in project code
+    """
+    frame = sys._getframe(2)
+    python_origin = None
+    while frame is not None:
+        if frame.f_code is _RENDER_CODE:
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                return f"{origin.template_name or origin.name}:{token.lineno}"
+        filename = frame.f_code.co_filename
+        if (python_origin is None and filename.startswith(_PROJECT_DIR)
+                and 'site-packages' not in filename and filename != __file__):
+            python_origin = f"{os.path.relpath(filename, _PROJECT_DIR)}:{frame.f_lineno}"
+        frame = frame.f_back
+    return python_origin or 'unknown'
+
+
+class QueryLog:
+    """
+    ``execute_wrapper`` hook that tallies one request's queries, on every
+    database alias
+    """
+
+    def __init__(self, repeat_threshold):
+        self.repeat_threshold = repeat_threshold
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            shape = sql_shape(sql)
+            self.shapes[shape] += 1
+            if self.shapes[shape] == self.repeat_threshold:
+                self.origins[shape] = query_origin()
+
+    @property
+    def repeated(self):
+        return {
+            shape: count for shape, count in self.shapes.items()
+            if count >= self.repeat_threshold
+        }
+
+
+def _log_query(execute, sql, params, many, context):
+    log = _query_log.get()
+    if log is None:
+        return execute(sql, params, many, context)
+    return log(execute, sql, params, many, context)
+
+
+def install(connection, **kwargs):
+    """
+    Route a connection's queries to the current request's QueryLog
+    """
+    if _log_query not in connection.execute_wrappers:
+        # First, so the pop() of an active execute_wrapper() block isn't ours
+        connection.execute_wrappers.insert(0, _log_query)
+
+
+def _install_all():
+    # Replica reads count against the budget too
+    for conn in connections.all():
+        install(conn)
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', settings.DEBUG):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        connection_created.connect(install, dispatch_uid='mywebsite.middleware.install')
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _log(self):
+        return QueryLog(getattr(settings, 'QUERY_BUDGET_REPEAT_THRESHOLD', 3))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        _install_all()
+        log = self._log()
+        token = _query_log.set(log)
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_log.reset(token)
+        return self._finish(request, response, log)
+
+    async def __acall__(self, request):
+        # Connections opened before the hook was connected, in the thread
+        # that runs thread-sensitive ORM calls
+        await sync_to_async(_install_all)()
+        log = self._log()
+        token = _query_log.set(log)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_log.reset(token)
+        return self._finish(request, response, log)
+
+    def _finish(self, request, response, log):
+        repeated = log.repeated
+        response['X-Query-Count'] = str(log.count)
+        response['X-Query-Time-Ms'] = f"{log.duration * 1000:.1f}"
+        response['X-Query-Repeated'] = str(len(repeated))
+
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        for shape, count in repeated.items():
+            logger.warning(
+                "Possible N+1 in %s (%s): %d x %s", url_name or request.path,
+                log.origins.get(shape, 'unknown'), count, shape[:200]
+            )
+
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+        if budget is not None:
+            response['X-Query-Budget'] = str(budget)
+            if log.count > budget:
+                message = f"{url_name} ran {log.count} queries (budget {budget})"
+                if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'DATABASE_REPLICAS', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.read_views = frozenset(getattr(settings, 'REPLICA_READ_VIEWS', ()))
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+        self.cookie_name = getattr(settings, 'REPLICA_STICKY_COOKIE', 'db_primary')
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _state(self, request):
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            url_name = None
+        sticky = request.get_signed_cookie(self.cookie_name, default=None, max_age=self.sticky_seconds)
+        return routers.RoutingState(
+            replicas_allowed=url_name in self.read_views and request.method in ('GET', 'HEAD') and not sticky
+        )
+
+    def _finish(self, request, response, state):
+        if state.sticky or (state.wrote and request.method not in SAFE_METHODS):
+            # Read your own writes: stay on the primary until replicas catch up
+            response.set_signed_cookie(
+                self.cookie_name, '1', max_age=self.sticky_seconds, httponly=True, samesite='Lax'
+            )
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routers.routing(self._state(request)) as state:
+            response = self.get_response(request)
+        return self._finish(request, response, state)
+
+    async def __acall__(self, request):
+        with routers.routing(self._state(request)) as state:
+            response = await self.get_response(request)
+        return self._finish(request, response, state)
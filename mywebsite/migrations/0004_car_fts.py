@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS mywebsite_car_fts USING fts5("
+            "brand, model, description, features, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        cursor.execute(
+            "INSERT INTO mywebsite_car_fts (rowid, brand, model, description, features) "
+            "SELECT c.id, b.name, m.name, COALESCE(c.description, ''), COALESCE(c.features, '') "
+            "FROM mywebsite_car c "
+            "INNER JOIN mywebsite_brand b ON b.id = c.brand_id "
+            "INNER JOIN mywebsite_carmodel m ON m.id = c.car_model_id"
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS mywebsite_car_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mywebsite', '0003_car_slug'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
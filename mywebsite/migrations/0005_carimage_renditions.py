@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mywebsite', '0004_car_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carimage',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='carimage',
+            name='source_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+    ]
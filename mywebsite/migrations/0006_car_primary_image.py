@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_primary_image(apps, schema_editor):
+    Car = apps.get_model('mywebsite', 'Car')
+    CarImage = apps.get_model('mywebsite', 'CarImage')
+    primary = {}
+    for image_id, car_id in CarImage.objects.order_by(
+        'car_id', '-is_primary', 'order', 'uploaded_at', 'id'
+    ).values_list('id', 'car_id'):
+        primary.setdefault(car_id, image_id)
+    for car_id, image_id in primary.items():
+        Car.objects.filter(pk=car_id).update(primary_image_id=image_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mywebsite', '0005_carimage_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='primary_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='mywebsite.carimage'),
+        ),
+        migrations.RunPython(populate_primary_image, migrations.RunPython.noop),
+    ]
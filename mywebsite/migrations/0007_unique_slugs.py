@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:28
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def deduplicate_slugs(apps, schema_editor):
+    """
+    Give every row but the oldest a fresh slug (``slug-1``, ``slug-2``, ...)
+    so the unique index can be created; empty slugs become NULL
+    """
+    for model_name in ('Brand', 'Car'):
+        model = apps.get_model('mywebsite', model_name)
+        model.objects.filter(slug='').update(slug=None)
+        duplicates = (
+            model.objects.exclude(slug=None).values('slug')
+            .annotate(rows=Count('id')).filter(rows__gt=1)
+            .values_list('slug', flat=True)
+        )
+        for slug in list(duplicates):
+            taken = set(
+                model.objects.filter(Q(slug=slug) | Q(slug__gte=f"{slug}-", slug__lt=f"{slug}."))
+                .order_by().values_list('slug', flat=True)
+            )
+            counter = 0
+            for pk in model.objects.filter(slug=slug).order_by('id').values_list('id', flat=True)[1:]:
+                counter += 1
+                while f"{slug}-{counter}" in taken:
+                    counter += 1
+                taken.add(f"{slug}-{counter}")
+                model.objects.filter(pk=pk).update(slug=f"{slug}-{counter}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mywebsite', '0006_car_primary_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='brand',
+            name='slug',
+            field=models.SlugField(blank=True, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='car',
+            name='slug',
+            field=models.SlugField(blank=True, null=True, unique=True),
+        ),
+    ]
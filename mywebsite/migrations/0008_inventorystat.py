@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:44
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q
+
+
+def populate_inventory_stats(apps, schema_editor):
+    """
+    One summary row for all cars and one per brand, car model, location and
+    year, as mywebsite.stats computes them
+    """
+    Car = apps.get_model('mywebsite', 'Car')
+    InventoryStat = apps.get_model('mywebsite', 'InventoryStat')
+
+    available = Q(status='available')
+    aggregates = {
+        'cars': Count('id'),
+        'available': Count('id', filter=available),
+        'available_for_rent': Count('id', filter=available & Q(rental_info__isnull=False)),
+        'min_price': Min('price'),
+        'max_price': Max('price'),
+        'available_min_price': Min('price', filter=available),
+        'available_max_price': Max('price', filter=available),
+    }
+    rows = [InventoryStat(dimension='all', value=0, **Car.objects.aggregate(**aggregates))]
+    dimensions = {'brand': 'brand_id', 'car_model': 'car_model_id', 'location': 'location_id', 'year': 'year'}
+    for dimension, field in dimensions.items():
+        for values in Car.objects.values(field).order_by().annotate(**aggregates):
+            value = values.pop(field)
+            rows.append(InventoryStat(dimension=dimension, value=value, **values))
+    InventoryStat.objects.bulk_create([row for row in rows if row.cars])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mywebsite', '0007_unique_slugs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('all', 'All Cars'), ('brand', 'Brand'), ('car_model', 'Car Model'), ('location', 'Location'), ('year', 'Year')], max_length=20)),
+                ('value', models.IntegerField(default=0, help_text='Brand/model/location id or year; 0 for all cars')),
+                ('cars', models.IntegerField(default=0)),
+                ('available', models.IntegerField(default=0)),
+                ('available_for_rent', models.IntegerField(default=0)),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('available_min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('available_max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+            ],
+            options={
+                'unique_together': {('dimension', 'value')},
+            },
+        ),
+        migrations.RunPython(populate_inventory_stats, migrations.RunPython.noop),
+    ]
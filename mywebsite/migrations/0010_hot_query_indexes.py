@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mywebsite', '0009_inquiry_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['status', 'is_featured', '-created_at'], name='car_status_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['brand', 'car_model', '-year'], name='car_brand_model_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['location', '-created_at'], name='car_location_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['-created_at'], name='car_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customerinquiry',
+            index=models.Index(fields=['status', '-created_at'], name='inquiry_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customerinquiry',
+            index=models.Index(fields=['-created_at'], name='inquiry_created_idx'),
+        ),
+    ]
@@ -2,14 +2,17 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
-from PIL import Image
 import os
+from django.core.files.storage import default_storage
 from django.utils.text import slugify
+from .counters import view_counter
+from .slugs import save_with_slug
+from . import images as image_pipeline
 
 # Car Brand Model
 class Brand(models.Model):
     name = models.CharField(max_length=100, unique=True)
-    slug = models.SlugField( blank=True, null=True)  # NEW FIELD
+    slug = models.SlugField(unique=True, blank=True, null=True)
     logo = models.ImageField(upload_to='brand_logos/', blank=True, null=True)
     country_of_origin = models.CharField(max_length=100, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -19,13 +22,7 @@ class Brand(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug and self.name:
-            base_slug = slugify(self.name)
-            slug = base_slug
-            counter = 1
-            while Brand.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            return save_with_slug(self, slugify(self.name), lambda: super(Brand, self).save(*args, **kwargs))
         super().save(*args, **kwargs)
 
     class Meta:
@@ -137,7 +134,13 @@ class Car(models.Model):
     country_of_import = models.CharField(max_length=100, blank=True, null=True)
     import_duty_paid = models.BooleanField(default=False)
 
-    slug = models.SlugField( blank=True, null=True)  
+    slug = models.SlugField(unique=True, blank=True, null=True)
+
+    # Cover image for listings, kept in sync by CarImage signals
+    primary_image = models.ForeignKey(
+        'CarImage', on_delete=models.SET_NULL, blank=True, null=True,
+        related_name='+', editable=False
+    )
     
     # Metadata
     is_featured = models.BooleanField(default=False)
@@ -150,21 +153,44 @@ class Car(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            base_slug = slugify(f"{self.year}-{self.brand.name}-{self.car_model.name}")
-            slug = base_slug
-            counter = 1
-            while Car.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            return save_with_slug(self, self.base_slug(), lambda: super(Car, self).save(*args, **kwargs))
         super().save(*args, **kwargs)
 
+    def base_slug(self):
+        return slugify(f"{self.year}-{self.brand.name}-{self.car_model.name}")
+
     def increment_views(self):
+        # Buffered; written in batches by mywebsite.counters
+        self.views_count += 1
+        view_counter.record(self)
+
+    async def aincrement_views(self):
         self.views_count += 1
-        self.save(update_fields=['views_count'])
+        await view_counter.arecord(self)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Homepage featured/recent cars
+            models.Index(fields=['status', 'is_featured', '-created_at'], name='car_status_featured_idx'),
+            # Similar cars on the detail page
+            models.Index(fields=['brand', 'car_model', '-year'], name='car_brand_model_year_idx'),
+            # Cars from the same location
+            models.Index(fields=['location', '-created_at'], name='car_location_created_idx'),
+            # Default ordering (admin changelist)
+            models.Index(fields=['-created_at'], name='car_created_idx'),
+        ]
+
+
+def update_primary_image(car_id):
+    """
+    Point Car.primary_image at the flagged primary image, or else the first
+    image in display order
+    """
+    image_id = CarImage.objects.filter(car_id=car_id).order_by(
+        '-is_primary', 'order', 'uploaded_at', 'id'
+    ).values_list('id', flat=True).first()
+    Car.objects.filter(pk=car_id).update(primary_image_id=image_id)
 
 # Car Images Model
 class CarImage(models.Model):
@@ -174,20 +200,64 @@ class CarImage(models.Model):
     is_primary = models.BooleanField(default=False)
     order = models.IntegerField(default=0)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+
+    # Resized copies written by mywebsite.images:
+    # {'card': {'width': 500, 'height': 375, 'jpg': path, 'webp': path}, ...}
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    source_hash = models.CharField(max_length=40, blank=True, editable=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loaded_image_name = self.image.name if self.image else None
     
     def save(self, *args, **kwargs):
         # Ensure only one primary image per car
         if self.is_primary:
             CarImage.objects.filter(car=self.car, is_primary=True).update(is_primary=False)
+        image_changed = self._state.adding or (self.image.name or None) != self._loaded_image_name
         super().save(*args, **kwargs)
         
-        # Resize image to optimize storage
-        if self.image:
-            img = Image.open(self.image.path)
-            if img.height > 800 or img.width > 1200:
-                output_size = (1200, 800)
-                img.thumbnail(output_size)
-                img.save(self.image.path)
+        # Renditions are built off the request path, and only for new files
+        if self.image and image_changed:
+            self._loaded_image_name = self.image.name
+            image_pipeline.schedule(self.pk)
+
+    def rendition_url(self, name, extension='jpg'):
+        """
+        URL of a rendition, falling back to the original until it exists
+        """
+        path = (self.renditions or {}).get(name, {}).get(extension)
+        if path:
+            return default_storage.url(path)
+        return self.image.url if self.image else ''
+
+    @property
+    def thumb_url(self):
+        return self.rendition_url('thumb')
+
+    @property
+    def card_url(self):
+        return self.rendition_url('card')
+
+    @property
+    def hero_url(self):
+        return self.rendition_url('hero')
+
+    def _srcset(self, extension):
+        entries = []
+        for name in ('thumb', 'card', 'hero'):
+            entry = (self.renditions or {}).get(name)
+            if entry and entry.get(extension):
+                entries.append(f"{default_storage.url(entry[extension])} {entry['width']}w")
+        return ', '.join(entries)
+
+    @property
+    def srcset(self):
+        return self._srcset('jpg')
+
+    @property
+    def webp_srcset(self):
+        return self._srcset('webp')
     
     def __str__(self):
         return f"Image for {self.car}"
@@ -264,6 +334,9 @@ class CustomerInquiry(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='new')
     notes = models.TextField(blank=True, null=True, help_text="Internal notes")
     
+    # Set by the ingestion spool (mywebsite.ingest) so replays are skipped
+    idempotency_key = models.CharField(max_length=64, unique=True, blank=True, null=True, editable=False)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -273,6 +346,11 @@ class CustomerInquiry(models.Model):
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = "Customer Inquiries"
+        indexes = [
+            # Admin status filter and date drill-down
+            models.Index(fields=['status', '-created_at'], name='inquiry_status_created_idx'),
+            models.Index(fields=['-created_at'], name='inquiry_created_idx'),
+        ]
 
 # Business Configuration Model
 class BusinessConfig(models.Model):
@@ -353,6 +431,11 @@ class BlogPost(models.Model):
     
     def __str__(self):
         return self.title
+
+    def increment_views(self):
+        # Buffered; written in batches by mywebsite.counters
+        self.views_count += 1
+        view_counter.record(self)
     
     class Meta:
         ordering = ['-published_at']
@@ -421,4 +504,33 @@ class ContactMessage(models.Model):
         return f"Message from {self.name} - {self.subject}"
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+
+# Inventory Statistics Model (summary rows maintained by mywebsite.stats)
+class InventoryStat(models.Model):
+    DIMENSION_CHOICES = [
+        ('all', 'All Cars'),
+        ('brand', 'Brand'),
+        ('car_model', 'Car Model'),
+        ('location', 'Location'),
+        ('year', 'Year'),
+    ]
+
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    value = models.IntegerField(default=0, help_text="Brand/model/location id or year; 0 for all cars")
+
+    cars = models.IntegerField(default=0)
+    available = models.IntegerField(default=0)
+    available_for_rent = models.IntegerField(default=0)
+
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    available_min_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    available_max_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.get_dimension_display()} {self.value}: {self.available} available"
+
+    class Meta:
+        unique_together = ['dimension', 'value']
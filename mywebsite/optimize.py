@@ -0,0 +1,373 @@
+"""
+Bulk re-optimization of uploaded media.
+
+``manage.py optimize_media`` walks MEDIA_ROOT and re-encodes every image on
+a process pool. Each image gets its EXIF orientation applied, metadata
+stripped (the colour profile is kept) and its size capped at
+``MEDIA_OPTIMIZE_MAX_SIZE``. JPEGs become progressive JPEGs. PNGs stay
+lossless unless they are photos, where a JPEG is less than half the size,
+or everything can be converted to WebP with ``--format webp``. A file is
+only replaced when the result is smaller or had to change (rotated,
+resized or renamed). ``.jfif`` files are renamed to ``.jpg``, and every
+ImageField pointing at a renamed file is updated in place.
+
+Progress is kept in a JSON-lines journal next to the media
+(``MEDIA_OPTIMIZE_MANIFEST``) holding the content hash of every file
+already handled, so a re-run only reads unchanged files and skips them.
+A replacement is journalled as pending before the new file is moved into
+place, and as done once the database and the old file are updated. An
+interrupted run therefore resumes where it stopped and never re-encodes
+its own output.
+
+Workers only read and encode files; the main process moves files, writes
+the journal and updates the database.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from PIL import ExifTags, Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.jfif', '.png', '.webp'}
+# Extensions each output format may keep; the first is used on a rename
+FORMAT_EXTENSIONS = {
+    'JPEG': ['.jpg', '.jpeg'],
+    'PNG': ['.png'],
+    'WEBP': ['.webp'],
+}
+# Generated by the rendition pipeline (mywebsite.images), already optimized
+EXCLUDED_PREFIXES = ('car_images/renditions/',)
+TMP_SUFFIX = '.optimize-tmp'
+
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+# An opaque PNG is treated as a photo if a JPEG is this much smaller
+PHOTO_JPEG_RATIO = 0.5
+
+PENDING = 'pending'
+DONE = 'done'
+
+
+def _sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+# ----------------------------------------------------------------------
+# Encoding (runs in the worker processes)
+# ----------------------------------------------------------------------
+
+def _has_alpha(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
+
+def _save(img, fmt, icc_profile):
+    buffer = BytesIO()
+    extra = {'icc_profile': icc_profile} if icc_profile else {}
+    if fmt == 'JPEG':
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True, **extra)
+    elif fmt == 'WEBP':
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if _has_alpha(img) else 'RGB')
+        img.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6, **extra)
+    else:
+        if img.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            img = img.convert('RGBA' if _has_alpha(img) else 'RGB')
+        img.save(buffer, 'PNG', optimize=True, **extra)
+    return buffer.getvalue()
+
+
+def encode(img, source_format, target_format='auto'):
+    """
+    (format, bytes) for an image; ``target_format`` is auto, jpeg or webp
+    """
+    icc_profile = img.info.get('icc_profile')
+    if target_format == 'webp':
+        return 'WEBP', _save(img, 'WEBP', icc_profile)
+    if _has_alpha(img):
+        return 'PNG', _save(img, 'PNG', icc_profile)
+    if target_format == 'jpeg' or source_format == 'JPEG':
+        return 'JPEG', _save(img, 'JPEG', icc_profile)
+    if source_format == 'WEBP':
+        return 'WEBP', _save(img, 'WEBP', icc_profile)
+    png = _save(img, 'PNG', icc_profile)
+    jpeg = _save(img, 'JPEG', icc_profile)
+    if len(jpeg) < len(png) * PHOTO_JPEG_RATIO:
+        return 'JPEG', jpeg
+    return 'PNG', png
+
+
+def optimize_file(root, name, known_hash, target_format, max_size, dry_run):
+    """
+    Re-encode one file. Writes the result to ``<name>.optimize-tmp`` and
+    returns what happened; never touches the original or the database.
+    """
+    path = os.path.join(root, name)
+    with open(path, 'rb') as f:
+        data = f.read()
+    source_hash = _sha1(data)
+    result = {'name': name, 'source_hash': source_hash, 'source_bytes': len(data)}
+    if source_hash == known_hash:
+        return dict(result, status='unchanged')
+
+    try:
+        img = Image.open(BytesIO(data))
+        source_format = img.format
+        oriented = img.getexif().get(ExifTags.Base.Orientation, 1) != 1
+        img = ImageOps.exif_transpose(img)
+        resized = max(img.size) > max_size
+        if resized:
+            img.thumbnail((max_size, max_size), Image.LANCZOS)
+        fmt, encoded = encode(img, source_format, target_format)
+    except Exception as exc:
+        return dict(result, status='failed', error=str(exc))
+
+    extension = os.path.splitext(name)[1].lower()
+    renamed = extension not in FORMAT_EXTENSIONS[fmt]
+    if len(encoded) >= len(data) and not (oriented or resized):
+        if not renamed:
+            return dict(result, status='kept')
+        if fmt == source_format:
+            # Only the extension is wrong: keep the original bytes
+            encoded = data
+
+    if not dry_run:
+        with open(path + TMP_SUFFIX, 'wb') as f:
+            f.write(encoded)
+    return dict(
+        result, status='optimized', format=fmt, renamed=renamed,
+        hash=_sha1(encoded), bytes=len(encoded),
+    )
+
+
+# ----------------------------------------------------------------------
+# Journal
+# ----------------------------------------------------------------------
+
+class Manifest:
+    """
+    Append-only JSON-lines journal; the last entry for a path wins
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+    def load(self):
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return self
+        with open(self.path) as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final line from an interrupted run
+                    logger.error("Skipping unreadable manifest line %s:%d", self.path, number)
+                    continue
+                self.entries[entry['path']] = entry
+        return self
+
+    def record(self, **entry):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries[entry['path']] = entry
+
+    def known_hash(self, path):
+        entry = self.entries.get(path)
+        return entry['hash'] if entry and entry['state'] == DONE else None
+
+    def pending(self):
+        return [entry for entry in self.entries.values() if entry['state'] == PENDING]
+
+    def compact(self):
+        """
+        Rewrite the journal with one line per path
+        """
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        os.replace(tmp, self.path)
+
+
+# ----------------------------------------------------------------------
+# Applying results (main process)
+# ----------------------------------------------------------------------
+
+def _file_fields():
+    return [
+        (model, field.name)
+        for model in apps.get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField)
+    ]
+
+
+def _rename_references(old, new, old_hash, new_hash):
+    """
+    Point every file field at the new name; returns the CarImage car ids
+    """
+    from .models import CarImage
+
+    if old != new:
+        for model, field in _file_fields():
+            model.objects.filter(**{field: old}).update(**{field: new})
+    # The renditions were built from the same picture; don't rebuild them
+    CarImage.objects.filter(image=new, source_hash=old_hash).update(source_hash=new_hash)
+    return set(CarImage.objects.filter(image=new).values_list('car_id', flat=True))
+
+
+def _target_name(root, name, fmt):
+    base, extension = os.path.splitext(name)
+    if extension.lower() in FORMAT_EXTENSIONS[fmt]:
+        return name
+    extension = FORMAT_EXTENSIONS[fmt][0]
+    target = base + extension
+    counter = 1
+    while os.path.exists(os.path.join(root, target)):
+        target = f"{base}_{counter}{extension}"
+        counter += 1
+    return target
+
+
+def _finish(root, manifest, entry):
+    """
+    Update the database and drop the old file for a replacement whose new
+    file is in place
+    """
+    car_ids = _rename_references(entry['source'], entry['path'], entry['source_hash'], entry['hash'])
+    if entry['source'] != entry['path']:
+        try:
+            os.remove(os.path.join(root, entry['source']))
+        except FileNotFoundError:
+            pass
+    manifest.record(**dict(entry, state=DONE))
+    return car_ids
+
+
+def _resume(root, manifest):
+    """
+    Finish the replacements an interrupted run left pending
+    """
+    car_ids = set()
+    for entry in manifest.pending():
+        target = os.path.join(root, entry['path'])
+        if os.path.exists(target):
+            with open(target, 'rb') as f:
+                in_place = _sha1(f.read()) == entry['hash']
+        else:
+            in_place = False
+        if in_place:
+            car_ids |= _finish(root, manifest, entry)
+        else:
+            # Never moved into place; the source is processed again
+            del manifest.entries[entry['path']]
+    return car_ids
+
+
+def media_files(root):
+    """
+    Relative names of the images to optimize; deletes stray temp files
+    """
+    names = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories[:] = sorted(d for d in subdirectories if not d.startswith('.'))
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            if filename.endswith(TMP_SUFFIX):
+                os.remove(path)
+                continue
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            if filename.startswith('.') or name.startswith(EXCLUDED_PREFIXES):
+                continue
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                names.append(name)
+    return names
+
+
+def run(workers=None, target_format='auto', max_size=None, dry_run=False, progress=None):
+    """
+    Optimize every image under MEDIA_ROOT; returns the totals
+    """
+    from . import conditional, homepage, reference
+    from .models import Car
+
+    root = settings.MEDIA_ROOT
+    max_size = max_size or getattr(settings, 'MEDIA_OPTIMIZE_MAX_SIZE', 2560)
+    manifest = Manifest(getattr(
+        settings, 'MEDIA_OPTIMIZE_MANIFEST', os.path.join(root, '.optimize-manifest.jsonl')
+    )).load()
+
+    totals = {
+        'files': 0, 'optimized': 0, 'renamed': 0, 'kept': 0, 'unchanged': 0, 'failed': 0,
+        'source_bytes': 0, 'bytes': 0, 'seconds': 0.0,
+    }
+    started = time.perf_counter()
+    car_ids = set() if dry_run else _resume(root, manifest)
+    names = media_files(root)
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [
+            executor.submit(optimize_file, root, name, manifest.known_hash(name), target_format, max_size, dry_run)
+            for name in names
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            status = result['status']
+            totals['files'] += 1
+            totals[status] += 1
+            totals['source_bytes'] += result['source_bytes']
+            totals['bytes'] += result.get('bytes', result['source_bytes'])
+            if status == 'optimized':
+                totals['renamed'] += result['renamed']
+                if not dry_run:
+                    car_ids |= _apply(root, manifest, result)
+            elif status == 'kept' and not dry_run:
+                manifest.record(path=result['name'], hash=result['source_hash'], state=DONE)
+            elif status == 'failed':
+                logger.warning("Could not optimize %s: %s", result['name'], result['error'])
+            if progress:
+                progress(result)
+    except BaseException:
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    if not dry_run:
+        manifest.compact()
+        if car_ids or totals['optimized']:
+            # Pages and caches link the old file names
+            Car.objects.filter(pk__in=car_ids).update(updated_at=timezone.now())
+            reference.invalidate()
+            homepage.invalidate()
+            conditional.invalidate()
+    totals['seconds'] = time.perf_counter() - started
+    return totals
+
+
+def _apply(root, manifest, result):
+    name = result['name']
+    target = _target_name(root, name, result['format'])
+    entry = {
+        'path': target, 'source': name, 'hash': result['hash'], 'source_hash': result['source_hash'],
+        'bytes': result['bytes'], 'source_bytes': result['source_bytes'],
+    }
+    # Journalled before the move, so a crash never leaves an unknown file behind
+    manifest.record(**dict(entry, state=PENDING))
+    os.replace(os.path.join(root, name + TMP_SUFFIX), os.path.join(root, target))
+    return _finish(root, manifest, entry)
@@ -0,0 +1,159 @@
+"""
+Process-local cache of reference data.
+
+BusinessConfig, Brand, CarModel and Location are tiny, read-mostly tables
+that almost every page needs. They are loaded once per process (four
+queries) and served from memory afterwards. A version stamp in the shared
+Django cache is bumped by the signal handlers in ``mywebsite.signals``
+whenever one of these rows is saved or deleted; every process compares its
+copy against the stamp (a cache read, no SQL) and reloads when it is stale.
+
+The returned model instances are shared between requests: treat them as
+read-only and copy them before attaching per-request attributes.
+"""
+import threading
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Brand, BusinessConfig, CarModel, Location
+from .routers import use_primary
+
+VERSION_KEY = 'mywebsite:reference:version'
+
+
+class Snapshot:
+    """
+    One consistent copy of the reference tables
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.business_config = BusinessConfig.objects.first()
+        self.brands = list(Brand.objects.order_by('name'))
+        self.brands_by_id = {brand.pk: brand for brand in self.brands}
+        self.brands_by_slug = {brand.slug: brand for brand in self.brands if brand.slug}
+        self.car_models = list(CarModel.objects.select_related('brand').order_by('name'))
+        self.car_models_by_brand = {}
+        for car_model in self.car_models:
+            self.car_models_by_brand.setdefault(car_model.brand_id, []).append(car_model)
+        self.locations = list(Location.objects.order_by('county', 'name'))
+
+
+class ReferenceData:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def _fresh(self):
+        snapshot = self._snapshot
+        version = cache.get(VERSION_KEY)
+        if snapshot is not None and version is not None and snapshot.version == version:
+            return snapshot
+        return None
+
+    def current(self):
+        """
+        The up-to-date snapshot, reloading it if another process (or a
+        signal in this one) bumped the version
+        """
+        snapshot = self._fresh()
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            cache.add(VERSION_KEY, 0, None)
+            version = cache.get(VERSION_KEY)
+            if snapshot is None or snapshot.version != version:
+                # Readers keep using the old snapshot until this one is complete.
+                # Loaded from the primary so a lagging replica isn't cached.
+                with use_primary():
+                    snapshot = self._snapshot = Snapshot(version)
+            return snapshot
+
+    async def acurrent(self):
+        """
+        ``current()`` for async views; only a reload leaves the event loop
+        """
+        return self._fresh() or await sync_to_async(self.current)()
+
+    def _bump(self):
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, None)
+        self._snapshot = None
+
+    def invalidate(self):
+        self._bump()
+        # Bump again once committed, or another process could reload the
+        # uncommitted state under the new version and keep it
+        transaction.on_commit(self._bump)
+
+
+reference_data = ReferenceData()
+
+
+def invalidate():
+    """
+    Mark the reference data stale in every process (called from signals)
+    """
+    reference_data.invalidate()
+
+
+def version():
+    """
+    The current reference data version (a cache read, no SQL)
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 0, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def business_config():
+    return reference_data.current().business_config
+
+
+async def abusiness_config():
+    return (await reference_data.acurrent()).business_config
+
+
+def brands():
+    """
+    All brands ordered by name
+    """
+    return reference_data.current().brands
+
+
+def get_brand(pk=None, slug=None):
+    data = reference_data.current()
+    if slug is not None:
+        return data.brands_by_slug.get(slug)
+    return data.brands_by_id.get(pk)
+
+
+def car_models(brand_id=None):
+    """
+    Car models ordered by name, optionally for one brand only
+    """
+    return _car_models(reference_data.current(), brand_id)
+
+
+async def acar_models(brand_id=None):
+    return _car_models(await reference_data.acurrent(), brand_id)
+
+
+def _car_models(data, brand_id):
+    if brand_id is None:
+        return data.car_models
+    return data.car_models_by_brand.get(brand_id, [])
+
+
+def locations(active_only=True):
+    data = reference_data.current()
+    if active_only:
+        return [location for location in data.locations if location.is_active]
+    return data.locations
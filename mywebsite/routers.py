@@ -0,0 +1,190 @@
+"""
+Primary/replica database routing.
+
+Writes always go to ``default`` (the primary). Reads go to one of the
+aliases in ``settings.DATABASE_REPLICAS``, but only while a listing view named
+in ``REPLICA_READ_VIEWS`` is serving a request (``ReplicaRoutingMiddleware``
+in ``mywebsite.middleware`` opts the request in). Everything else - the
+admin, management commands, background flushers and any read inside a
+transaction on the primary - reads from the primary, so it always sees its
+own writes.
+
+Read-your-writes across requests: a write the client caused - one made
+while handling a non-safe method, or flagged with ``mark_written()`` -
+marks the client with a short-lived signed cookie (``REPLICA_STICKY_SECONDS``),
+and that client's reads stay on the primary until the replicas have caught
+up. Incidental writes while serving a read (view counter and ingest
+flushes, which run inside ``use_primary()``) don't pin the client.
+
+Derived caches (facet index, reference data, homepage bundle, catalog) are
+rebuilt inside ``use_primary()``, so a lagging replica can never be cached
+under a version that was bumped for a newer write.
+
+Replicas are probed with a ``SELECT 1`` (plus a replay-lag query on
+PostgreSQL, and a check that a SQLite copy is not empty) at most every
+``REPLICA_HEALTH_INTERVAL`` seconds; a replica that fails or lags more than
+``REPLICA_MAX_LAG_SECONDS`` is ejected until its next successful probe.
+SQLite replicas are opened read-only, so a missing file fails the probe
+rather than being created. With no healthy replica, reads fall back to the
+primary.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingState:
+    """
+    Per-request routing decisions, shared with threads the request spawns
+    via sync_to_async (they copy the context, not the object)
+    """
+
+    def __init__(self, replicas_allowed=False):
+        self.replicas_allowed = replicas_allowed
+        self.wrote = False
+        # The client should read its own write on its next requests too
+        self.sticky = False
+
+
+_state = ContextVar('mywebsite_db_routing', default=None)
+
+
+@contextmanager
+def routing(state):
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """
+    Read from the primary inside the block, whatever the request allows
+    """
+    with routing(RoutingState(replicas_allowed=False)):
+        yield
+
+
+def mark_written():
+    """
+    Keep the client on the primary after this request, e.g. for a write
+    made by a GET that the client will want to see
+    """
+    state = _state.get()
+    if state is not None:
+        state.wrote = state.sticky = True
+
+
+def _replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class ReplicaHealth:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = {}  # alias -> (monotonic time, healthy)
+
+    def probe(self, alias):
+        """
+        True if the replica answers and is not lagging too far behind
+        """
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+                if connections[alias].vendor == 'sqlite':
+                    # A copy that was never synced opens fine but has no tables
+                    cursor.execute('SELECT COUNT(*) FROM sqlite_master')
+                    if not cursor.fetchone()[0]:
+                        logger.warning("Replica %s is an empty database; ejecting it", alias)
+                        return False
+                elif connections[alias].vendor == 'postgresql':
+                    cursor.execute(
+                        'SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)'
+                    )
+                    lag = float(cursor.fetchone()[0])
+                    max_lag = getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 5)
+                    if lag > max_lag:
+                        logger.warning("Replica %s is %.1fs behind; ejecting it", alias, lag)
+                        return False
+            return True
+        except Exception:
+            logger.warning("Replica %s failed its health check; ejecting it", alias, exc_info=True)
+            return False
+
+    def is_healthy(self, alias):
+        interval = getattr(settings, 'REPLICA_HEALTH_INTERVAL', 5)
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checked.get(alias)
+            if checked is not None and now - checked[0] < interval:
+                return checked[1]
+            if _in_event_loop():
+                # The probe would need a thread hop; keep the last answer
+                return checked[1] if checked else True
+            # Claim the slot so concurrent readers don't all probe
+            self._checked[alias] = (now, checked[1] if checked else True)
+        healthy = self.probe(alias)
+        with self._lock:
+            self._checked[alias] = (time.monotonic(), healthy)
+        return healthy
+
+    def reset(self):
+        with self._lock:
+            self._checked.clear()
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+    def __init__(self):
+        self._turn = itertools.count()
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replicas_allowed or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # The transaction may hold writes the replicas can't see yet
+            return DEFAULT_DB_ALIAS
+        replicas = [alias for alias in _replicas() if health.is_healthy(alias)]
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        return replicas[next(self._turn) % len(replicas)]
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema by replication
+        if db in _replicas():
+            return False
+        return None
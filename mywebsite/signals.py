@@ -0,0 +1,201 @@
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver
+
+from . import conditional, fulltext, homepage, images, reference, stats
+from .facets import facet_index, INDEXED_FIELDS
+from .models import (
+    Brand, CarModel, Car, CarImage, CarRental, Location, Testimonial,
+    BlogPost, BusinessConfig, update_primary_image
+)
+
+
+# Faceted search index maintenance
+@receiver(post_save, sender=Car)
+def car_saved_update_facets(sender, instance, update_fields=None, **kwargs):
+    # e.g. increment_views() touches nothing the index cares about
+    if update_fields and not INDEXED_FIELDS.intersection(update_fields):
+        return
+    facet_index.refresh_car(instance.pk)
+
+
+@receiver(post_delete, sender=Car)
+def car_deleted_update_facets(sender, instance, **kwargs):
+    facet_index.remove_car(instance.pk)
+
+
+@receiver(post_save, sender=CarRental)
+@receiver(post_delete, sender=CarRental)
+def rental_changed_update_facets(sender, instance, **kwargs):
+    facet_index.refresh_car(instance.car_id)
+
+
+@receiver(post_save, sender=CarModel)
+@receiver(post_delete, sender=CarModel)
+def car_model_changed_update_facets(sender, instance, **kwargs):
+    facet_index.invalidate()
+
+
+# Full-text (FTS5) index maintenance
+FULLTEXT_FIELDS = frozenset(['brand', 'car_model', 'description', 'features'])
+
+
+@receiver(post_save, sender=Car)
+def car_saved_update_fulltext(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not FULLTEXT_FIELDS.intersection(update_fields):
+        return
+    fulltext.index_car(instance.pk)
+
+
+@receiver(post_delete, sender=Car)
+def car_deleted_update_fulltext(sender, instance, **kwargs):
+    fulltext.remove_car(instance.pk)
+
+
+@receiver(post_save, sender=Brand)
+def brand_saved_update_fulltext(sender, instance, created=False, **kwargs):
+    if not created:
+        fulltext.index_brand(instance.pk)
+
+
+@receiver(post_save, sender=CarModel)
+def car_model_saved_update_fulltext(sender, instance, created=False, **kwargs):
+    if not created:
+        fulltext.index_car_model(instance.pk)
+
+
+# Homepage data cache invalidation
+@receiver(post_save, sender=Car)
+def car_saved_invalidate_homepage(sender, instance, update_fields=None, **kwargs):
+    # View counter updates are not shown on the homepage
+    if update_fields and set(update_fields) <= {'views_count'}:
+        return
+    homepage.invalidate()
+
+
+@receiver(post_delete, sender=Car)
+@receiver(post_save, sender=CarRental)
+@receiver(post_delete, sender=CarRental)
+@receiver(post_save, sender=CarImage)
+@receiver(post_delete, sender=CarImage)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=CarModel)
+@receiver(post_delete, sender=CarModel)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(post_save, sender=Testimonial)
+@receiver(post_delete, sender=Testimonial)
+@receiver(post_save, sender=BusinessConfig)
+@receiver(post_delete, sender=BusinessConfig)
+def homepage_data_changed(sender, **kwargs):
+    homepage.invalidate()
+
+
+@receiver(post_save, sender=BlogPost)
+def blog_post_saved_invalidate_homepage(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'views_count'}:
+        return
+    homepage.invalidate()
+
+
+@receiver(post_delete, sender=BlogPost)
+def blog_post_deleted_invalidate_homepage(sender, instance, **kwargs):
+    homepage.invalidate()
+
+
+# Car image renditions cleanup
+@receiver(post_delete, sender=CarImage)
+def car_image_deleted_remove_renditions(sender, instance, **kwargs):
+    images.delete_renditions(instance.renditions)
+
+
+# Denormalized Car.primary_image maintenance
+@receiver(post_save, sender=CarImage)
+@receiver(post_delete, sender=CarImage)
+def car_image_changed_update_primary(sender, instance, **kwargs):
+    update_primary_image(instance.car_id)
+
+
+# Reference data (brands, models, locations, business config)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=CarModel)
+@receiver(post_delete, sender=CarModel)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(post_save, sender=BusinessConfig)
+@receiver(post_delete, sender=BusinessConfig)
+def reference_data_changed(sender, **kwargs):
+    reference.invalidate()
+
+
+# Materialized inventory statistics
+def _touches_stats(update_fields):
+    return not update_fields or bool(stats.STATS_FIELDS.intersection(update_fields))
+
+
+@receiver(pre_save, sender=Car)
+def car_saving_capture_stats(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._stats_state = None
+    if not raw and instance.pk and _touches_stats(update_fields):
+        instance._stats_state = stats.car_state(instance.pk)
+
+
+@receiver(post_save, sender=Car)
+def car_saved_update_stats(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw or not _touches_stats(update_fields):
+        return
+    old = None if created else getattr(instance, '_stats_state', None)
+    stats.apply_change(old, stats.car_state(instance.pk))
+
+
+@receiver(pre_delete, sender=Car)
+def car_deleting_capture_stats(sender, instance, **kwargs):
+    instance._stats_state = stats.car_state(instance.pk)
+
+
+@receiver(post_delete, sender=Car)
+def car_deleted_update_stats(sender, instance, **kwargs):
+    old = getattr(instance, '_stats_state', None)
+    if old:
+        # The cascade already deleted the rental and counted it out
+        stats.apply_change(dict(old, for_rent=False), None)
+
+
+@receiver(post_save, sender=CarRental)
+def rental_saved_update_stats(sender, instance, created=False, raw=False, **kwargs):
+    if raw or not created:
+        return
+    state = stats.car_state(instance.car_id)
+    if state:
+        stats.apply_change(dict(state, for_rent=False), state)
+
+
+@receiver(post_delete, sender=CarRental)
+def rental_deleted_update_stats(sender, instance, **kwargs):
+    state = stats.car_state(instance.car_id)
+    if state:
+        stats.apply_change(dict(state, for_rent=True), state)
+
+
+# Conditional GET validators
+@receiver(post_save, sender=Car)
+def car_saved_invalidate_validators(sender, instance, update_fields=None, **kwargs):
+    # View counts are not shown on any page
+    if update_fields and set(update_fields) <= {'views_count'}:
+        return
+    conditional.invalidate()
+
+
+@receiver(post_delete, sender=Car)
+@receiver(post_save, sender=CarRental)
+def inventory_changed_invalidate_validators(sender, **kwargs):
+    conditional.invalidate()
+
+
+@receiver(post_save, sender=CarImage)
+@receiver(post_delete, sender=CarImage)
+@receiver(post_delete, sender=CarRental)
+def car_related_changed_touch_car(sender, instance, **kwargs):
+    # These leave no timestamp of their own for the car's Last-Modified
+    conditional.touch_car(instance.car_id)
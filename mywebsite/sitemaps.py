@@ -0,0 +1,184 @@
+"""
+XML sitemaps for crawlers, so they discover the inventory without paging
+through ``car_list``.
+
+``sitemap.xml`` is a sitemap index pointing at ``sitemap-pages.xml`` (the
+fixed pages) and one ``sitemap-cars-<n>.xml`` shard per block of
+``SHARD_SIZE`` car ids, so no file exceeds the protocol's 50,000 URLs.
+Shards cover fixed id ranges: a new car only ever lands in the last shard,
+and deleting cars never moves the others between files.
+
+Every shard is cached (gzipped, under the signature it was built from) and
+regenerated only when its signature - the number of listed cars and their
+latest ``updated_at`` - changes. The signatures of all shards come from one
+aggregate query, itself cached per inventory version, so an unchanged
+sitemap is served without SQL. A shard that has to be rebuilt is streamed
+while it is generated, reading the cars in ``iterator()`` chunks, and
+cached once complete.
+
+``manage.py build_sitemaps`` rebuilds the stale shards ahead of crawlers
+(with a cache shared between processes).
+"""
+import hashlib
+import zlib
+from xml.sax.saxutils import escape
+
+from django.core.cache import cache
+from django.db.models import BigIntegerField, Count, ExpressionWrapper, F, Max
+from django.urls import reverse
+
+from . import conditional
+from .models import Car
+from .routers import use_primary
+
+SHARD_SIZE = 50000
+CHUNK_SIZE = 2000
+# Shards are kept until their cars change; this only frees abandoned ones
+CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+# Fixed pages: (url name, change frequency, priority)
+PAGES = [
+    ('homepage', 'daily', '1.0'),
+    ('car_list', 'hourly', '0.9'),
+]
+
+
+def listed_cars():
+    """
+    The cars a sitemap lists: available ones with a page
+    """
+    return Car.objects.filter(status='available', slug__isnull=False).exclude(slug='')
+
+
+def _shard_range(shard):
+    return shard * SHARD_SIZE + 1, (shard + 1) * SHARD_SIZE
+
+
+def shard_signatures():
+    """
+    ``{shard: (count, last updated_at)}`` for every non-empty shard, in id
+    order; one query per inventory version
+    """
+    key = f"mywebsite:sitemap:signatures:{conditional.inventory_version()}"
+    signatures = cache.get(key)
+    if signatures is None:
+        shard = ExpressionWrapper((F('pk') - 1) / SHARD_SIZE, output_field=BigIntegerField())
+        with use_primary():
+            rows = listed_cars().annotate(shard=shard).values('shard').annotate(
+                count=Count('pk'), last=Max('updated_at')
+            ).order_by('shard')
+            signatures = {row['shard']: (row['count'], row['last']) for row in rows}
+        cache.set(key, signatures, CACHE_TIMEOUT)
+    return signatures
+
+
+def _shard_key(base_url, shard):
+    base = hashlib.md5(base_url.encode()).hexdigest()[:12]
+    return f"mywebsite:sitemap:cars:{SHARD_SIZE}:{base}:{shard}"
+
+
+def _url(loc, lastmod=None, changefreq=None, priority=None):
+    parts = [f'<url><loc>{escape(loc)}</loc>']
+    if lastmod:
+        parts.append(f'<lastmod>{lastmod.isoformat(timespec="seconds")}</lastmod>')
+    if changefreq:
+        parts.append(f'<changefreq>{changefreq}</changefreq>')
+    if priority:
+        parts.append(f'<priority>{priority}</priority>')
+    parts.append('</url>\n')
+    return ''.join(parts)
+
+
+def generate_shard(base_url, shard):
+    """
+    The XML of one car shard, in chunks of CHUNK_SIZE urls. Sitemap views
+    don't read from replicas, so this needs no routing of its own.
+    """
+    yield f'{XML_HEADER}<urlset xmlns="{NAMESPACE}">\n'
+    # One reverse() for the shard instead of one per car
+    prefix, suffix = (base_url + reverse('car_detail', args=['__slug__'])).split('__slug__')
+    cars = listed_cars().filter(pk__range=_shard_range(shard)).order_by('pk').values_list('slug', 'updated_at')
+    chunk = []
+    for slug, updated_at in cars.iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(_url(f'{prefix}{slug}{suffix}', updated_at))
+        if len(chunk) == CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk) + '</urlset>\n'
+
+
+def cached_shard(base_url, shard, signature):
+    """
+    The gzipped XML of a shard, if it was built from ``signature``
+    """
+    entry = cache.get(_shard_key(base_url, shard))
+    if entry is not None and entry[0] == signature:
+        return entry[1]
+    return None
+
+
+def stream_shard(base_url, shard, signature):
+    """
+    Generate a shard, yielding it as it is built and caching it at the end
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)  # gzip container
+    compressed = []
+    for chunk in generate_shard(base_url, shard):
+        data = chunk.encode()
+        compressed.append(compressor.compress(data))
+        yield data
+    compressed.append(compressor.flush())
+    cache.set(_shard_key(base_url, shard), (signature, b''.join(compressed)), CACHE_TIMEOUT)
+
+
+def build(base_url):
+    """
+    Regenerate the shards that changed since they were cached; returns
+    (rebuilt, unchanged)
+    """
+    rebuilt = unchanged = 0
+    for shard, signature in shard_signatures().items():
+        if cached_shard(base_url, shard, signature) is not None:
+            unchanged += 1
+            continue
+        for _ in stream_shard(base_url, shard, signature):
+            pass
+        rebuilt += 1
+    return rebuilt, unchanged
+
+
+def shard_etag(request, number):
+    """
+    Validator for one shard's URL: a car change elsewhere leaves it alone
+    """
+    signature = shard_signatures().get(number - 1)
+    if signature is None:
+        return None
+    return conditional.make_etag('sitemap_cars', request.get_host(), number, *signature)
+
+
+def index(base_url):
+    """
+    The sitemap index document
+    """
+    parts = [f'{XML_HEADER}<sitemapindex xmlns="{NAMESPACE}">\n']
+    parts.append(f'<sitemap><loc>{escape(base_url + reverse("sitemap_pages"))}</loc></sitemap>\n')
+    for shard, (count, last) in shard_signatures().items():
+        loc = base_url + reverse('sitemap_cars', args=[shard + 1])
+        parts.append(
+            f'<sitemap><loc>{escape(loc)}</loc>'
+            f'<lastmod>{last.isoformat(timespec="seconds")}</lastmod></sitemap>\n'
+        )
+    parts.append('</sitemapindex>\n')
+    return ''.join(parts)
+
+
+def pages(base_url):
+    """
+    The fixed pages' sitemap
+    """
+    urls = ''.join(_url(base_url + reverse(name), None, changefreq, priority) for name, changefreq, priority in PAGES)
+    return f'{XML_HEADER}<urlset xmlns="{NAMESPACE}">\n{urls}</urlset>\n'
@@ -0,0 +1,92 @@
+"""
+Unique slug allocation.
+
+Slugs are handed out as ``base``, ``base-1``, ``base-2``, ... For a single
+object ``allocate_slug()`` fetches every existing slug for the base in one
+query and picks the first free one. ``SlugAllocator`` does the same in memory
+for bulk work (backfills, generators) so thousands of rows cost one query.
+
+``Car.slug`` and ``Brand.slug`` carry a unique index; ``save_with_slug()``
+retries when a concurrent writer claims the same slug first.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+SAVE_ATTEMPTS = 3
+
+
+def _taken(model, base, exclude_pk=None):
+    # A range rather than startswith: SQLite's LIKE is case-insensitive and
+    # can't use the slug index ('.' sorts right after '-')
+    queryset = model.objects.filter(
+        Q(slug=base) | Q(slug__gte=f"{base}-", slug__lt=f"{base}.")
+    ).order_by()
+    if exclude_pk is not None:
+        queryset = queryset.exclude(pk=exclude_pk)
+    return set(queryset.values_list('slug', flat=True))
+
+
+def _first_free(base, taken, start=0):
+    counter = start
+    slug = base if counter == 0 else f"{base}-{counter}"
+    while slug in taken:
+        counter += 1
+        slug = f"{base}-{counter}"
+    return slug, counter
+
+
+def allocate_slug(model, base, exclude_pk=None):
+    """
+    First free slug for ``base`` on ``model``, using one query
+    """
+    slug, _ = _first_free(base, _taken(model, base, exclude_pk))
+    return slug
+
+
+def save_with_slug(instance, base, save):
+    """
+    Allocate ``instance.slug`` from ``base`` and call ``save()``, retrying
+    with a fresh slug if another writer took it in the meantime
+    """
+    model = type(instance)
+    for attempt in range(SAVE_ATTEMPTS):
+        instance.slug = allocate_slug(model, base, exclude_pk=instance.pk)
+        try:
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            slug_taken = model.objects.filter(slug=instance.slug).exclude(pk=instance.pk).exists()
+            if not slug_taken or attempt == SAVE_ATTEMPTS - 1:
+                raise
+
+
+class SlugAllocator:
+    """
+    Hands out unique slugs for many objects without a query per row.
+
+    Existing slugs are loaded once per base, or all at once with
+    ``preload()`` for backfills that touch most of the table.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.taken = set()
+        self.loaded = set()
+        self.preloaded = False
+        self.next_suffix = {}
+
+    def preload(self):
+        self.taken.update(
+            self.model.objects.exclude(slug=None).values_list('slug', flat=True)
+        )
+        self.preloaded = True
+        return self
+
+    def allocate(self, base):
+        if not self.preloaded and base not in self.loaded:
+            self.taken.update(_taken(self.model, base))
+            self.loaded.add(base)
+        slug, counter = _first_free(base, self.taken, self.next_suffix.get(base, 0))
+        self.next_suffix[base] = counter + 1
+        self.taken.add(slug)
+        return slug
@@ -0,0 +1,205 @@
+"""
+Materialized inventory statistics.
+
+``InventoryStat`` holds one summary row for all cars and one per brand, car
+model, location and year: how many cars there are, how many are available
+and available for rent, and the price bounds over all and over available
+cars. The homepage and car list read these rows instead of aggregating the
+car table on every request.
+
+The rows are maintained incrementally by the Car/CarRental signal handlers
+in ``mywebsite.signals``: each change moves one car's contribution from its
+old state to its new one with ``F()`` updates, and price bounds are only
+re-aggregated (for the affected keys) when a car that sat on a bound leaves
+it. ``manage.py rebuild_inventory_stats`` recomputes everything from
+scratch to repair drift, e.g. after bulk inserts that bypass signals.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import (
+    Count, DecimalField, Exists, F, Max, Min, OuterRef, Q, Value
+)
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import Car, CarRental, InventoryStat
+
+# dimension -> Car field holding the value
+DIMENSIONS = {
+    'brand': 'brand_id',
+    'car_model': 'car_model_id',
+    'location': 'location_id',
+    'year': 'year',
+}
+# Car fields a save must touch for the stats to change
+STATS_FIELDS = frozenset(['brand', 'car_model', 'location', 'year', 'status', 'price'])
+COUNTERS = ('cars', 'available', 'available_for_rent')
+BOUNDS = ('min_price', 'max_price', 'available_min_price', 'available_max_price')
+
+
+def _aggregates():
+    available = Q(status='available')
+    return {
+        'cars': Count('id'),
+        'available': Count('id', filter=available),
+        'available_for_rent': Count('id', filter=available & Q(rental_info__isnull=False)),
+        'min_price': Min('price'),
+        'max_price': Max('price'),
+        'available_min_price': Min('price', filter=available),
+        'available_max_price': Max('price', filter=available),
+    }
+
+
+def _key_filter(dimension, value):
+    return {} if dimension == 'all' else {DIMENSIONS[dimension]: value}
+
+
+# ----------------------------------------------------------------------
+# Incremental maintenance
+# ----------------------------------------------------------------------
+
+def car_state(car_id):
+    """
+    The stats-relevant fields of a car as stored, or None if it is gone
+    """
+    return Car.objects.filter(pk=car_id).annotate(
+        for_rent=Exists(CarRental.objects.filter(car_id=OuterRef('pk')))
+    ).values(*DIMENSIONS.values(), 'status', 'price', 'for_rent').first()
+
+
+def _keys(state):
+    return [('all', 0)] + [(dimension, state[field]) for dimension, field in DIMENSIONS.items()]
+
+
+def _counts(state):
+    available = state['status'] == 'available'
+    return {
+        'cars': 1,
+        'available': int(available),
+        'available_for_rent': int(available and bool(state['for_rent'])),
+    }
+
+
+def _widen(field, price, smaller):
+    price = Value(price, output_field=DecimalField(max_digits=10, decimal_places=2))
+    return (Least if smaller else Greatest)(Coalesce(F(field), price), price)
+
+
+def apply_change(old, new):
+    """
+    Move one car's contribution from state ``old`` to state ``new`` (see
+    ``car_state()``). Either may be None for an added or removed car.
+    """
+    if old == new:
+        return
+
+    deltas = defaultdict(Counter)
+    if old:
+        for key in _keys(old):
+            for field, amount in _counts(old).items():
+                deltas[key][field] -= amount
+    if new:
+        for key in _keys(new):
+            for field, amount in _counts(new).items():
+                deltas[key][field] += amount
+
+    new_keys = set(_keys(new)) if new else set()
+    with transaction.atomic():
+        for (dimension, value), delta in deltas.items():
+            updates = {field: F(field) + amount for field, amount in delta.items() if amount}
+            if (dimension, value) in new_keys and new['price'] is not None:
+                updates['min_price'] = _widen('min_price', new['price'], True)
+                updates['max_price'] = _widen('max_price', new['price'], False)
+                if new['status'] == 'available':
+                    updates['available_min_price'] = _widen('available_min_price', new['price'], True)
+                    updates['available_max_price'] = _widen('available_max_price', new['price'], False)
+            if not updates:
+                continue
+            InventoryStat.objects.get_or_create(dimension=dimension, value=value)
+            InventoryStat.objects.filter(dimension=dimension, value=value).update(**updates)
+
+        # A car leaving a key may have been holding one of its price bounds
+        if old and old['price'] is not None:
+            unchanged_price = new and new['price'] == old['price'] and new['status'] == old['status']
+            for key in _keys(old):
+                if unchanged_price and key in new_keys:
+                    continue
+                _refresh_bounds(key, old['price'])
+
+
+def _refresh_bounds(key, price):
+    dimension, value = key
+    on_bound = Q()
+    for field in BOUNDS:
+        on_bound |= Q(**{field: price})
+    stat = InventoryStat.objects.filter(on_bound, dimension=dimension, value=value)
+    if not stat.exists():
+        return
+    aggregates = {field: aggregate for field, aggregate in _aggregates().items() if field in BOUNDS}
+    bounds = Car.objects.filter(**_key_filter(dimension, value)).aggregate(**aggregates)
+    stat.update(**bounds)
+
+
+# ----------------------------------------------------------------------
+# Full rebuild
+# ----------------------------------------------------------------------
+
+def compute():
+    """
+    Every summary row computed from the car table, as unsaved instances
+    """
+    rows = [InventoryStat(dimension='all', value=0, **Car.objects.aggregate(**_aggregates()))]
+    for dimension, field in DIMENSIONS.items():
+        for values in Car.objects.values(field).order_by().annotate(**_aggregates()):
+            value = values.pop(field)
+            rows.append(InventoryStat(dimension=dimension, value=value, **values))
+    return rows
+
+
+def rebuild():
+    """
+    Replace every summary row. Returns the number of rows that had drifted
+    (changed, added or removed).
+    """
+    fields = COUNTERS + BOUNDS
+
+    with transaction.atomic():
+        rows = compute()
+        before = {
+            (stat.dimension, stat.value): tuple(getattr(stat, field) for field in fields)
+            for stat in InventoryStat.objects.all() if stat.cars
+        }
+        after = {
+            (stat.dimension, stat.value): tuple(getattr(stat, field) for field in fields)
+            for stat in rows if stat.cars
+        }
+        InventoryStat.objects.all().delete()
+        InventoryStat.objects.bulk_create([stat for stat in rows if stat.cars])
+
+    return sum(1 for key in before.keys() | after.keys() if before.get(key) != after.get(key))
+
+
+# ----------------------------------------------------------------------
+# Reading
+# ----------------------------------------------------------------------
+
+def snapshot():
+    """
+    All summary rows in one query, as {dimension: {value: InventoryStat}}
+    """
+    stats = {dimension: {} for dimension in ('all',) + tuple(DIMENSIONS)}
+    for stat in InventoryStat.objects.all():
+        stats[stat.dimension][stat.value] = stat
+    if 0 not in stats['all']:
+        stats['all'][0] = InventoryStat(dimension='all', value=0)
+    return stats
+
+
+def totals():
+    """
+    The all-cars row (zeros if nothing has been recorded yet)
+    """
+    return (
+        InventoryStat.objects.filter(dimension='all', value=0).first()
+        or InventoryStat(dimension='all', value=0)
+    )
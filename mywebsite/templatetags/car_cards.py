@@ -0,0 +1,13 @@
+from django import template
+
+from mywebsite import cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def car_cards(cars, variant):
+    """
+    {% car_cards cars 'list' %} - the cached listing cards of ``cars``
+    """
+    return cards.render_cards(list(cars), variant)
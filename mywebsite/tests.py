@@ -1,3 +1,1735 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from contextlib import closing, contextmanager
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+from urllib.parse import quote
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from PIL import ExifTags, Image
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.template.loader import get_template
+from django.templatetags.static import static
+from django.db import IntegrityError, OperationalError, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import (
+    benchmarks, cards, catalog, conditional, counters, exports, facets, fulltext, homepage, images, ingest,
+    optimize, reference, routers, sitemaps, slugs, stats, views
+)
+from .facets import FacetIndex, facet_index
+from .homepage import get_homepage_data
+from .counters import view_counter
+from .middleware import QueryBudgetExceeded, QueryBudgetMiddleware, ReplicaRoutingMiddleware
+from .models import (
+    BlogPost, Brand, CarModel, Car, CarImage, CarRental, Location, CustomerInquiry, CarComparison,
+    NewsletterSubscription, Testimonial
+)
+
+
+def create_cars(count, brand=None, car_model=None, location=None, **overrides):
+    """Create ``count`` minimal cars for tests"""
+    brand = brand or Brand.objects.get_or_create(name='Toyota')[0]
+    car_model = car_model or CarModel.objects.get_or_create(
+        brand=brand, name='Corolla', defaults={'body_type': 'sedan'}
+    )[0]
+    location = location or Location.objects.get_or_create(name='Westlands', county='Nairobi')[0]
+    fields = {
+        'year': 2018,
+        'condition': 'used_local',
+        'engine_size': Decimal('1.8'),
+        'fuel_type': 'petrol',
+        'transmission': 'automatic',
+        'drive_type': 'fwd',
+        'mileage': 50000,
+        'color': 'White',
+        'doors': 4,
+        'seats': 5,
+        'price': Decimal('1500000'),
+    }
+    fields.update(overrides)
+    return [
+        Car.objects.create(brand=brand, car_model=car_model, location=location, **fields)
+        for _ in range(count)
+    ]
+
+
+_cache_dir = tempfile.TemporaryDirectory()
+_settings_override = override_settings(
+    # Timed view count flushes from a thread would write outside the
+    # tests' transactions
+    VIEW_COUNTER_BACKGROUND_FLUSH=False,
+    # The configured backend, away from the site's own cache
+    CACHES={'default': {**settings.CACHES['default'], 'LOCATION': _cache_dir.name}},
+)
+
+
+def setUpModule():
+    _settings_override.enable()
+
+
+def tearDownModule():
+    # Counts still buffered would be written at exit, after the test
+    # database is gone
+    view_counter.buffer.take()
+    _settings_override.disable()
+    _cache_dir.cleanup()
+
+
+def use_temporary_spool(test):
+    """Point the ingestion spool at a fresh directory, with no background flusher"""
+    spool_dir = tempfile.TemporaryDirectory()
+    test.addCleanup(spool_dir.cleanup)
+    override = override_settings(INGEST_SPOOL_DIR=spool_dir.name, INGEST_BACKGROUND_FLUSH=False)
+    override.enable()
+    test.addCleanup(override.disable)
+
+
+# Faceted search index
+class FacetIndexTests(TestCase):
+    def setUp(self):
+        self.toyota = Brand.objects.create(name='Toyota')
+        self.mazda = Brand.objects.create(name='Mazda')
+        self.corolla = CarModel.objects.create(brand=self.toyota, name='Corolla', body_type='sedan')
+        self.cx5 = CarModel.objects.create(brand=self.mazda, name='CX-5', body_type='suv')
+        self.corollas = create_cars(2, brand=self.toyota, car_model=self.corolla)
+        self.cx5s = create_cars(3, brand=self.mazda, car_model=self.cx5, price=Decimal('3500000'))
+        facet_index.invalidate()
+
+    def test_filters_and_counts(self):
+        result = facet_index.search({'brand': self.mazda.pk, 'condition': ''})
+        self.assertEqual(set(result.ids), {car.pk for car in self.cx5s})
+        # A facet's own filter is left out of its counts
+        self.assertEqual(result.counts['brand'], {self.toyota.pk: 2, self.mazda.pk: 3})
+        self.assertEqual(result.counts['body_type'], {'suv': 3})
+        self.assertEqual(result.counts['price_band'], {'2m-5m': 3})
+
+        result = facet_index.search({'body_type': 'sedan'}, min_price=1000000, max_price=2000000)
+        self.assertEqual(set(result.ids), {car.pk for car in self.corollas})
+        self.assertEqual(result.counts['body_type'], {'sedan': 2})
+
+        result = facet_index.search()
+        self.assertEqual(result.count, 5)
+        self.assertEqual(result.counts['listing'], {'sale': 5})
+        self.assertEqual(result.ids, [car.pk for car in reversed(self.corollas + self.cx5s)])
+
+        ranked = [self.cx5s[1].pk, self.corollas[0].pk, 999999]
+        result = facet_index.search(candidates=ranked, sort='relevance')
+        self.assertEqual(result.ids, ranked[:2])
+
+    def test_signals_keep_the_index_current(self):
+        facet_index.search()
+        car = self.corollas[0]
+        car.price = Decimal('12000000')
+        car.save()
+        self.assertEqual(facet_index.search({'price_band': 'over-10m'}).ids, [car.pk])
+
+        CarRental.objects.create(car=self.cx5s[0], daily_rate=Decimal('5000'))
+        self.assertEqual(facet_index.search({'listing': 'rental'}).ids, [self.cx5s[0].pk])
+
+        self.cx5s[1].delete()
+        result = facet_index.search({'brand': self.mazda.pk})
+        self.assertEqual(set(result.ids), {self.cx5s[0].pk, self.cx5s[2].pk})
+
+        CarRental.objects.get(car=self.cx5s[0]).delete()
+        self.assertEqual(facet_index.search({'listing': 'rental'}).ids, [])
+
+    def test_other_workers_apply_the_changed_cars_only(self):
+        other = FacetIndex()
+        other.search()
+        car = self.corollas[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            car.status = 'sold'
+            car.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cx5s[0].delete()
+        # One query for the two journalled cars instead of a rebuild
+        with self.assertNumQueries(1):
+            result = other.search({'status': 'sold'})
+        self.assertEqual(result.ids, [car.pk])
+        self.assertNotIn(self.cx5s[0].pk, other.search().ids)
+
+    def test_other_workers_rebuild_when_the_journal_is_incomplete(self):
+        other = FacetIndex()
+        other.search()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.corollas[0].save()
+        cache.delete(facets.CHANGE_KEY % cache.get(facets.VERSION_KEY))
+        with mock.patch.object(other, 'build', wraps=other.build) as build:
+            other.search()
+        build.assert_called_once()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cx5.body_type = 'crossover'
+            self.cx5.save()
+        self.assertEqual(other.search({'body_type': 'crossover'}).count, 3)
+
+
+# Full-text keyword search
+@skipUnless(connections['default'].vendor == 'sqlite', 'FTS5 index is SQLite only')
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        self.toyota = Brand.objects.create(name='Toyota')
+        self.nissan = Brand.objects.create(name='Nissan')
+        corolla = CarModel.objects.create(brand=self.toyota, name='Corolla', body_type='sedan')
+        self.xtrail = CarModel.objects.create(brand=self.nissan, name='X-Trail', body_type='suv')
+        self.corolla = create_cars(1, brand=self.toyota, car_model=corolla, description='Clean car')[0]
+        self.nissan_car = create_cars(
+            1, brand=self.nissan, car_model=self.xtrail, description='Drives like a Toyota, 7 seats'
+        )[0]
+        self.assertTrue(fulltext.is_available())
+
+    def test_user_input_is_quoted(self):
+        self.assertEqual(fulltext.build_match_query('"toyota" corolla'), '"toyota"* "corolla"*')
+        self.assertEqual(fulltext.build_match_query('x-trail*'), '"x"* "trail"*')
+        self.assertEqual(fulltext.build_match_query('toyota OR NEAR(nissan)'), '"toyota"* "OR"* "NEAR"* "nissan"*')
+        self.assertEqual(fulltext.build_match_query(''), '')
+        self.assertEqual(fulltext.build_match_query(None), '')
+        for text in ('"', '*', '-toyota', 'toyota OR', 'NEAR', 'AND NOT', '^', '(', ''):
+            fulltext.search_ids(text)
+        self.assertEqual(fulltext.search_ids('  "" '), [])
+        self.assertEqual(fulltext.search_ids('x-trail'), [self.nissan_car.pk])
+
+    def test_brand_and_model_matches_rank_first(self):
+        # Toyota is the brand of one car and in the description of the other
+        self.assertEqual(fulltext.search_ids('toyota'), [self.corolla.pk, self.nissan_car.pk])
+        self.assertEqual(fulltext.search_ids('toyo'), [self.corolla.pk, self.nissan_car.pk])
+        self.assertEqual(fulltext.search_ids('toyota', limit=1), [self.corolla.pk])
+
+    def test_renames_are_reindexed(self):
+        self.toyota.name = 'Lexus'
+        self.toyota.save()
+        self.xtrail.name = 'Patrol'
+        self.xtrail.save()
+        self.assertEqual(fulltext.search_ids('lexus'), [self.corolla.pk])
+        self.assertEqual(fulltext.search_ids('patrol'), [self.nissan_car.pk])
+        # Only the other car's description still mentions Toyota
+        self.assertEqual(fulltext.search_ids('toyota'), [self.nissan_car.pk])
+        self.assertEqual(fulltext.search_ids('trail'), [])
+        self.corolla.delete()
+        self.assertEqual(fulltext.search_ids('lexus'), [])
+
+    def test_icontains_fallback(self):
+        with mock.patch.object(fulltext, 'is_available', return_value=False):
+            self.assertEqual(sorted(fulltext.search_ids('toyota')), sorted([self.corolla.pk, self.nissan_car.pk]))
+            self.assertEqual(fulltext.search_ids('x-trail'), [self.nissan_car.pk])
+            # Words are matched separately, as by the FTS query
+            self.assertEqual(fulltext.search_ids('toyota  seats'), [self.nissan_car.pk])
+            self.assertEqual(fulltext.search_ids('corolla clean'), [self.corolla.pk])
+            self.assertEqual(fulltext.search_ids(''), [])
+        self.assertEqual(fulltext.search_ids('toyota  seats'), [self.nissan_car.pk])
+
+
+# Homepage data cache
+class HomepageCacheTests(TestCase):
+    def setUp(self):
+        self.car = create_cars(1, is_featured=True)[0]
+        homepage.invalidate()
+
+    def test_bundle_is_cached_and_counted(self):
+        before = homepage.cache_stats()
+        data = get_homepage_data()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_homepage_data()['homepage_cars'], data['homepage_cars'])
+        after = homepage.cache_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual([car.pk for car in data['homepage_cars']], [self.car.pk])
+        self.assertEqual(data['car_stats']['total_cars'], 1)
+
+    def test_signals_invalidate_only_on_shown_changes(self):
+        get_homepage_data()
+        version = homepage._version()
+
+        self.car.views_count += 1
+        self.car.save(update_fields=['views_count'])
+        self.assertEqual(homepage._version(), version)
+
+        self.car.status = 'sold'
+        self.car.save()
+        self.assertGreater(homepage._version(), version)
+        self.assertEqual(get_homepage_data()['homepage_cars'], [])
+
+        version = homepage._version()
+        Testimonial.objects.create(customer_name='Jane', message='Great', rating=5)
+        self.assertGreater(homepage._version(), version)
+
+    def test_bundle_built_before_commit_is_rebuilt(self):
+        stale = get_homepage_data()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.car.status = 'sold'
+            self.car.save()
+            # Another process, which can't see the save yet, rebuilds the bundle
+            with mock.patch.object(homepage, 'build_homepage_data', return_value=stale):
+                get_homepage_data()
+        self.assertEqual(get_homepage_data()['homepage_cars'], [])
+
+    def test_search_parameter_runs_no_queries(self):
+        self.client.get(reverse('homepage'))
+        with CaptureQueriesContext(connections['default']) as plain:
+            self.client.get(reverse('homepage'))
+        with self.assertNumQueries(len(plain)), mock.patch('mywebsite.views.process_car_search') as search:
+            response = self.client.get(reverse('homepage'), {'search': '1', 'brand': self.car.brand_id})
+        self.assertEqual(response.status_code, 200)
+        search.assert_not_called()
+
+
+# Buffered view counters
+class ViewCounterTests(TestCase):
+    def setUp(self):
+        view_counter.buffer.take()  # drop counts left by other tests
+        self.cars = create_cars(3)
+        author = User.objects.create_user('writer')
+        self.post = BlogPost.objects.create(title='News', slug='news', content='...', author=author)
+
+    def assertViews(self, *expected):
+        self.assertEqual(
+            [car.views_count for car in Car.objects.filter(pk__in=[c.pk for c in self.cars]).order_by('pk')],
+            list(expected),
+        )
+
+    def test_flush_batches_updates(self):
+        self.cars[0].increment_views()
+        self.cars[0].increment_views()
+        self.cars[1].increment_views()
+        self.cars[2].increment_views()
+        self.post.increment_views()
+        self.assertViews(0, 0, 0)
+
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.assertEqual(view_counter.flush(), 4)
+        # One UPDATE per (model, amount): cars x2, cars x1, the post
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries), 3)
+        self.assertViews(2, 1, 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views_count, 1)
+        self.assertEqual(view_counter.flush(), 0)
+
+    @override_settings(VIEW_COUNTER_MAX_PENDING=2)
+    def test_flushes_when_enough_objects_are_pending(self):
+        self.cars[0].increment_views()
+        self.cars[0].increment_views()
+        self.assertViews(0, 0, 0)
+        self.cars[1].increment_views()
+        self.assertViews(2, 1, 0)
+
+    def test_failed_flush_keeps_the_counts(self):
+        self.cars[0].increment_views()
+        with mock.patch.object(counters, '_write', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            view_counter.flush()
+        view_counter.flush()
+        self.assertViews(1, 0, 0)
+
+    def test_background_thread_flushes_periodically(self):
+        class Stop(Exception):
+            pass
+
+        self.cars[0].increment_views()
+        with mock.patch.object(counters.time, 'sleep', side_effect=[None, Stop]) as sleep, \
+                mock.patch.object(connections['default'], 'close'), self.assertRaises(Stop):
+            view_counter._run_flusher()
+        self.assertEqual(sleep.call_count, 2)
+        self.assertViews(1, 0, 0)
+
+        counter = counters.ViewCounter()
+        with mock.patch.object(counters.threading, 'Thread') as thread:
+            counter.ensure_flusher()
+            thread.return_value.start.assert_not_called()
+            with override_settings(VIEW_COUNTER_BACKGROUND_FLUSH=True):
+                counter.ensure_flusher()
+            thread.return_value.start.assert_called_once()
+
+    def test_command_needs_a_shared_buffer(self):
+        self.cars[0].increment_views()
+        with self.assertRaisesMessage(CommandError, "VIEW_COUNTER_BUFFER is 'memory'"):
+            call_command('flush_view_counts', stdout=StringIO())
+
+        cache.delete(counters.PENDING_KEY)
+        with mock.patch.object(view_counter, '_buffer', counters.CacheBuffer()), \
+                override_settings(VIEW_COUNTER_BUFFER='cache'):
+            self.cars[1].increment_views()
+            self.cars[1].increment_views()
+            out = StringIO()
+            call_command('flush_view_counts', stdout=out)
+        self.assertIn('Total rows updated: 1', out.getvalue())
+        self.assertViews(0, 2, 0)
+
+
+# Keyset (cursor) pagination
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        # Same price throughout, so the car id breaks every tie
+        self.cars = create_cars(5)
+        facet_index.invalidate()
+
+    def walk(self, per_page, sort='price'):
+        """Follow next cursors from the first page; returns the pages' ids"""
+        result = facet_index.search(sort=sort)
+        pages, cursor = [], None
+        while True:
+            page = result.cursor_page(cursor, per_page)
+            pages.append([car.pk for car in page])
+            if not page.has_next():
+                return result, pages
+            cursor = facets.Cursor.decode(page.next_cursor.encode(), sort)
+
+    def test_ties_are_ordered_by_id(self):
+        result, pages = self.walk(2)
+        ids = [car.pk for car in self.cars]
+        self.assertEqual(pages, [ids[0:2], ids[2:4], ids[4:]])
+        self.assertEqual(sum(pages, []), result.ids)
+
+        result, pages = self.walk(2, sort='-price')
+        self.assertEqual(sum(pages, []), ids[::-1])
+
+        # A 'prev' cursor returns the page before it
+        last = result.cursor_page(facets.Cursor('-price', (Decimal('1500000'), ids[0]), 'next'), 2)
+        self.assertEqual([car.pk for car in last], [])
+        page = result.cursor_page(facets.Cursor('-price', (Decimal('1500000'), ids[2]), 'prev'), 2)
+        self.assertEqual([car.pk for car in page], ids[4:2:-1])
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+    def test_cursor_across_a_deleted_car(self):
+        result = facet_index.search(sort='price')
+        first = result.cursor_page(None, 2)
+        token = first.next_cursor.encode()
+        # The car the cursor points at goes away before the next request
+        self.cars[1].delete()
+        self.cars[2].delete()
+        result = facet_index.search(sort='price')
+        page = result.cursor_page(facets.Cursor.decode(token, 'price'), 2)
+        self.assertEqual([car.pk for car in page], [self.cars[3].pk, self.cars[4].pk])
+        self.assertFalse(page.has_next())
+        self.assertTrue(page.has_previous())
+
+    def test_invalid_cursors_are_ignored(self):
+        valid = facets.Cursor('price', (1500000, self.cars[0].pk)).encode()
+        self.assertIsNotNone(facets.Cursor.decode(valid, 'price'))
+        for token in ['', 'garbage', valid[:-3], valid[:-6], '{}']:
+            self.assertIsNone(facets.Cursor.decode(token, 'price'), token)
+        # Issued for another sort, or with a key of the wrong type
+        self.assertIsNone(facets.Cursor.decode(valid, '-price'))
+        tampered = facets.Cursor('price', ('1500000', self.cars[0].pk)).encode()
+        self.assertIsNone(facets.Cursor.decode(tampered, 'price'))
+        tampered = facets.Cursor('-created_at', ('yesterday', self.cars[0].pk)).encode()
+        self.assertIsNone(facets.Cursor.decode(tampered, '-created_at'))
+
+        # The view falls back to the first page
+        response = self.client.get(reverse('car_list'), {'per_page': 2, 'sort': 'price', 'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['cursor_mode'])
+        self.assertEqual([car.pk for car in response.context['cars']], [self.cars[0].pk, self.cars[1].pk])
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(views, 'CAR_LIST_MAX_PER_PAGE', 2):
+            response = self.client.get(reverse('car_list'), {'per_page': 1000})
+            self.assertEqual(len(response.context['cars']), 2)
+            self.assertFalse(response.context['cursor_mode'])
+            self.assertEqual(response.context['page_obj'].paginator.num_pages, 3)
+
+            # "All" becomes cursor pages of the cap
+            response = self.client.get(reverse('car_list'), {'per_page': 'all'})
+            self.assertTrue(response.context['cursor_mode'])
+            self.assertEqual(len(response.context['cars']), 2)
+            response = self.client.get(reverse('car_list') + response.context['next_url'])
+            self.assertEqual(len(response.context['cars']), 2)
+            self.assertIsNotNone(response.context['previous_url'])
+
+
+# Car image renditions
+@override_settings(IMAGE_RENDITIONS_ASYNC=False)
+class RenditionTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.root = media.name
+
+        # Portrait once the EXIF orientation is applied
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        os.makedirs(os.path.join(self.root, 'car_images'))
+        Image.new('RGB', (2000, 1000), 'red').save(os.path.join(self.root, 'car_images/car.jpg'), 'JPEG', exif=exif)
+        self.car = create_cars(1)[0]
+
+    def create_image(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            car_image = CarImage.objects.create(car=self.car, image='car_images/car.jpg')
+        car_image.refresh_from_db()
+        return car_image
+
+    def test_sizes_and_formats(self):
+        car_image = self.create_image()
+        self.assertEqual(set(car_image.renditions), set(images.RENDITIONS))
+        self.assertEqual(car_image.source_hash, images.file_hash(car_image.image))
+        for name, (max_width, max_height) in images.RENDITIONS.items():
+            entry = car_image.renditions[name]
+            # Scaled down to fit, keeping the rotated 1:2 aspect ratio
+            self.assertEqual(entry['height'], min(max_height, 2000))
+            self.assertAlmostEqual(entry['width'], entry['height'] / 2, delta=1)
+            for extension, fmt in (('jpg', 'JPEG'), ('webp', 'WEBP')):
+                with Image.open(os.path.join(self.root, entry[extension])) as img:
+                    self.assertEqual(img.format, fmt)
+                    self.assertEqual(img.size, (entry['width'], entry['height']))
+                    if fmt == 'JPEG':
+                        self.assertTrue(img.info.get('progressive'))
+        self.assertEqual(car_image.card_url, '/media/' + car_image.renditions['card']['jpg'])
+        self.assertIn(' 500w', car_image.webp_srcset)
+
+    def test_command_finds_missing_and_stale_renditions(self):
+        with self.captureOnCommitCallbacks():  # the renditions are not built
+            missing = CarImage.objects.create(car=self.car, image='car_images/car.jpg')
+        built = self.create_image()
+
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, '1 images have missing or stale renditions'):
+            call_command('generate_image_renditions', '--check', stdout=out)
+        self.assertIn('Stale: car_images/car.jpg', out.getvalue())
+
+        call_command('generate_image_renditions', stdout=StringIO())
+        missing.refresh_from_db()
+        self.assertEqual(set(missing.renditions), set(images.RENDITIONS))
+        out = StringIO()
+        call_command('generate_image_renditions', '--check', stdout=out)
+        self.assertIn('Total images checked: 2', out.getvalue())
+
+        # The file was replaced in place: both hashes are now stale
+        Image.new('RGB', (300, 200), 'blue').save(os.path.join(self.root, 'car_images/car.jpg'), 'JPEG')
+        with self.assertRaisesMessage(CommandError, '2 images have missing or stale renditions'):
+            call_command('generate_image_renditions', '--check', stdout=StringIO())
+        out = StringIO()
+        call_command('generate_image_renditions', stdout=out)
+        self.assertIn('Total images processed: 2', out.getvalue())
+        built.refresh_from_db()
+        self.assertEqual(built.renditions['hero']['width'], 300)
+
+
+# Denormalized primary image
+class PrimaryImageTests(TestCase):
+    def setUp(self):
+        self.car = create_cars(1)[0]
+
+    def add_image(self, name, **fields):
+        return CarImage.objects.create(car=self.car, image=f'car_images/{name}.jpg', **fields)
+
+    def assertPrimary(self, image):
+        self.car.refresh_from_db()
+        self.assertEqual(self.car.primary_image_id, image.pk if image else None)
+
+    def test_follows_the_primary_flag(self):
+        first = self.add_image('first')
+        self.assertPrimary(first)
+        second = self.add_image('second', is_primary=True)
+        self.assertPrimary(second)
+
+        # Flagging another image clears the old flag
+        first.is_primary = True
+        first.save()
+        second.refresh_from_db()
+        self.assertFalse(second.is_primary)
+        self.assertPrimary(first)
+
+        first.is_primary = False
+        first.save()
+        self.assertPrimary(first)  # still first in display order
+
+    def test_follows_order_and_deletes(self):
+        first = self.add_image('first', order=1)
+        second = self.add_image('second', order=2)
+        self.assertPrimary(first)
+
+        second.order = 0
+        second.save()
+        self.assertPrimary(second)
+
+        second.delete()
+        self.assertPrimary(first)
+        first.delete()
+        self.assertPrimary(None)
+
+    def test_listing_uses_the_primary_image(self):
+        self.add_image('first')
+        cover = self.add_image('cover', is_primary=True)
+        response = self.client.get(reverse('car_list'))
+        self.assertContains(response, cover.image.url)
+        self.assertNotContains(response, '/media/car_images/first.jpg')
+
+
+# Synthetic inventory generation
+class GenerateInventoryTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.root = media.name
+
+        brand = Brand.objects.create(name='Toyota')
+        CarModel.objects.create(brand=brand, name='Corolla', body_type='sedan')
+        Location.objects.create(name='Westlands', county='Nairobi')
+
+    def test_generates_cars_with_placeholder_images(self):
+        out = StringIO()
+        call_command(
+            'generate_inventory', cars=5, images_per_car=2, inquiries=3, batch_size=2, seed=1, stdout=out
+        )
+        self.assertIn('Total cars created: 5 (10 images, 3 inquiries)', out.getvalue())
+        with Image.open(os.path.join(self.root, 'car_images/placeholder.jpg')) as img:
+            self.assertEqual(img.format, 'JPEG')
+
+        cars = Car.objects.all()
+        self.assertEqual(len(cars), 5)
+        self.assertEqual(len({car.slug for car in cars}), 5)
+        for car in cars:
+            self.assertEqual(car.primary_image, car.images.get(is_primary=True))
+        self.assertEqual(CustomerInquiry.objects.count(), 3)
+        self.assertEqual(facet_index.search().count, 5)
+
+    def test_missing_image_path(self):
+        with self.assertRaisesMessage(CommandError, '--image-path car_images/missing.jpg does not exist'):
+            call_command('generate_inventory', cars=1, image_path='car_images/missing.jpg', stdout=StringIO())
+        self.assertFalse(Car.objects.exists())
+
+        call_command('generate_inventory', cars=1, images_per_car=0, image_path='car_images/missing.jpg',
+                     stdout=StringIO())
+        self.assertEqual(Car.objects.count(), 1)
+
+
+# Unique slugs
+class SlugTests(TestCase):
+    base = '2018-toyota-corolla'
+
+    def test_collisions_get_the_first_free_suffix(self):
+        cars = create_cars(3)
+        self.assertEqual([car.slug for car in cars], [self.base, f'{self.base}-1', f'{self.base}-2'])
+
+        # Neighbouring slugs that only share a prefix don't count
+        Car.objects.filter(pk=cars[1].pk).update(slug=f'{self.base}x')
+        other = create_cars(1, year=2018, car_model=CarModel.objects.create(
+            brand=cars[0].brand, name='Corolla Cross', body_type='suv'
+        ))[0]
+        self.assertEqual(other.slug, f'{self.base}-cross')
+        with CaptureQueriesContext(connections['default']) as queries:
+            taken = slugs._taken(Car, self.base)
+        self.assertEqual(taken, {self.base, f'{self.base}-2', f'{self.base}-cross'})
+        self.assertNotIn('ORDER BY', queries[0]['sql'])
+        self.assertEqual(slugs.allocate_slug(Car, self.base), f'{self.base}-1')
+        # A car keeps its own slug when re-slugged
+        self.assertEqual(slugs.allocate_slug(Car, self.base, exclude_pk=cars[0].pk), self.base)
+
+    def test_save_retries_when_the_slug_is_taken_concurrently(self):
+        create_cars(1)
+        allocate_slug = slugs.allocate_slug
+        calls = []
+
+        def racing(model, base, exclude_pk=None):
+            # The first allocation misses a slug another writer just took
+            calls.append(base)
+            return base if len(calls) == 1 else allocate_slug(model, base, exclude_pk)
+
+        with mock.patch.object(slugs, 'allocate_slug', side_effect=racing):
+            car = create_cars(1)[0]
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(car.slug, f'{self.base}-1')
+
+        with mock.patch.object(slugs, 'allocate_slug', return_value=self.base) as allocate, \
+                self.assertRaises(IntegrityError):
+            create_cars(1)
+        self.assertEqual(allocate.call_count, slugs.SAVE_ATTEMPTS)
+
+        # Other integrity errors are not retried
+        save = mock.Mock(side_effect=IntegrityError)
+        with self.assertRaises(IntegrityError):
+            slugs.save_with_slug(Car(), 'fresh', save)
+        self.assertEqual(save.call_count, 1)
+
+    def test_allocator(self):
+        Car.objects.filter(pk=create_cars(1)[0].pk).update(slug=f'{self.base}-1')
+        allocator = slugs.SlugAllocator(Car)
+        with self.assertNumQueries(1):
+            allocated = [allocator.allocate(self.base) for _ in range(3)]
+        self.assertEqual(allocated, [self.base, f'{self.base}-2', f'{self.base}-3'])
+        with self.assertNumQueries(1):
+            self.assertEqual(allocator.allocate('other'), 'other')
+            self.assertEqual(allocator.allocate('other'), 'other-1')
+
+        allocator = slugs.SlugAllocator(Car).preload()
+        with self.assertNumQueries(0):
+            self.assertEqual(allocator.allocate(self.base), self.base)
+            self.assertEqual(allocator.allocate(self.base), f'{self.base}-2')
+
+
+# Shared cache
+class SharedCacheTests(TestCase):
+    # Another worker process, invalidating after a change it made
+    WORKER = (
+        "import django; django.setup(); "
+        "from mywebsite import facets, homepage; "
+        "homepage.invalidate(); facets.facet_index.invalidate()"
+    )
+
+    def test_invalidation_reaches_other_processes(self):
+        create_cars(1)
+        get_homepage_data()
+        facet_index.search()
+        version = homepage._version()
+
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'carsoko.settings'}
+        env.pop('CARSOKO_REDIS_URL', None)
+        env['CARSOKO_CACHE_DIR'] = settings.CACHES['default']['LOCATION']
+        subprocess.run([sys.executable, '-c', self.WORKER], cwd=settings.BASE_DIR, env=env, check=True)
+
+        self.assertGreater(homepage._version(), version)
+        with mock.patch.object(facet_index, 'build', wraps=facet_index.build) as build:
+            self.assertEqual(facet_index.search().count, 1)
+        build.assert_called_once()
+
+
+# Admin changelists
+class AdminChangelistQueryTests(TestCase):
+    # session, user, count, full count, list-filter choices, rows
+    CAR_CHANGELIST_QUERIES = 7
+    INQUIRY_CHANGELIST_QUERIES = 5
+    COMPARISON_CHANGELIST_QUERIES = 5
+
+    def setUp(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+    def add_rows(self, count):
+        cars = create_cars(count)
+        for car in cars:
+            CarImage.objects.create(car=car, image='car_images/test.jpg')
+            CustomerInquiry.objects.create(
+                car=car, inquiry_type='purchase', customer_name='Jane',
+                customer_phone='0700000000', message='Is it available?'
+            )
+            comparison = CarComparison.objects.create(session_key='abc')
+            comparison.cars.add(car, cars[0])
+
+    def assertChangelistQueries(self, url, expected):
+        with self.assertNumQueries(expected):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_car_changelist_query_count_is_constant(self):
+        url = reverse('admin:mywebsite_car_changelist')
+        self.add_rows(5)
+        self.assertChangelistQueries(url, self.CAR_CHANGELIST_QUERIES)
+        self.add_rows(95)
+        response = self.assertChangelistQueries(url, self.CAR_CHANGELIST_QUERIES)
+        self.assertContains(response, '2018 Toyota Corolla')
+        self.assertContains(response, '1 image')
+
+    def test_inquiry_changelist_query_count_is_constant(self):
+        url = reverse('admin:mywebsite_customerinquiry_changelist')
+        self.add_rows(5)
+        self.assertChangelistQueries(url, self.INQUIRY_CHANGELIST_QUERIES)
+        self.add_rows(95)
+        CustomerInquiry.objects.create(
+            inquiry_type='general', customer_name='John',
+            customer_phone='0711111111', message='Hello'
+        )
+        response = self.assertChangelistQueries(url, self.INQUIRY_CHANGELIST_QUERIES)
+        self.assertContains(response, '2018 Toyota Corolla')
+        self.assertContains(response, 'General Inquiry')
+
+    def test_comparison_changelist_query_count_is_constant(self):
+        url = reverse('admin:mywebsite_carcomparison_changelist')
+        self.add_rows(5)
+        self.assertChangelistQueries(url, self.COMPARISON_CHANGELIST_QUERIES)
+        self.add_rows(95)
+        response = self.assertChangelistQueries(url, self.COMPARISON_CHANGELIST_QUERIES)
+        self.assertContains(response, 'Comparison of 2 cars')
+
+
+# View benchmarks
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        use_temporary_spool(self)
+        cars = create_cars(3)
+        CarImage.objects.create(car=cars[0], image='car_images/test.jpg')
+
+    def test_run_measures_every_view(self):
+        scenarios = [
+            scenario for scenario in benchmarks.build_scenarios()
+            if not scenario.name.startswith('car_list:') or scenario.name.startswith('car_list:brand:price:')
+        ]
+        results = benchmarks.run(repeats=1, scenarios=scenarios)
+
+        self.assertEqual(set(results['views']), {scenario.name for scenario in scenarios})
+        for name, result in results['views'].items():
+            self.assertEqual(result['status'], 200, name)
+            self.assertGreater(result['peak_kib'], 0, name)
+        # Served from the reference data cache
+        self.assertEqual(results['views']['get_models_by_brand']['queries'], 0)
+        self.assertEqual(results['meta']['cars'], 3)
+
+    def test_compare_flags_regressions(self):
+        baseline = {'views': {
+            'car_list': {'status': 200, 'queries': 6, 'time_ms': 40.0, 'peak_kib': 500.0},
+            'homepage': {'status': 200, 'queries': 0, 'time_ms': 1.0, 'peak_kib': 100.0},
+        }}
+        current = {'views': {
+            'car_list': {'status': 200, 'queries': 7, 'time_ms': 60.0, 'peak_kib': 700.0},
+            'homepage': {'status': 200, 'queries': 0, 'time_ms': 2.5, 'peak_kib': 110.0},
+        }}
+
+        regressions = benchmarks.compare(baseline, current, threshold=0.25)
+
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(all(regression.startswith('car_list:') for regression in regressions))
+        self.assertEqual(benchmarks.compare(baseline, baseline), [])
+
+
+# Query budget middleware
+@override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_RAISE=True)
+class QueryBudgetMiddlewareTests(TestCase):
+    def setUp(self):
+        self.cars = create_cars(4)
+        # Budgets are for steady state, with the process caches warm
+        reference.reference_data.current()
+        facet_index.search()
+        get_homepage_data()
+
+    def test_headers(self):
+        response = self.client.get(reverse('car_detail_ajax', args=[self.cars[0].pk]))
+        self.assertEqual(response['X-Query-Count'], '3')
+        self.assertEqual(response['X-Query-Repeated'], '0')
+        self.assertEqual(response['X-Query-Budget'], '5')
+
+    def test_views_stay_within_budget(self):
+        self.client.get(reverse('homepage'))
+        self.client.get(reverse('car_list'), {'per_page': 'all'})
+        self.client.get(reverse('car_detail', args=[self.cars[0].slug]))
+        self.client.get(reverse('car_detail_ajax', args=[self.cars[0].pk]))
+
+    @override_settings(QUERY_BUDGETS={'car_detail_ajax': 2})
+    def test_budget_exceeded_raises(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('car_detail_ajax', args=[self.cars[0].pk]))
+
+    def test_repeated_queries_are_reported_with_template_line(self):
+        template = Template("{% for car in cars %}\n{{ car.location.name }}{% endfor %}")
+
+        def view(request):
+            cars = Car.objects.order_by('pk')
+            return HttpResponse(template.render(Context({'cars': cars})))
+
+        request = RequestFactory().get('/')
+        request.resolver_match = None
+        with self.assertLogs('mywebsite.middleware', 'WARNING') as logs:
+            response = QueryBudgetMiddleware(view)(request)
+
+        self.assertEqual(response['X-Query-Count'], '5')
+        self.assertEqual(response['X-Query-Repeated'], '1')
+        self.assertIn('Possible N+1', logs.output[0])
+        self.assertIn('<unknown source>:2', logs.output[0])
+
+    def test_queries_on_every_alias_are_counted(self):
+        replica = mock.Mock(execute_wrappers=[])
+
+        def view(request):
+            list(Car.objects.all())
+            # A query on the replica connection
+            replica.execute_wrappers[0](lambda *args: None, 'SELECT 1', (), False, {})
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.resolver_match = None
+        with mock.patch.object(connections, 'all', return_value=[connections['default'], replica]):
+            response = QueryBudgetMiddleware(view)(request)
+        self.assertEqual(response['X-Query-Count'], '2')
+
+    async def test_async_views_are_counted_without_a_thread_switch(self):
+        other = mock.Mock(execute_wrappers=[])
+
+        async def view(request):
+            cars = [car async for car in Car.objects.all()]
+            # A connection opened in another thread, queried off the
+            # thread-sensitive executor
+            connection_created.send(sender=None, connection=other)
+            query = sync_to_async(other.execute_wrappers[0], thread_sensitive=False)
+            await query(lambda *args: None, 'SELECT 1', (), False, {})
+            return HttpResponse(len(cars))
+
+        middleware = QueryBudgetMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        request = RequestFactory().get('/')
+        request.resolver_match = None
+        response = await middleware(request)
+        self.assertEqual(response['X-Query-Count'], '2')
+
+        response = await self.async_client.get(reverse('car_detail_ajax', args=[self.cars[0].pk]))
+        self.assertEqual(response['X-Query-Count'], '3')
+
+
+# Reference data cache
+class ReferenceDataTests(TestCase):
+    def setUp(self):
+        self.car = create_cars(1)[0]
+
+    def test_steady_state_costs_no_queries(self):
+        reference.reference_data.current()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('models_by_brand'), {'brand_id': self.car.brand_id})
+        self.assertEqual(response.json(), {'models': [{'id': self.car.car_model_id, 'name': 'Corolla'}]})
+        with self.assertNumQueries(0):
+            self.assertEqual(reference.get_brand(slug='toyota'), self.car.brand)
+
+    def test_saving_reference_rows_invalidates(self):
+        self.assertEqual([brand.name for brand in reference.brands()], ['Toyota'])
+        Brand.objects.create(name='Audi')
+        self.assertEqual([brand.name for brand in reference.brands()], ['Audi', 'Toyota'])
+        self.car.location.delete()
+        self.assertEqual(reference.locations(), [])
+
+
+# Materialized inventory statistics
+class InventoryStatTests(TestCase):
+    def assertNoDrift(self):
+        self.assertEqual(stats.rebuild(), 0)
+
+    def test_signals_keep_stats_in_sync(self):
+        cheap, dear, other = create_cars(3)
+        dear.price = Decimal('4000000')
+        dear.save()
+        other.year = 2020
+        other.location = Location.objects.create(name='Nyali', county='Mombasa')
+        other.save()
+        self.assertNoDrift()
+
+        totals = stats.totals()
+        self.assertEqual((totals.cars, totals.available), (3, 3))
+        self.assertEqual(totals.max_price, Decimal('4000000'))
+
+        CarRental.objects.create(car=cheap, daily_rate=Decimal('5000'))
+        self.assertEqual(stats.totals().available_for_rent, 1)
+        self.assertNoDrift()
+
+        dear.status = 'sold'
+        dear.save(update_fields=['status'])
+        self.assertEqual(stats.totals().available_max_price, Decimal('1500000'))
+        self.assertNoDrift()
+
+        cheap.delete()
+        dear.delete()
+        totals = stats.totals()
+        self.assertEqual((totals.cars, totals.available, totals.available_for_rent), (1, 1, 0))
+        self.assertNoDrift()
+
+    def test_views_count_update_skips_stats(self):
+        car = Car.objects.get(pk=create_cars(1)[0].pk)
+        with self.assertNumQueries(1):
+            car.save(update_fields=['views_count'])
+
+    def test_homepage_uses_stats(self):
+        create_cars(2, status='available')
+        create_cars(1, status='sold', year=2010)
+        data = get_homepage_data()
+        self.assertEqual(data['years'], [2018, 2010])
+        self.assertEqual(data['car_stats']['total_cars'], 2)
+        self.assertEqual([model.car_count for model in data['popular_models']], [2])
+
+
+# Conditional GET
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.car = create_cars(1)[0]
+
+    def revalidate(self, url, response, **params):
+        return self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_quick_view_revalidates_with_one_query(self):
+        url = reverse('car_detail_ajax', args=[self.car.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        CarRental.objects.create(car=self.car, daily_rate=Decimal('5000'))
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        self.car.rental_info.delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_list_and_models_revalidate_without_queries(self):
+        reference.reference_data.current()
+        url = reverse('car_list')
+        response = self.client.get(url, {'brand': 'toyota'})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(url, response, brand='toyota').status_code, 304)
+            models_url = reverse('models_by_brand')
+            models = self.client.get(models_url, {'brand_id': self.car.brand_id})
+            self.assertEqual(self.revalidate(models_url, models, brand_id=self.car.brand_id).status_code, 304)
+
+        self.car.price = Decimal('1400000')
+        self.car.save()
+        self.assertEqual(self.revalidate(url, response, brand='toyota').status_code, 200)
+
+    def test_detail_page_changes_with_images_and_counts_views(self):
+        view_counter.buffer.take()  # drop counts left by other tests
+        url = reverse('car_detail', args=[self.car.slug])
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        view_counter.flush()
+        self.car.refresh_from_db()
+        self.assertEqual(self.car.views_count, 2)
+
+        CarImage.objects.create(car=self.car, image='car_images/front.jpg')
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_list_rendered_before_commit_is_revalidated(self):
+        url = reverse('car_list')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.car.price = Decimal('1400000')
+            self.car.save()
+            # Another request rendering before the save commits
+            response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_views_count_update_keeps_validators(self):
+        etag = conditional.car_list_etag(None)
+        Car.objects.get(pk=self.car.pk).save(update_fields=['views_count'])
+        self.assertEqual(conditional.car_list_etag(None), etag)
+
+
+# Brand/model catalog
+class CatalogTests(TestCase):
+    def setUp(self):
+        self.car = create_cars(2)[0]
+
+    def test_catalog_is_served_immutable_by_digest(self):
+        url = catalog.url()
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertIn('immutable', response['Cache-Control'])
+        data = response.json()
+        self.assertEqual(data['brands'], [{'id': self.car.brand_id, 'slug': 'toyota', 'name': 'Toyota', 'count': 2}])
+        self.assertEqual([(model['name'], model['count']) for model in data['models']], [('Corolla', 2)])
+        self.assertIn({'value': 'sedan', 'label': 'Sedan', 'count': 2}, data['body_types'])
+
+    def test_changes_produce_a_new_url(self):
+        url = catalog.url()
+        CarModel.objects.create(brand=self.car.brand, name='Vitz', body_type='hatchback')
+        self.assertNotEqual(catalog.url(), url)
+        response = self.client.get(url)
+        self.assertRedirects(response, catalog.url())
+
+        url = catalog.url()
+        self.car.status = 'sold'
+        self.car.save()
+        self.assertNotEqual(catalog.url(), url)
+
+    def test_change_saved_in_a_transaction_rebuilds_after_commit(self):
+        stale = catalog.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.car.status = 'sold'
+            self.car.save()
+            # A worker that can't see the save yet builds the new version
+            with mock.patch.object(catalog, 'build', return_value=stale):
+                stale_url = catalog.url()
+        self.assertNotEqual(catalog.url(), stale_url)
+        self.assertEqual(catalog.current().key[1], conditional.inventory_version())
+        self.assertEqual(json.loads(catalog.current().content)['brands'][0]['count'], 1)
+
+    def test_pages_link_the_catalog(self):
+        response = self.client.get(reverse('homepage'))
+        self.assertContains(response, f'data-catalog-url="{catalog.url()}"')
+
+
+# Async views
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        use_temporary_spool(self)
+        self.car = create_cars(1)[0]
+        self.client = AsyncClient()
+
+    async def test_submit_inquiry(self):
+        response = await self.client.post(reverse('submit_inquiry'), {
+            'car_id': str(self.car.pk),
+            'customer_name': 'Jane',
+            'customer_phone': '0700000000',
+            'message': 'Still available?',
+        })
+        data = response.json()
+        self.assertTrue(data['success'])
+        await sync_to_async(ingest.flush)()
+        inquiry = await CustomerInquiry.objects.aget(idempotency_key=data['reference'])
+        self.assertEqual(inquiry.car_id, self.car.pk)
+
+    async def test_newsletter_subscribe_and_reactivate(self):
+        url = reverse('newsletter_subscribe')
+        self.assertTrue((await self.client.post(url, {'email': 'jane@example.com'})).json()['success'])
+        await sync_to_async(ingest.flush)()
+        self.assertFalse((await self.client.post(url, {'email': 'jane@example.com'})).json()['success'])
+        await NewsletterSubscription.objects.filter(email='jane@example.com').aupdate(is_active=False)
+        response = await self.client.post(url, {'email': 'jane@example.com'})
+        self.assertIn('reactivated', response.json()['message'])
+        await sync_to_async(ingest.flush)()
+        self.assertTrue((await NewsletterSubscription.objects.aget(email='jane@example.com')).is_active)
+
+    @override_settings(VIEW_COUNTER_MAX_PENDING=1)
+    async def test_quick_view_flushes_view_counts_in_background(self):
+        counters.view_counter.buffer.take()  # drop counts left by other tests
+        response = await self.client.get(reverse('car_detail_ajax', args=[self.car.pk]))
+        self.assertEqual(response.json()['car']['id'], self.car.pk)
+        await asyncio.gather(*counters._background_tasks)
+        self.assertEqual((await Car.objects.aget(pk=self.car.pk)).views_count, 1)
+
+
+# Write-behind ingestion
+class IngestTests(TestCase):
+    def setUp(self):
+        use_temporary_spool(self)
+        self.car = create_cars(1)[0]
+
+    def inquiry(self, **overrides):
+        data = {
+            'car_id': self.car.pk,
+            'inquiry_type': 'purchase',
+            'customer_name': 'Jane',
+            'customer_phone': '0700000000',
+            'customer_email': '',
+            'message': 'Still available?',
+            'preferred_contact_method': 'whatsapp',
+        }
+        data.update(overrides)
+        return data
+
+    def test_submissions_are_acknowledged_before_the_write(self):
+        response = self.client.post(reverse('submit_inquiry'), {
+            'car_id': self.car.pk, 'customer_name': 'Jane', 'customer_phone': '0700000000', 'message': 'Hi',
+        }, HTTP_IDEMPOTENCY_KEY='retry-1')
+        reference = response.json()['reference']
+        self.assertFalse(CustomerInquiry.objects.exists())
+        self.assertEqual(ingest.metrics()['backlog'], 1)
+
+        self.assertEqual(ingest.flush(), {'inquiry': 1, 'newsletter': 0})
+        self.assertEqual(CustomerInquiry.objects.get().idempotency_key, reference)
+        metrics = ingest.metrics()
+        self.assertEqual((metrics['backlog'], metrics['lag_seconds']), (0, 0.0))
+        self.assertEqual(metrics['last_written'], {'inquiry': 1, 'newsletter': 0})
+
+    def test_replayed_records_are_written_once(self):
+        ingest.submit(ingest.INQUIRY, 'key-1', self.inquiry())
+        ingest.flush()
+        # The same record again, as after a crash before the segment was removed
+        ingest.submit(ingest.INQUIRY, 'key-1', self.inquiry())
+        ingest.submit(ingest.INQUIRY, 'key-2', self.inquiry(car_id=999999))
+        ingest.submit(ingest.NEWSLETTER, 'key-3', {'email': 'jane@example.com'})
+        ingest.submit(ingest.NEWSLETTER, 'key-4', {'email': 'jane@example.com'})
+        ingest.flush()
+
+        self.assertEqual(CustomerInquiry.objects.count(), 2)
+        self.assertIsNone(CustomerInquiry.objects.get(idempotency_key='key-2').car_id)
+        self.assertEqual(NewsletterSubscription.objects.filter(email='jane@example.com').count(), 1)
+
+    def test_client_keys_are_scoped_to_the_submission(self):
+        def post(name):
+            return self.client.post(reverse('submit_inquiry'), {
+                'car_id': self.car.pk, 'customer_name': name, 'customer_phone': '0700000000', 'message': 'Hi',
+            }, HTTP_IDEMPOTENCY_KEY='1').json()['reference']
+
+        # A retry keeps its key; another customer reusing the key gets their own
+        self.assertEqual(post('Jane'), post('Jane'))
+        self.assertNotEqual(post('John'), post('Jane'))
+        ingest.flush()
+        self.assertCountEqual(CustomerInquiry.objects.values_list('customer_name', flat=True), ['Jane', 'John'])
+
+    def test_poison_records_are_set_aside(self):
+        ingest.submit(ingest.INQUIRY, 'key-1', self.inquiry())
+        ingest.submit(ingest.INQUIRY, 'key-2', self.inquiry(car_id=[self.car.pk]))
+        ingest.submit(ingest.INQUIRY, 'key-3', self.inquiry(unknown_field='x'))
+        ingest.submit('complaint', 'key-4', {})
+        ingest.submit(ingest.NEWSLETTER, 'key-5', {'email': 'jane@example.com'})
+
+        with self.assertLogs('mywebsite.ingest', 'ERROR') as logs:
+            self.assertEqual(ingest.flush(), {'inquiry': 1, 'newsletter': 1})
+        self.assertEqual(len(logs.output), 3)
+        self.assertEqual(list(CustomerInquiry.objects.values_list('idempotency_key', flat=True)), ['key-1'])
+        self.assertTrue(NewsletterSubscription.objects.filter(email='jane@example.com').exists())
+
+        dead = ingest.spool.dead_letters()
+        self.assertEqual([entry['record']['key'] for entry in dead], ['key-2', 'key-3', 'key-4'])
+        self.assertIn('unknown_field', dead[1]['error'])
+        metrics = ingest.metrics()
+        self.assertEqual((metrics['backlog'], metrics['dead_letters']), (0, 3))
+        # The flush moves on; nothing is retried
+        self.assertEqual(ingest.flush(), {'inquiry': 0, 'newsletter': 0})
+
+    def test_unavailable_database_keeps_the_records(self):
+        ingest.submit(ingest.INQUIRY, 'key-1', self.inquiry())
+        writer = mock.Mock(side_effect=OperationalError('database is locked'))
+        with mock.patch.dict(ingest.WRITERS, {ingest.INQUIRY: writer}):
+            with self.assertRaises(OperationalError):
+                ingest.flush()
+        self.assertEqual(ingest.metrics()['dead_letters'], 0)
+        self.assertEqual(ingest.flush(), {'inquiry': 1, 'newsletter': 0})
+
+    def test_invalid_submissions_are_rejected_without_spooling(self):
+        response = self.client.post(reverse('newsletter_subscribe'), {'email': 'not-an-email'})
+        self.assertFalse(response.json()['success'])
+        response = self.client.post(reverse('submit_inquiry'), {
+            'customer_name': 'Jane', 'customer_phone': '0700000000', 'message': 'Hi', 'inquiry_type': 'bogus',
+        })
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(ingest.metrics()['backlog'], 0)
+
+
+# Primary/replica routing
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], REPLICA_HEALTH_INTERVAL=60)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+        routers.health.reset()
+        self.addCleanup(routers.health.reset)
+        self.down = set()
+        patcher = mock.patch.object(routers.health, 'probe', side_effect=lambda alias: alias not in self.down)
+        self.probe = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reads(self, count=4):
+        with routers.routing(routers.RoutingState(replicas_allowed=True)):
+            return {self.router.db_for_read(Car) for _ in range(count)}
+
+    def test_only_listing_requests_read_from_replicas(self):
+        self.assertEqual(self.router.db_for_read(Car), 'default')
+        self.assertEqual(self.reads(), {'replica1', 'replica2'})
+        with routers.routing(routers.RoutingState(replicas_allowed=True)):
+            with mock.patch.object(connections['default'], 'in_atomic_block', True):
+                self.assertEqual(self.router.db_for_read(Car), 'default')
+            with routers.use_primary():
+                self.assertEqual(self.router.db_for_read(Car), 'default')
+            self.assertEqual(self.router.db_for_write(Car), 'default')
+            # Reads after a write in the same request see it
+            self.assertEqual(self.router.db_for_read(Car), 'default')
+
+    def test_sqlite_replica_probe(self):
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+        from .management.commands.sync_sqlite_replicas import Command as SyncCommand, replica_path
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'replica 1.sqlite3')
+        name = f"file:{quote(path)}?mode=ro"
+        self.assertEqual(replica_path(name), path)
+
+        def probe():
+            replica = DatabaseWrapper({**connections['default'].settings_dict, 'NAME': name}, 'replica1')
+            try:
+                with mock.patch.object(routers, 'connections', {'replica1': replica}):
+                    return routers.ReplicaHealth().probe('replica1')
+            finally:
+                replica.close()
+
+        # Never synced: not created as an empty database
+        with self.assertLogs('mywebsite.routers', 'WARNING'):
+            self.assertFalse(probe())
+        self.assertFalse(os.path.exists(path))
+
+        sqlite3.connect(path).close()
+        with self.assertLogs('mywebsite.routers', 'WARNING') as logs:
+            self.assertFalse(probe())
+        self.assertIn('empty database', logs.output[0])
+
+        primary = os.path.join(directory.name, 'primary.sqlite3')
+        with closing(sqlite3.connect(primary)) as db:
+            db.execute('CREATE TABLE car (id INTEGER PRIMARY KEY)')
+        SyncCommand().copy(primary, replica_path(name))
+        self.assertTrue(probe())
+
+    def test_unhealthy_replicas_are_ejected(self):
+        self.down = {'replica1'}
+        self.assertEqual(self.reads(), {'replica2'})
+        self.assertEqual(self.probe.call_count, 2)  # probed once per interval
+        routers.health.reset()
+        self.down = {'replica1', 'replica2'}
+        self.assertEqual(self.reads(), {'default'})
+
+    def test_a_write_keeps_the_client_on_the_primary(self):
+        def view(request):
+            if request.method == 'POST':
+                self.router.db_for_write(Car)
+            return HttpResponse(self.router.db_for_read(Car))
+
+        middleware = ReplicaRoutingMiddleware(view)
+        factory = RequestFactory()
+        self.assertIn(middleware(factory.get('/cars/list')).content, (b'replica1', b'replica2'))
+        self.assertEqual(middleware(factory.get('/admin/')).content, b'default')
+
+        response = middleware(factory.post('/ajax/newsletter-subscribe/'))
+        factory.cookies['db_primary'] = response.cookies['db_primary'].value
+        self.assertEqual(middleware(factory.get('/cars/list')).content, b'default')
+
+    def test_incidental_writes_keep_the_client_on_replicas(self):
+        def view(request):
+            # e.g. a view count flushed, or updated_at touched, while listing
+            self.router.db_for_write(Car)
+            with routers.use_primary():
+                self.router.db_for_write(Car)
+            if 'mark' in request.GET:
+                routers.mark_written()
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        factory = RequestFactory()
+        self.assertNotIn('db_primary', middleware(factory.get('/cars/list')).cookies)
+        self.assertIn('db_primary', middleware(factory.get('/cars/list', {'mark': 1})).cookies)
+
+    def test_flushes_are_not_the_clients_writes(self):
+        state = routers.RoutingState(replicas_allowed=True)
+        with routers.routing(state), mock.patch.object(counters, '_write') as write:
+            counters.view_counter.buffer.add(('mywebsite.Car', 1), 1)
+            write.side_effect = lambda pending: self.router.db_for_write(Car)
+            counters.view_counter.flush()
+        write.assert_called_once()
+        self.assertFalse(state.wrote)
+
+
+
+# Query plans
+@skipUnless(connections['default'].vendor == 'sqlite', "EXPLAIN QUERY PLAN is SQLite's")
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        use_temporary_spool(self)
+        cars = create_cars(4, is_featured=True) + create_cars(4, status='sold')
+        CarImage.objects.create(car=cars[0], image='car_images/test.jpg')
+        CustomerInquiry.objects.create(
+            car=cars[0], inquiry_type='purchase', customer_name='Jane',
+            customer_phone='0700000000', message='Is it available?'
+        )
+
+    def test_scans_are_detected_through_aliases(self):
+        sql = 'SELECT U0."id" FROM "mywebsite_car" U0 INNER JOIN "mywebsite_brand" ON (1)'
+        plan = ['SCAN U0', 'SEARCH mywebsite_brand USING INTEGER PRIMARY KEY (rowid=?)']
+        self.assertEqual(benchmarks.scanned_tables(sql, plan), ['mywebsite_car'])
+        self.assertEqual(benchmarks.scanned_tables(sql, ['SCAN U0 USING INDEX car_created_idx']), [])
+
+    def test_views_never_scan_large_tables(self):
+        # Building the facet index reads every car by design; the homepage
+        # bundle is rebuilt so its queries are checked too
+        facet_index.search()
+        homepage.invalidate()
+        changelists = {
+            'admin:cars': ('admin:mywebsite_car_changelist', {}),
+            'admin:cars:status': ('admin:mywebsite_car_changelist', {'status__exact': 'available'}),
+            'admin:inquiries': ('admin:mywebsite_customerinquiry_changelist', {}),
+            'admin:inquiries:status': ('admin:mywebsite_customerinquiry_changelist', {'status__exact': 'new'}),
+            'admin:inquiries:date': ('admin:mywebsite_customerinquiry_changelist', {'created_at__gte': '2024-01-01 00:00:00+00:00'}),
+        }
+        scenarios = benchmarks.build_scenarios() + [
+            benchmarks.Scenario(name, 'get', reverse(url), data) for name, (url, data) in changelists.items()
+        ]
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+        found = benchmarks.full_scans(scenarios, client=self.client)
+
+        self.assertEqual(found, {})
+
+
+# Static asset pipeline
+class StaticAssetTests(TestCase):
+    STYLE = (
+        ".icon { background: url(../fonts/icons.woff); }\n"
+        ".video { background: url(missing.png); }\n"
+    ) + ".row { margin: 0 auto; padding: 0 15px; }\n" * 50
+
+    def setUp(self):
+        source, root = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.addCleanup(root.cleanup)
+        for name, content in [
+            ('assets/css/style.css', self.STYLE.encode()),
+            ('assets/fonts/icons.woff', b'wOFF' * 10),
+            ('assets/img/unused.png', b'\x89PNG' * 10),
+            ('assets/js/main.js', b"$('.hero').attr('data-setbg', '/static/assets/img/hero.jpg');\n"
+                                  b"fetch('assets/data/makes.json?v=2');\n"),
+            ('assets/img/hero.jpg', b'\xff\xd8' * 10),
+            ('assets/data/makes.json', b'[]'),
+        ]:
+            path = os.path.join(source.name, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+        override = override_settings(STATICFILES_DIRS=[source.name], STATIC_ROOT=root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.root = root.name
+
+    def test_build_hashes_prunes_and_compresses(self):
+        out = StringIO()
+        with self.assertLogs('mywebsite.assets', 'WARNING') as logs:
+            call_command('build_static', '--report', '/', stdout=out)
+        self.assertIn('missing file missing.png', logs.output[0])
+
+        hashed = staticfiles_storage.stored_name('assets/css/style.css')
+        self.assertRegex(hashed, r'^assets/css/style\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(self.root, hashed)) as f:
+            css = f.read()
+        # Existing targets are hashed, missing ones left alone
+        self.assertRegex(css, r'url\("?\.\./fonts/icons\.[0-9a-f]{12}\.woff"?\)')
+        self.assertIn('url(missing.png)', css)
+        self.assertTrue(os.path.exists(os.path.join(self.root, hashed + '.gz')))
+        # Only referenced by nothing
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'assets/img/unused.png')))
+        self.assertEqual(staticfiles_storage.stored_name('assets/img/unused.png'), 'assets/img/unused.png')
+        # Referenced only from a script
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'assets/img/hero.jpg')))
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'assets/data/makes.json')))
+        self.assertIn('Saved', out.getvalue())
+
+    def test_serve_picks_precompressed_variant(self):
+        with self.assertLogs('mywebsite.assets', 'WARNING'):
+            call_command('build_static', stdout=StringIO())
+        url = static('assets/css/style.css')
+        with open(os.path.join(self.root, url.removeprefix('/static/')), 'rb') as f:
+            collected = f.read()
+
+        response = self.client.get(url, headers={'accept-encoding': 'gzip, br;q=0'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), collected)
+
+        response = self.client.get('/static/assets/css/style.css', headers={'accept-encoding': 'identity'})
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(self.client.get('/static/../manage.py').status_code, 404)
+
+
+# Bulk media re-optimization
+class OptimizeMediaTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.root = media.name
+
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        exif[ExifTags.Base.Make] = 'Camera'
+        self.save('car_images/rotated.jpeg', Image.new('RGB', (3000, 1000), 'red'), 'JPEG', exif=exif, quality=95)
+        self.save('car_images/small.jfif', Image.new('RGB', (40, 30), 'blue'), 'JPEG')
+        self.save('brand_logos/logo.png', Image.new('RGBA', (50, 20), (0, 0, 0, 0)), 'PNG')
+
+        car = create_cars(1)[0]
+        self.rotated = CarImage.objects.create(car=car, image='car_images/rotated.jpeg')
+        self.small = CarImage.objects.create(car=car, image='car_images/small.jfif')
+        Brand.objects.filter(pk=car.brand_id).update(logo='brand_logos/logo.png')
+
+    def save(self, name, img, fmt, **params):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        img.save(path, fmt, **params)
+
+    def assertOptimized(self):
+        self.small.refresh_from_db()
+        self.assertEqual(self.small.image.name, 'car_images/small.jpg')
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'car_images/small.jfif')))
+
+        with Image.open(os.path.join(self.root, 'car_images/rotated.jpeg')) as img:
+            self.assertEqual(img.size, (400, 1200))
+            self.assertTrue(img.info.get('progressive'))
+            self.assertEqual(len(img.getexif()), 0)
+        with Image.open(os.path.join(self.root, 'brand_logos/logo.png')) as img:
+            self.assertEqual(img.mode, 'RGBA')
+        self.assertFalse(any(entry['state'] == optimize.PENDING for entry in self.manifest().values()))
+
+    def manifest(self):
+        return optimize.Manifest(os.path.join(self.root, '.optimize-manifest.jsonl')).load().entries
+
+    def test_optimizes_once(self):
+        totals = optimize.run(workers=1, max_size=1200)
+
+        self.assertEqual(totals['files'], 3)
+        self.assertEqual(totals['renamed'], 1)
+        self.assertLess(totals['bytes'], totals['source_bytes'])
+        self.assertOptimized()
+
+        totals = optimize.run(workers=1, max_size=1200)
+        self.assertEqual((totals['unchanged'], totals['optimized']), (3, 0))
+
+    def test_interrupted_run_resumes(self):
+        with mock.patch.object(optimize, '_rename_references', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                optimize.run(workers=1, max_size=1200)
+        pending = [entry for entry in self.manifest().values() if entry['state'] == optimize.PENDING]
+        self.assertEqual(len(pending), 1)
+
+        optimize.run(workers=1, max_size=1200)
+
+        self.assertOptimized()
+        names = os.listdir(os.path.join(self.root, 'car_images'))
+        self.assertEqual(sorted(names), ['rotated.jpeg', 'small.jpg'])
+
+
+# Car card fragment cache
+class CardCacheTests(TestCase):
+    def setUp(self):
+        self.sale, self.rental = create_cars(2)
+        CarRental.objects.create(car=self.rental, daily_rate=Decimal('5000'))
+
+    def listing(self):
+        return list(Car.objects.select_related(
+            'brand', 'car_model', 'location', 'rental_info', 'primary_image'
+        ).order_by('pk'))
+
+    def render_counting(self, cars):
+        template = get_template(cards.VARIANTS['list'])
+        with mock.patch.object(type(template), 'render', autospec=True, side_effect=template.render.__func__) as render:
+            html = cards.render_cards(cars, 'list')
+        return html, render.call_count
+
+    def test_cards_are_rendered_once_per_change(self):
+        html, rendered = self.render_counting(self.listing())
+        self.assertEqual(rendered, 2)
+        self.assertIn('KES 1,500,000.00', html)
+        self.assertIn('KES 5,000', html)
+        self.assertEqual(self.render_counting(self.listing()), (html, 0))
+
+        self.sale.price = Decimal('1750000')
+        self.sale.save()
+        rental = self.rental.rental_info
+        rental.daily_rate = Decimal('6500')
+        rental.save()
+        html, rendered = self.render_counting(self.listing())
+        self.assertEqual(rendered, 2)
+        self.assertIn('KES 1,750,000', html)
+        self.assertIn('KES 6,500', html)
+
+        Brand.objects.filter(pk=self.sale.brand_id).update(name='Toyota Motors')
+        reference.invalidate()
+        html, rendered = self.render_counting(self.listing())
+        self.assertEqual(rendered, 2)
+        self.assertIn('Toyota Motors Corolla', html)
+
+    def test_pages_render_cached_cards(self):
+        for url in (reverse('car_list'), reverse('homepage')):
+            response = self.client.get(url)
+            self.assertContains(response, 'class="car__item"', count=2)
+            self.assertContains(response, reverse('car_detail', args=[self.sale.slug]))
+
+
+# Sitemaps and feeds
+@mock.patch.object(sitemaps, 'SHARD_SIZE', 2)
+class SitemapTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cars = create_cars(5)
+
+    def number(self, car):
+        return (car.pk - 1) // sitemaps.SHARD_SIZE + 1
+
+    def shard(self, number, **headers):
+        response = self.client.get(reverse('sitemap_cars', args=[number]), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        if response.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        return response, content.decode()
+
+    def test_index_lists_a_shard_per_id_block(self):
+        numbers = sorted({self.number(car) for car in self.cars})
+        response = self.client.get(reverse('sitemap'))
+        self.assertContains(response, 'http://testserver/sitemap-pages.xml')
+        self.assertContains(response, '<sitemap>', count=len(numbers) + 1)
+        for number in numbers:
+            self.assertContains(response, f'http://testserver/sitemap-cars-{number}.xml')
+        self.assertEqual(self.client.get(reverse('sitemap_cars', args=[numbers[-1] + 1])).status_code, 404)
+
+        response, content = self.shard(self.number(self.cars[0]))
+        self.assertTrue(response.streaming)
+        # Later requests may get the cached gzip, so shared caches must vary
+        self.assertIn('Accept-Encoding', response['Vary'])
+        for car in self.cars:
+            self.assertEqual(f'<loc>http://testserver/cars/{car.slug}/</loc>' in content,
+                             self.number(car) == self.number(self.cars[0]))
+
+    def test_only_changed_shards_are_regenerated(self):
+        numbers = sorted({self.number(car) for car in self.cars})
+        for number in numbers:
+            self.shard(number)
+        with self.assertNumQueries(0):
+            response, cached = self.shard(numbers[0], accept_encoding='gzip')
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(cached, self.shard(numbers[0])[1])
+
+        car = self.cars[2]
+        car.status = 'sold'
+        car.save()
+        for number in numbers:
+            response, content = self.shard(number)
+            self.assertEqual(response.streaming, number == self.number(car))
+            self.assertNotIn(f'/cars/{car.slug}/', content)
+
+        Car.objects.filter(pk=self.cars[0].pk).update(status='sold')
+        conditional.invalidate()
+        out = StringIO()
+        call_command('build_sitemaps', '--base-url', 'http://testserver/', stdout=out)
+        self.assertIn('Total sitemap shards regenerated: 1', out.getvalue())
+        self.assertIn(f'{len(numbers) - 1} shards unchanged', out.getvalue())
+
+    def test_slugify_cars_updates_the_shards(self):
+        number = self.number(self.cars[0])
+        Car.objects.filter(pk=self.cars[0].pk).update(slug=None)
+        conditional.invalidate()
+        before = sitemaps.shard_signatures()[number - 1]
+        self.assertNotIn(f'/cars/{self.cars[0].slug}/', self.shard(number)[1])
+
+        call_command('slugify_cars', stdout=StringIO())
+        car = Car.objects.get(pk=self.cars[0].pk)
+        self.assertGreater(car.updated_at, self.cars[0].updated_at)
+        self.assertEqual(sitemaps.shard_signatures()[number - 1], (before[0] + 1, car.updated_at))
+        response, content = self.shard(number)
+        self.assertTrue(response.streaming)
+        self.assertIn(f'<loc>http://testserver/cars/{car.slug}/</loc><lastmod>', content)
+
+    def test_shard_revalidates(self):
+        url = reverse('sitemap_cars', args=[self.number(self.cars[0])])
+        etag = self.client.get(url)['ETag']
+        # A change in another shard keeps this one's ETag
+        self.cars[4].save()
+        self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 304)
+        self.cars[0].save()
+        self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 200)
+
+    def test_feeds_and_robots(self):
+        for name in ('car_feed', 'car_feed_atom'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, f'http://testserver/cars/{self.cars[0].slug}/')
+            self.assertContains(response, 'KES 1,500,000')
+            response = self.client.get(reverse(name), headers={'if-none-match': response['ETag']})
+            self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(reverse('robots_txt'))
+        self.assertContains(response, 'Sitemap: http://testserver/sitemap.xml')
+        self.assertContains(response, 'Disallow: /*per_page=all')
+
+
+# Streaming exports
+class ExportTests(TestCase):
+    # A floor far below a development machine, to catch per-row queries
+    # or quadratic buffering rather than to benchmark
+    MIN_ROWS_PER_SEC = 2000
+
+    def setUp(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+    def export_action(self, model, action, data):
+        url = reverse(f'admin:mywebsite_{model}_changelist')
+        response = self.client.post(url + data.pop('query', ''), dict(data, action=action, index=0))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_car_csv_follows_the_changelist_filters(self):
+        available = create_cars(2)
+        CarRental.objects.create(car=available[1], daily_rate=Decimal('5000'))
+        sold = create_cars(1, status='sold')[0]
+
+        content = self.export_action('car', 'export_csv', {
+            'query': '?status__exact=available', 'select_across': 1, '_selected_action': [available[0].pk],
+        })
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(sorted(int(row['id']) for row in rows), [car.pk for car in available])
+        self.assertNotIn(str(sold.pk), [row['id'] for row in rows])
+        by_id = {int(row['id']): row for row in rows}
+        self.assertEqual(by_id[available[0].pk]['brand'], 'Toyota')
+        self.assertEqual(by_id[available[0].pk]['rental_daily_rate'], '')
+        self.assertEqual(by_id[available[1].pk]['rental_daily_rate'], '5000.00')
+
+    def test_inquiry_jsonl_exports_the_selected_rows(self):
+        car = create_cars(1)[0]
+        inquiries = [
+            CustomerInquiry.objects.create(
+                car=car if i else None, inquiry_type='purchase', customer_name=f'Jane {i}',
+                customer_phone='0700000000', message='Is it\navailable?'
+            )
+            for i in range(3)
+        ]
+        content = self.export_action('customerinquiry', 'export_jsonl', {
+            '_selected_action': [inquiries[0].pk, inquiries[2].pk],
+        })
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual({row['id'] for row in rows}, {inquiries[0].pk, inquiries[2].pk})
+        by_id = {row['id']: row for row in rows}
+        self.assertIsNone(by_id[inquiries[0].pk]['car_brand'])
+        self.assertEqual(by_id[inquiries[2].pk]['car_model'], 'Corolla')
+        self.assertEqual(by_id[inquiries[2].pk]['message'], 'Is it\navailable?')
+
+    def test_csv_escapes_spreadsheet_formulas(self):
+        formulas = ['=HYPERLINK("http://example.com")', '+1+cmd|calc', '-2+3', '@SUM(A1)', '\tx', '\r=1']
+        for name in formulas:
+            CustomerInquiry.objects.create(inquiry_type='purchase', customer_name=name, customer_phone='0700000000')
+        CustomerInquiry.objects.create(inquiry_type='purchase', customer_name='Jane', customer_phone='+254 700 000000')
+
+        content = ''.join(exports.EXPORTS['inquiries'].stream(format='csv'))
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertCountEqual([row['customer_name'] for row in rows], ["'" + name for name in formulas] + ['Jane'])
+        # Phone numbers are kept as they are
+        self.assertIn('+254 700 000000', [row['customer_phone'] for row in rows])
+
+        content = ''.join(exports.EXPORTS['inquiries'].stream(format='jsonl'))
+        names = [json.loads(line)['customer_name'] for line in content.splitlines()]
+        self.assertCountEqual(names, formulas + ['Jane'])
+
+    def test_command_filters_and_one_query_per_export(self):
+        NewsletterSubscription.objects.bulk_create(
+            NewsletterSubscription(email=f'reader{i}@example.com', is_active=i % 2 == 0) for i in range(10)
+        )
+        with mock.patch.object(exports, 'CHUNK_SIZE', 3), self.assertNumQueries(1):
+            chunks = list(exports.EXPORTS['subscribers'].stream(format='jsonl'))
+        self.assertEqual(len(chunks), 4)
+
+        out, err = StringIO(), StringIO()
+        call_command('export_data', 'subscribers', '--filter', 'is_active=True', stdout=out, stderr=err)
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(all(row['is_active'] == 'True' for row in rows))
+        self.assertIn('Total subscribers exported: 5', err.getvalue())
+
+    def test_throughput_and_flat_memory(self):
+        NewsletterSubscription.objects.bulk_create(
+            NewsletterSubscription(email=f'reader{i}@example.com') for i in range(4000)
+        )
+        with mock.patch.object(exports, 'CHUNK_SIZE', 200):
+            small = benchmarks.export_throughput(
+                'subscribers', 'csv', NewsletterSubscription.objects.filter(pk__lte=400))
+            large = benchmarks.export_throughput('subscribers', 'csv')
+        self.assertEqual(large['rows'], 4000)
+        self.assertGreaterEqual(large['rows_per_sec'], self.MIN_ROWS_PER_SEC)
+        # Ten times the rows, about the same memory
+        self.assertLess(large['peak_kb'], small['peak_kb'] * 2)
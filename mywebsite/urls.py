@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import conditional, feeds, views
 
 
 urlpatterns = [
@@ -9,7 +9,15 @@ urlpatterns = [
     path('cars/list' , views.car_list , name="car_list"),
     # AJAX endpoints
     path('ajax/models-by-brand/', views.get_models_by_brand, name='models_by_brand'),
+    path('catalog/<str:digest>.json', views.catalog_json, name='catalog'),
     path('ajax/car-detail/<int:car_id>/', views.car_detail_ajax, name='car_detail_ajax'),
     path('ajax/submit-inquiry/', views.submit_inquiry, name='submit_inquiry'),
     path('ajax/newsletter-subscribe/', views.newsletter_subscribe, name='newsletter_subscribe'),
+    # Crawlers and feed readers
+    path('robots.txt', views.robots_txt, name='robots_txt'),
+    path('sitemap.xml', views.sitemap_index, name='sitemap'),
+    path('sitemap-pages.xml', views.sitemap_pages, name='sitemap_pages'),
+    path('sitemap-cars-<int:number>.xml', views.sitemap_cars, name='sitemap_cars'),
+    path('feeds/cars.rss', conditional.conditional_view(conditional.car_feed_etag)(feeds.LatestCarsFeed()), name='car_feed'),
+    path('feeds/cars.atom', conditional.conditional_view(conditional.car_feed_etag)(feeds.LatestCarsAtomFeed()), name='car_feed_atom'),
 ]
\ No newline at end of file
@@ -1,5 +1,12 @@
-from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+import gzip
+from copy import copy
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.db.models import Q, Count, Min, Max
 from django.core.paginator import Paginator
 from django.contrib import messages
@@ -9,240 +16,128 @@ from .models import (
     Car, Brand, CarModel, Location, CarImage, CarRental, 
     CustomerInquiry, BusinessConfig, Testimonial, BlogPost, FAQ
 )
+from . import assets, catalog, conditional, fulltext, ingest, reference, sitemaps, stats
+from .facets import facet_index, Cursor
+from .homepage import get_homepage_data
 
 def homepage(request):
     """
     Homepage view that displays car listings, search functionality,
     and business information for the car dealership.
-    """
-    
-    # Get business configuration
-    try:
-        business_config = BusinessConfig.objects.first()
-    except BusinessConfig.DoesNotExist:
-        business_config = None
-    
-    # Get available cars for display
-    available_cars = Car.objects.filter(
-        status='available'
-    ).select_related(
-        'brand', 'car_model', 'location'
-    ).prefetch_related('images')
-    
-    # Get featured cars (limit to 8 for homepage display)
-    featured_cars = list(available_cars.filter(is_featured=True)[:8])
-    
-    # If not enough featured cars, fill with recent cars
-    if len(featured_cars) < 8:
-        featured_car_ids = [car.id for car in featured_cars]
-        additional_cars = list(available_cars.exclude(
-            id__in=featured_car_ids
-        ).order_by('-created_at')[:8 - len(featured_cars)])
-        
-        # Combine featured and additional cars
-        homepage_cars = featured_cars + additional_cars
-    else:
-        homepage_cars = featured_cars
-    
-    # Separate cars for sale and rent
-    cars_for_sale = []
-    cars_for_rent = []
-    
-    for car in homepage_cars:
-        # Check if car has rental info
-        try:
-            if hasattr(car, 'rental_info') and car.rental_info:
-                cars_for_rent.append(car)
-            else:
-                cars_for_sale.append(car)
-        except CarRental.DoesNotExist:
-            cars_for_sale.append(car)
-    
-    # Get filter options for search forms
-    # Years (from cars in database)
-    years = list(Car.objects.values_list('year', flat=True).distinct().order_by('-year'))
-    
-    # Fix the brand filter - use correct relationship
-    brands = Brand.objects.filter(
-        car__status='available'  # Use 'car' instead of 'car_set' since you have brand FK on Car model
-    ).distinct().order_by('name')
-    
-    # Get popular models (with car count)
-    popular_models = CarModel.objects.filter(
-        car__status='available'
-    ).annotate(
-        car_count=Count('car')
-    ).order_by('-car_count')[:10]
-    
-    # Price range for available cars
-    price_range = Car.objects.filter(status='available').aggregate(
-        min_price=Min('price'),
-        max_price=Max('price')
-    )
-    
-    # Get locations with available cars
-    locations = Location.objects.filter(
-        car__status='available',
-        is_active=True
-    ).distinct().order_by('county', 'name')
-    
-    # Get testimonials for homepage
-    testimonials = Testimonial.objects.filter(
-        is_approved=True,
-        is_featured=True
-    ).order_by('-created_at')[:3]
-    
-    # Get latest blog posts
-    latest_posts = BlogPost.objects.filter(
-        is_published=True,
-        published_at__lte=timezone.now()
-    ).order_by('-published_at')[:3]
-    
-    # Car statistics for display
-    car_stats = {
-        'total_cars': available_cars.count(),
-        'cars_for_sale': Car.objects.filter(
-            status='available'
-        ).exclude(
-            id__in=Car.objects.filter(rental_info__isnull=False).values_list('id', flat=True)
-        ).count(),
-        'cars_for_rent': Car.objects.filter(
-            status='available', 
-            rental_info__isnull=False
-        ).count(),
-        'total_brands': brands.count(),
-    }
-    
-    # Process search if GET parameters are present
-    search_results = None
-    if request.GET.get('search'):
-        # You'll need to implement this function
-        # search_results = process_car_search(request)
-        pass
     
-    # Debug information - remove this in production
-    print(f"Total available cars: {available_cars.count()}")
-    print(f"Featured cars: {len(featured_cars)}")
-    print(f"Homepage cars: {len(homepage_cars)}")
-    print(f"Cars for sale: {len(cars_for_sale)}")
-    print(f"Cars for rent: {len(cars_for_rent)}")
+    The page data is served from the cached bundle in mywebsite.homepage,
+    which is invalidated by model signals when the underlying rows change.
+    """
+    context = dict(get_homepage_data())
     
-    context = {
-        'business_config': business_config,
-        'homepage_cars': homepage_cars,
-        'cars_for_sale': cars_for_sale,
-        'cars_for_rent': cars_for_rent,
-        'years': years,
-        'brands': brands,
-        'popular_models': popular_models,
-        'locations': locations,
-        'price_range': price_range,
-        'testimonials': testimonials,
-        'latest_posts': latest_posts,
-        'car_stats': car_stats,
-        'search_results': search_results,
-    }
+    # homepage.html doesn't render search results yet, so a search
+    # (?search=1) isn't run; process_car_search() is ready for when it does
+    context['search_results'] = None
     
     return render(request, 'homepage.html', context)
 
 
+def _int_param(value):
+    """
+    Parse an integer query parameter, returning None when missing or invalid
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float_param(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
 def process_car_search(request):
     """
-    Process car search based on form parameters
+    Process car search based on form parameters.
+
+    Answered from the facet index: returns a FacetResult holding the ordered
+    matching car ids and per-facet counts. Use ``result.page(number, per_page)``
+    to load the cars for one page.
     """
-    cars = Car.objects.filter(status='available').select_related(
-        'brand', 'car_model', 'location'
-    ).prefetch_related('images')
-    
-    # Filter by year
-    year = request.GET.get('year')
-    if year:
-        cars = cars.filter(year=year)
-    
-    # Filter by brand
-    brand_id = request.GET.get('brand')
-    if brand_id:
-        cars = cars.filter(brand_id=brand_id)
+    filters = {
+        'status': 'available',
+        'year': _int_param(request.GET.get('year')),
+        'brand': _int_param(request.GET.get('brand')),
+        'model': _int_param(request.GET.get('model')),
+        'location': _int_param(request.GET.get('location')),
+        'fuel_type': request.GET.get('fuel_type'),
+        'transmission': request.GET.get('transmission'),
+    }
     
-    # Filter by model
-    model_id = request.GET.get('model')
-    if model_id:
-        cars = cars.filter(car_model_id=model_id)
+    # Filter by car type (rental or sale)
+    car_type = request.GET.get('car_type')
+    if car_type in ('rental', 'sale'):
+        filters['listing'] = car_type
     
     # Filter by mileage (assuming it's maximum mileage in thousands)
-    mileage = request.GET.get('mileage')
-    if mileage:
-        try:
-            max_mileage = int(mileage) * 1000  # Convert to actual mileage
-            cars = cars.filter(mileage__lte=max_mileage)
-        except ValueError:
-            pass
+    max_mileage = _int_param(request.GET.get('mileage'))
+    if max_mileage is not None:
+        max_mileage *= 1000  # Convert to actual mileage
     
-    # Filter by price range
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    
-    if min_price:
-        try:
-            cars = cars.filter(price__gte=float(min_price))
-        except ValueError:
-            pass
-    
-    if max_price:
-        try:
-            cars = cars.filter(price__lte=float(max_price))
-        except ValueError:
-            pass
-    
-    # Filter by location
-    location_id = request.GET.get('location')
-    if location_id:
-        cars = cars.filter(location_id=location_id)
-    
-    # Filter by fuel type
-    fuel_type = request.GET.get('fuel_type')
-    if fuel_type:
-        cars = cars.filter(fuel_type=fuel_type)
-    
-    # Filter by transmission
-    transmission = request.GET.get('transmission')
-    if transmission:
-        cars = cars.filter(transmission=transmission)
-    
-    # Search by keyword (searches in brand name, model name, and description)
+    # Search by keyword (full-text over brand, model, description and features)
+    candidates = None
+    sort = '-created_at'
     keyword = request.GET.get('keyword')
     if keyword:
-        cars = cars.filter(
-            Q(brand__name__icontains=keyword) |
-            Q(car_model__name__icontains=keyword) |
-            Q(description__icontains=keyword) |
-            Q(features__icontains=keyword)
-        )
-    
-    # Filter by car type (rental or sale)
-    car_type = request.GET.get('car_type')
-    if car_type == 'rental':
-        cars = cars.filter(rental_info__isnull=False)
-    elif car_type == 'sale':
-        cars = cars.filter(rental_info__isnull=True)
-    
-    return cars.order_by('-created_at')
+        candidates = fulltext.search_ids(keyword)
+        sort = 'relevance'
+    
+    return facet_index.search(
+        filters,
+        min_price=_float_param(request.GET.get('min_price')),
+        max_price=_float_param(request.GET.get('max_price')),
+        max_mileage=max_mileage,
+        candidates=candidates,
+        sort=sort,
+    )
 
 
-def get_models_by_brand(request):
+@conditional.conditional_view(conditional.models_by_brand_etag)
+async def get_models_by_brand(request):
     """
-    AJAX view to get car models based on selected brand
+    AJAX view to get car models based on selected brand. The search forms
+    use the catalog bundle (catalog_json); this is their fallback.
     """
-    brand_id = request.GET.get('brand_id')
+    brand_id = _int_param(request.GET.get('brand_id'))
     models = []
     
     if brand_id:
-        models = list(
-            CarModel.objects.filter(brand_id=brand_id).values('id', 'name')
-        )
+        models = [
+            {'id': model.id, 'name': model.name}
+            for model in await reference.acar_models(brand_id)
+        ]
     
     return JsonResponse({'models': models})
 
+
+# Long enough to count as "forever" for browsers and proxies
+CATALOG_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def catalog_json(request, digest):
+    """
+    The content-hashed brand/model catalog (see mywebsite.catalog)
+    """
+    current = catalog.current()
+    if digest != current.digest:
+        # An outdated (or not yet seen) version; point at the current one
+        response = redirect('catalog', digest=current.digest)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    response = HttpResponse(current.content, content_type='application/json')
+    patch_cache_control(response, public=True, max_age=CATALOG_MAX_AGE, immutable=True)
+    return response
+
+
 from django.shortcuts import render
 from django.core.paginator import Paginator
 from django.db.models import Min, Max
@@ -255,100 +150,169 @@ from django.core.paginator import Paginator
 from django.db.models import Min, Max, Q
 from .models import Car, Brand, CarModel, BusinessConfig
 
+
+# Sitemaps (see mywebsite.sitemaps)
+
+SITEMAP_CONTENT_TYPE = 'application/xml; charset=utf-8'
+
+
+def _base_url(request):
+    return request.build_absolute_uri('/').rstrip('/')
+
+
+@conditional.conditional_view(conditional.sitemap_etag)
+def sitemap_index(request):
+    return HttpResponse(sitemaps.index(_base_url(request)), content_type=SITEMAP_CONTENT_TYPE)
+
+
+def sitemap_pages(request):
+    return HttpResponse(sitemaps.pages(_base_url(request)), content_type=SITEMAP_CONTENT_TYPE)
+
+
+@conditional.conditional_view(sitemaps.shard_etag)
+def sitemap_cars(request, number):
+    """
+    One car shard: from the cache, or streamed while it is regenerated
+    """
+    signature = sitemaps.shard_signatures().get(number - 1)
+    if signature is None:
+        raise Http404
+    base_url = _base_url(request)
+    cached = sitemaps.cached_shard(base_url, number - 1, signature)
+    if cached is None:
+        response = StreamingHttpResponse(
+            sitemaps.stream_shard(base_url, number - 1, signature), content_type=SITEMAP_CONTENT_TYPE
+        )
+    elif 'gzip' in assets.accepted_encodings(request):
+        response = HttpResponse(cached, content_type=SITEMAP_CONTENT_TYPE)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(cached), content_type=SITEMAP_CONTENT_TYPE)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+def robots_txt(request):
+    lines = [
+        'User-agent: *',
+        'Disallow: /admin/',
+        # The sitemap lists every car; the whole inventory on one page is
+        # the most expensive request we serve
+        'Disallow: /*per_page=all',
+        f'Sitemap: {_base_url(request)}{reverse("sitemap")}',
+    ]
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain')
+
+
+# Largest page car_list will render, including per_page=all
+CAR_LIST_MAX_PER_PAGE = 60
+
+
+def _cursor_url(request, cursor):
+    """
+    Current query string with the cursor replaced (and page dropped)
+    """
+    params = request.GET.copy()
+    params.pop('page', None)
+    params['cursor'] = cursor.encode()
+    return '?' + params.urlencode()
+
+
+@conditional.conditional_view(conditional.car_list_etag)
 def car_list(request):
-    # Get all distinct values for filters
-    brands = Brand.objects.all().order_by('name')
-    models = CarModel.objects.all().order_by('name')
+    # Filter dropdowns come from the in-process reference cache
+    brands = reference.brands()
+    models = reference.car_models()
     
     # Get choices from Car model
     conditions = Car._meta.get_field('condition').choices
     transmissions = Car._meta.get_field('transmission').choices
     fuel_types = Car._meta.get_field('fuel_type').choices
     
-    # Get price range
-    price_range = Car.objects.aggregate(
-        min_price=Min('price'),
-        max_price=Max('price')
-    )
-    min_price = int(price_range['min_price'] or 0)
-    max_price = int(price_range['max_price'] or 10000000)
-    
-    # Start with all active cars - ADD PREFETCH_RELATED FOR IMAGES
-    cars = Car.objects.select_related(
-        'brand', 'car_model', 'location'
-    ).prefetch_related('images')  # This is the key addition!
+    # Price range over all cars, from the materialized stats
+    totals = stats.totals()
+    min_price = int(totals.min_price or 0)
+    max_price = int(totals.max_price or 10000000)
     
-    # Apply filters
+    # Facet filters are answered from the in-memory facet index
+    filters = {}
     brand_slug = request.GET.get('brand')
     if brand_slug:
-        cars = cars.filter(brand__slug=brand_slug)
-        # Update models queryset to only show models for selected brand
-        models = models.filter(brand__slug=brand_slug)
-    
-    model_id = request.GET.get('model')
-    if model_id:
-        cars = cars.filter(car_model__id=model_id)
-    
-    body_type = request.GET.get('body_type')
-    if body_type:
-        cars = cars.filter(car_model__body_type=body_type)
-    
-    condition = request.GET.get('condition')
-    if condition:
-        cars = cars.filter(condition=condition)
-    
-    transmission = request.GET.get('transmission')
-    if transmission:
-        cars = cars.filter(transmission=transmission)
-    
-    fuel_type = request.GET.get('fuel_type')
-    if fuel_type:
-        cars = cars.filter(fuel_type=fuel_type)
-    
-    # Price filter
-    min_price_filter = request.GET.get('min_price')
-    max_price_filter = request.GET.get('max_price')
-    
-    if min_price_filter:
-        try:
-            cars = cars.filter(price__gte=float(min_price_filter))
-        except ValueError:
-            pass
-    
-    if max_price_filter:
-        try:
-            cars = cars.filter(price__lte=float(max_price_filter))
-        except ValueError:
-            pass
-    
-    # Search query - FIXED Q IMPORT
+        brand = reference.get_brand(slug=brand_slug)
+        filters['brand'] = brand.id if brand else 0
+        # Only show models for the selected brand
+        models = reference.car_models(filters['brand'])
+    
+    filters['model'] = _int_param(request.GET.get('model'))
+    filters['body_type'] = request.GET.get('body_type')
+    filters['condition'] = request.GET.get('condition')
+    filters['transmission'] = request.GET.get('transmission')
+    filters['fuel_type'] = request.GET.get('fuel_type')
+    
+    # Search query narrows the candidates (BM25-ranked) before faceting
+    candidates = None
     search_query = request.GET.get('q')
     if search_query:
-        cars = cars.filter(
-            Q(brand__name__icontains=search_query) |
-            Q(car_model__name__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
+        candidates = fulltext.search_ids(search_query)
     
-    # Sorting
-    sort = request.GET.get('sort', '-created_at')
+    # Sorting - relevance is the default once a search query is given
+    sort = request.GET.get('sort', 'relevance' if search_query else '-created_at')
     valid_sorts = ['-created_at', 'created_at', 'price', '-price', 'year', '-year']
-    if sort in valid_sorts:
-        cars = cars.order_by(sort)
+    if search_query:
+        valid_sorts.append('relevance')
+    if sort not in valid_sorts:
+        sort = '-created_at'
+    
+    result = facet_index.search(
+        filters,
+        min_price=_float_param(request.GET.get('min_price')),
+        max_price=_float_param(request.GET.get('max_price')),
+        candidates=candidates,
+        sort=sort,
+    )
     
-    # Pagination
+    # Attach per-value counts for the filter dropdowns; the cached
+    # instances are shared, so the counts go on copies
+    brands = [copy(brand) for brand in brands]
+    for brand in brands:
+        brand.facet_count = result.counts['brand'].get(brand.id, 0)
+    models = [copy(model) for model in models]
+    for model in models:
+        model.facet_count = result.counts['model'].get(model.id, 0)
+    conditions = [(value, label, result.counts['condition'].get(value, 0)) for value, label in conditions]
+    transmissions = [(value, label, result.counts['transmission'].get(value, 0)) for value, label in transmissions]
+    fuel_types = [(value, label, result.counts['fuel_type'].get(value, 0)) for value, label in fuel_types]
+    
+    # Pagination - only the cars on the requested page are loaded.
+    # "All" is served as keyset (cursor) pages of CAR_LIST_MAX_PER_PAGE cars
+    # so a single response never materialises the whole inventory.
     per_page = request.GET.get('per_page', '9')
     if per_page == 'all':
-        paginator = Paginator(cars, cars.count())
+        per_page = CAR_LIST_MAX_PER_PAGE
+        cursor_mode = True
     else:
-        try:
-            per_page = int(per_page)
-        except ValueError:
+        per_page = _int_param(per_page)
+        if not per_page or per_page < 1:
             per_page = 9
-        paginator = Paginator(cars, per_page)
+        per_page = min(per_page, CAR_LIST_MAX_PER_PAGE)
+        cursor_mode = 'cursor' in request.GET
+    if sort == 'relevance':
+        cursor_mode = False
     
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_queryset = Car.objects.select_related(
+        'brand', 'car_model__brand', 'location', 'rental_info', 'primary_image'
+    )
+    
+    next_url = previous_url = None
+    if cursor_mode:
+        cursor = Cursor.decode(request.GET.get('cursor', ''), sort)
+        page_obj = result.cursor_page(cursor, per_page, queryset=page_queryset)
+        if page_obj.has_next():
+            next_url = _cursor_url(request, page_obj.next_cursor)
+        if page_obj.has_previous():
+            previous_url = _cursor_url(request, page_obj.previous_cursor)
+    else:
+        page_obj = result.page(request.GET.get('page'), per_page, queryset=page_queryset)
     
     context = {
         'cars': page_obj,
@@ -357,16 +321,21 @@ def car_list(request):
         'conditions': conditions,
         'transmissions': transmissions,
         'fuel_types': fuel_types,
+        'facet_counts': result.counts,
+        'total_count': result.count,
         'min_price': min_price,
         'max_price': max_price,
-        'is_paginated': page_obj.has_other_pages(),
+        'is_paginated': not cursor_mode and page_obj.has_other_pages(),
+        'cursor_mode': cursor_mode,
+        'next_url': next_url,
+        'previous_url': previous_url,
         'page_obj': page_obj,
-        'business_config': BusinessConfig.objects.first(),
     }
     
     return render(request, 'carlist.html', context)
 
 from django.db.models import Prefetch
+@conditional.conditional_view(conditional.car_detail_etag, not_modified=conditional.count_car_view)
 def car_detail(request, slug):
     # Get the car with related data in a single query
     car = get_object_or_404(
@@ -421,21 +390,28 @@ def car_detail(request, slug):
     return render(request, 'cars/car_detail.html', context)
 
 
-def car_detail_ajax(request, car_id):
+@conditional.conditional_view(
+    conditional.car_detail_ajax_etag,
+    conditional.car_detail_ajax_last_modified,
+    not_modified=conditional.count_quick_view,
+    load=conditional.load_quick_view,
+)
+async def car_detail_ajax(request, car_id):
     """
     AJAX view to get car details for quick view modals
     """
     try:
-        car = Car.objects.select_related(
-            'brand', 'car_model', 'location'
-        ).prefetch_related('images').get(id=car_id, status='available')
+        # rental_info is select_related so hasattr() below runs no query
+        car = await Car.objects.select_related(
+            'brand', 'car_model', 'location', 'primary_image', 'rental_info'
+        ).prefetch_related('images').aget(id=car_id, status='available')
         
-        # Increment view count
-        car.increment_views()
+        # Increment view count (a due flush runs in the background)
+        await car.aincrement_views()
         
-        # Get primary image
-        primary_image = car.images.filter(is_primary=True).first()
-        all_images = car.images.all().order_by('order', 'uploaded_at')
+        # Get primary image (denormalized on Car) and the prefetched gallery
+        primary_image = car.primary_image
+        all_images = car.images.all()
         
         # Check if car has rental info
         rental_info = None
@@ -478,51 +454,50 @@ def car_detail_ajax(request, car_id):
         return JsonResponse({'success': False, 'error': 'Car not found'})
 
 
-def submit_inquiry(request):
+async def submit_inquiry(request):
     """
-    Handle customer inquiry form submission
+    Handle customer inquiry form submission. The inquiry is validated and
+    spooled; mywebsite.ingest writes it to the database in the background.
     """
     if request.method == 'POST':
         try:
             # Get form data
-            car_id = request.POST.get('car_id')
-            inquiry_type = request.POST.get('inquiry_type', 'general')
-            customer_name = request.POST.get('customer_name')
-            customer_phone = request.POST.get('customer_phone')
-            customer_email = request.POST.get('customer_email', '')
-            message = request.POST.get('message')
-            preferred_contact = request.POST.get('preferred_contact', 'whatsapp')
+            car_id = _int_param(request.POST.get('car_id'))
+            fields = {
+                'car_id': car_id,
+                'inquiry_type': request.POST.get('inquiry_type', 'general'),
+                'customer_name': request.POST.get('customer_name'),
+                'customer_phone': request.POST.get('customer_phone'),
+                'customer_email': request.POST.get('customer_email', ''),
+                'message': request.POST.get('message'),
+                'preferred_contact_method': request.POST.get('preferred_contact', 'whatsapp'),
+            }
             
             # Validate required fields
-            if not all([customer_name, customer_phone, message]):
+            if not all([fields['customer_name'], fields['customer_phone'], fields['message']]):
                 return JsonResponse({
                     'success': False, 
                     'error': 'Please fill in all required fields'
                 })
+            try:
+                ingest.clean_inquiry(fields)
+            except ValidationError:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Please check the details you entered'
+                })
             
-            # Get car if specified
-            car = None
-            if car_id:
-                try:
-                    car = Car.objects.get(id=car_id)
-                except Car.DoesNotExist:
-                    pass
-            
-            # Create inquiry
-            inquiry = CustomerInquiry.objects.create(
-                car=car,
-                inquiry_type=inquiry_type,
-                customer_name=customer_name,
-                customer_phone=customer_phone,
-                customer_email=customer_email,
-                message=message,
-                preferred_contact_method=preferred_contact,
-            )
+            # Spool the inquiry (fsync'ed, off the event loop)
+            key = ingest.new_key(request.headers.get('Idempotency-Key'), fields)
+            await sync_to_async(ingest.submit, thread_sensitive=False)(ingest.INQUIRY, key, fields)
             
             # Generate WhatsApp message if business config exists
             whatsapp_url = None
             try:
-                business_config = BusinessConfig.objects.first()
+                business_config = await reference.abusiness_config()
+                car = None
+                if business_config and car_id:
+                    car = await Car.objects.select_related('brand', 'car_model').filter(id=car_id).afirst()
                 if business_config and car:
                     template = business_config.whatsapp_message_template
                     whatsapp_message = template.format(
@@ -539,7 +514,7 @@ def submit_inquiry(request):
             response_data = {
                 'success': True,
                 'message': 'Thank you for your inquiry! We will contact you soon.',
-                'inquiry_id': inquiry.id
+                'reference': key
             }
             
             if whatsapp_url:
@@ -556,9 +531,10 @@ def submit_inquiry(request):
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
 
-def newsletter_subscribe(request):
+async def newsletter_subscribe(request):
     """
-    Handle newsletter subscription
+    Handle newsletter subscription. The signup is spooled and written to the
+    database in the background (mywebsite.ingest).
     """
     if request.method == 'POST':
         email = request.POST.get('email')
@@ -566,32 +542,39 @@ def newsletter_subscribe(request):
         if not email:
             return JsonResponse({'success': False, 'error': 'Email is required'})
         
+        try:
+            ingest.clean_signup(email)
+        except ValidationError:
+            return JsonResponse({'success': False, 'error': 'Please enter a valid email address'})
+        
         try:
             from .models import NewsletterSubscription
-            subscription, created = NewsletterSubscription.objects.get_or_create(
-                email=email,
-                defaults={'is_active': True}
-            )
+            # A read only; the write is left to the flusher
+            is_active = await NewsletterSubscription.objects.filter(
+                email=email
+            ).values_list('is_active', flat=True).afirst()
+            
+            if is_active:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'This email is already subscribed'
+                })
             
-            if created:
+            fields = {'email': email}
+            key = ingest.new_key(request.headers.get('Idempotency-Key'), fields)
+            await sync_to_async(ingest.submit, thread_sensitive=False)(ingest.NEWSLETTER, key, fields)
+            
+            if is_active is None:
                 return JsonResponse({
                     'success': True,
                     'message': 'Thank you for subscribing to our newsletter!'
                 })
             else:
-                if subscription.is_active:
-                    return JsonResponse({
-                        'success': False,
-                        'error': 'This email is already subscribed'
-                    })
-                else:
-                    # Reactivate subscription
-                    subscription.is_active = True
-                    subscription.save()
-                    return JsonResponse({
-                        'success': True,
-                        'message': 'Welcome back! Your subscription has been reactivated.'
-                    })
+                # Reactivated when the flusher writes the signup
+                return JsonResponse({
+                    'success': True,
+                    'message': 'Welcome back! Your subscription has been reactivated.'
+                })
                     
         except Exception as e:
             return JsonResponse({
@@ -633,10 +616,7 @@ def get_whatsapp_url(car, business_config=None):
     Generate WhatsApp URL for car inquiry
     """
     if not business_config:
-        try:
-            business_config = BusinessConfig.objects.first()
-        except BusinessConfig.DoesNotExist:
-            return None
+        business_config = reference.business_config()
     
     if not business_config:
         return None
@@ -0,0 +1,95 @@
+/*  ---------------------------------------------------
+    Brand -> model dropdowns
+
+    Fills the model <select> named by a brand select's
+    data-models-target from the versioned catalog
+    (loaded once, cached by the browser for good).
+    Falls back to ajax/models-by-brand/ if the catalog
+    cannot be loaded.
+---------------------------------------------------------  */
+
+'use strict';
+
+(function ($) {
+
+    var script = $(document.currentScript);
+    var catalogUrl = script.data('catalog-url');
+    var fallbackUrl = script.data('fallback-url');
+    var catalog = null;
+
+    /*------------------
+        Catalog loading
+    --------------------*/
+    function loadCatalog() {
+        if (!catalog) {
+            catalog = $.ajax({ url: catalogUrl, dataType: 'json', cache: true }).then(function (data) {
+                var brands = {};
+                var models = {};
+                $.each(data.brands, function (i, brand) {
+                    brands[String(brand.id)] = brand;
+                    brands[brand.slug] = brand;
+                    models[brand.id] = [];
+                });
+                $.each(data.models, function (i, model) {
+                    if (models[model.brand]) {
+                        models[model.brand].push(model);
+                    }
+                });
+                return { brands: brands, models: models };
+            });
+        }
+        return catalog;
+    }
+
+    // Models for a brand option value (an id on the homepage, a slug on the car list)
+    function modelsFor(brandValue) {
+        return loadCatalog().then(function (data) {
+            var brand = data.brands[brandValue];
+            return brand ? data.models[brand.id] : [];
+        }, function () {
+            if (!/^\d+$/.test(brandValue)) {
+                return $.Deferred().reject();
+            }
+            return $.getJSON(fallbackUrl, { brand_id: brandValue }).then(function (data) {
+                return data.models;
+            });
+        });
+    }
+
+    /*------------------
+        Dropdowns
+    --------------------*/
+    function fillModels(select, models) {
+        var placeholder = select.find('option').first().clone();
+        select.empty().append(placeholder);
+        $.each(models, function (i, model) {
+            var label = model.count === undefined ? model.name : model.name + ' (' + model.count + ')';
+            select.append($('<option>').val(model.id).text(label));
+        });
+        if ($.fn.niceSelect) {
+            select.niceSelect('update');
+        }
+    }
+
+    $('select[data-models-target]').each(function () {
+        var brandSelect = $(this);
+        var modelSelect = $(brandSelect.data('models-target'));
+
+        brandSelect.on('change', function () {
+            var brandValue = brandSelect.val();
+            if (!brandValue) {
+                fillModels(modelSelect, []);
+                return;
+            }
+            modelsFor(brandValue).then(function (models) {
+                fillModels(modelSelect, models);
+            });
+        });
+
+        // Homepage forms start with an empty model list
+        if (brandSelect.val() && modelSelect.find('option').length <= 1) {
+            brandSelect.trigger('change');
+        }
+    });
+
+})(jQuery);
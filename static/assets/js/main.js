@@ -191,7 +191,9 @@
         var imgurl = $(this).data('imgbigurl');
         var bigImg = $('.car-big-img').attr('src');
         if (imgurl != bigImg) {
-            $('.car-big-img').attr({
+            // Drop the responsive sources so the picked image is shown
+            $('.car-big-img').siblings('source').remove();
+            $('.car-big-img').removeAttr('srcset').attr({
                 src: imgurl
             });
         }